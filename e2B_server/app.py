@@ -1,10 +1,41 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file, g
 from dotenv import load_dotenv
 from mistralai import Mistral
 from datetime import datetime
 import re
-from e2b import Sandbox
+import json
+import queue
+import threading
+import shutil
+import tempfile
+import uuid
+import time
+import httpx
+from werkzeug.datastructures import FileStorage
+from e2b import Sandbox, CommandExitException
+from sandbox_pool import SandboxPool
+from backends import E2BBackend, LocalBackend
+from dependencies import DependencyManager, DEFAULT_PACKAGES, normalize_package
+from imports import extract_imports, required_packages as packages_for_source
+from preflight import IncrementalSyntaxCheck, PreflightError, check as preflight_check, delta_text, repair_messages
+from pipeline import Pipeline, PipelineCancelled
+from optimization_cache import OptimizationCache, cache_key
+from sessions import SessionStore
+from jobs import JobQueue, QueueFull
+from reaper import SandboxReaper, kill_many
+from benchmark import benchmark_command, benchmark_report, describe as describe_benchmark, format_comparison
+from tournament import compare_outputs, leaderboard, output_digests
+from output_capture import OUTPUT_LOG_PATH, OutputRing, tee_command
+from response_format import encode_payload, requested_version
+from llm_gateway import LLMGateway, LLMUnavailable, retryable
+from routing import ModelRouter, PromptTooLarge, TokenCounter, parse_routes
+from chunking import chunk_problems, split_module
+from deadlines import CancellationWatch, Deadline, DeadlineExceeded, DeadlineSandbox, RunCancelled, client_socket
+from artifacts import ArtifactStore, collect_artifacts, DEFAULT_ARTIFACT_GLOBS
+from uploads import UploadRequest, upload_data_files
+from metrics import Registry, Trace, TracedSandbox, timed
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -15,10 +46,252 @@ MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 
 # Initialize Flask app
 app = Flask(__name__)
+# Uploads are spooled to disk and hashed while they are received
+app.request_class = UploadRequest
 port = 8000
 
-# Configure clients
-client = Mistral(api_key=MISTRAL_API_KEY)
+# Sandbox pool settings
+SANDBOX_POOL_MIN = int(os.getenv('SANDBOX_POOL_MIN', '2'))
+SANDBOX_POOL_MAX = int(os.getenv('SANDBOX_POOL_MAX', '10'))
+SANDBOX_MAX_AGE = int(os.getenv('SANDBOX_MAX_AGE', '1800'))
+SANDBOX_MAX_USES = int(os.getenv('SANDBOX_MAX_USES', '20'))
+SANDBOX_HEALTH_INTERVAL = int(os.getenv('SANDBOX_HEALTH_INTERVAL', '30'))
+SANDBOX_TIMEOUT = int(os.getenv('SANDBOX_TIMEOUT', '600'))
+
+# Local caches live next to the server unless overridden
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+# Dependency environment settings
+DEPENDENCY_CACHE_DIR = os.getenv('DEPENDENCY_CACHE_DIR', os.path.join(CACHE_DIR, 'envs'))
+PREWARM_DEPENDENCIES = os.getenv('PREWARM_DEPENDENCIES', 'true').lower() == 'true'
+
+# Optimization cache settings
+OPTIMIZATION_CACHE_PATH = os.getenv('OPTIMIZATION_CACHE_PATH', os.path.join(CACHE_DIR, 'optimizations.sqlite3'))
+OPTIMIZATION_CACHE_MEMORY_ENTRIES = int(os.getenv('OPTIMIZATION_CACHE_MEMORY_ENTRIES', '256'))
+OPTIMIZATION_CACHE_MAX_BYTES = int(os.getenv('OPTIMIZATION_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+OPTIMIZATION_CACHE_TTL = int(os.getenv('OPTIMIZATION_CACHE_TTL', str(7 * 24 * 3600)))
+# Stream the completion so code reaches clients early and broken output is cut off
+OPTIMIZATION_STREAMING = os.getenv('OPTIMIZATION_STREAMING', 'true').lower() == 'true'
+# How often the LLM is asked to fix code that fails the pre-flight checks
+OPTIMIZATION_REPAIR_ATTEMPTS = int(os.getenv('OPTIMIZATION_REPAIR_ATTEMPTS', '2'))
+# Large scripts are optimized in chunks of top-level definitions, several at once
+OPTIMIZATION_CHUNKING = os.getenv('OPTIMIZATION_CHUNKING', 'true').lower() == 'true'
+CHUNKING_MIN_TOKENS = int(os.getenv('CHUNKING_MIN_TOKENS', '3000'))
+CHUNK_TARGET_TOKENS = int(os.getenv('CHUNK_TARGET_TOKENS', '1200'))
+CHUNK_CONCURRENCY = int(os.getenv('CHUNK_CONCURRENCY', '8'))
+
+# Generated files matching these globs are collected after execution. Stored artifacts
+# and output logs expire after ARTIFACT_TTL seconds, oldest first above ARTIFACT_MAX_BYTES
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR', os.path.join(CACHE_DIR, 'artifacts'))
+ARTIFACT_GLOBS = [g.strip() for g in os.getenv('ARTIFACT_GLOBS', ','.join(DEFAULT_ARTIFACT_GLOBS)).split(',') if g.strip()]
+ARTIFACT_TTL = int(os.getenv('ARTIFACT_TTL', str(24 * 3600)))
+ARTIFACT_MAX_BYTES = int(os.getenv('ARTIFACT_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# A/B benchmark of the original against the optimized script, on request
+BENCHMARK_RUNS = int(os.getenv('BENCHMARK_RUNS', '5'))
+BENCHMARK_WARMUP = int(os.getenv('BENCHMARK_WARMUP', '1'))
+BENCHMARK_MAX_RUNS = int(os.getenv('BENCHMARK_MAX_RUNS', '30'))
+BENCHMARK_TIMEOUT = int(os.getenv('BENCHMARK_TIMEOUT', '900'))
+
+# Optimization tournaments: several candidates, verified against the original and raced
+TOURNAMENT_MAX_CANDIDATES = int(os.getenv('TOURNAMENT_MAX_CANDIDATES', '6'))
+TOURNAMENT_TEMPERATURES = [float(t) for t in os.getenv('TOURNAMENT_TEMPERATURES', '0.2,0.5,0.8,1.0').split(',') if t.strip()]
+TOURNAMENT_RUNS = int(os.getenv('TOURNAMENT_RUNS', '3'))
+
+# Script output: the server keeps the tail, the sandbox forwards and logs up to these caps
+OUTPUT_CAPTURE_CHARS = int(os.getenv('OUTPUT_CAPTURE_CHARS', str(64 * 1024)))
+OUTPUT_STREAM_MAX_BYTES = int(os.getenv('OUTPUT_STREAM_MAX_BYTES', str(8 * 1024 * 1024)))
+OUTPUT_LOG_MAX_BYTES = int(os.getenv('OUTPUT_LOG_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Responses smaller than this are sent uncompressed
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+
+# Deadlines. A run's sandbox commands and LLM calls share one budget (a request may ask
+# for a different one with the `deadline` field); each call also has its own cap
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '900'))
+REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv('REQUEST_DEADLINE_MAX_SECONDS', '3600'))
+COMMAND_TIMEOUT_SECONDS = float(os.getenv('COMMAND_TIMEOUT_SECONDS', '60'))
+EXECUTE_TIMEOUT_SECONDS = float(os.getenv('EXECUTE_TIMEOUT_SECONDS', '600'))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '120'))
+DISCONNECT_POLL_SECONDS = float(os.getenv('DISCONNECT_POLL_SECONDS', '1'))
+
+# Mistral gateway: one connection pool, retries, optional hedging and a circuit breaker
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '32'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', '3'))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+LLM_RETRY_MAX_BACKOFF = float(os.getenv('LLM_RETRY_MAX_BACKOFF', '8'))
+LLM_HEDGE = os.getenv('LLM_HEDGE', 'false').lower() == 'true'
+LLM_HEDGE_QUANTILE = float(os.getenv('LLM_HEDGE_QUANTILE', '0.95'))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+LLM_HTTP_LIMITS = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+
+# Model routing: `model:max_tokens[:max_complexity]` routes, first fit wins; prompts no
+# route accepts are refused. Tokens are counted with a tiktoken encoding or a tokenizer.json,
+# loaded at startup; the server waits up to ROUTING_TOKENIZER_TIMEOUT seconds for it
+MODEL_ROUTES = os.getenv('MODEL_ROUTES', 'mistral-small-latest:1500:15,mistral-large-latest:32000')
+ROUTING_TOKENIZER = os.getenv('ROUTING_TOKENIZER', 'cl100k_base')
+ROUTING_TOKENIZER_TIMEOUT = float(os.getenv('ROUTING_TOKENIZER_TIMEOUT', '30'))
+TIKTOKEN_CACHE_DIR = os.getenv('TIKTOKEN_CACHE_DIR', os.path.join(CACHE_DIR, 'tiktoken'))
+# tiktoken reads it from the environment and otherwise keeps the vocabulary in the temporary
+# directory; set here, once, before the tokenizer starts loading in the background
+os.environ['TIKTOKEN_CACHE_DIR'] = TIKTOKEN_CACHE_DIR
+
+# Data files sent to a sandbox at the same time
+DATA_UPLOAD_WORKERS = int(os.getenv('DATA_UPLOAD_WORKERS', '4'))
+
+# Threads shared by the stages of all in-flight pipelines
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '32'))
+
+# Seconds a step-by-step session keeps its sandbox without hearing from the client
+SESSION_TTL = int(os.getenv('SESSION_TTL', '900'))
+
+# Asynchronous job API settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_QUEUE_DEPTH = int(os.getenv('JOB_QUEUE_DEPTH', '50'))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', '3600'))
+
+# Sandbox cleanup settings
+SANDBOX_KILL_WORKERS = int(os.getenv('SANDBOX_KILL_WORKERS', '16'))
+SANDBOX_KILL_TIMEOUT = float(os.getenv('SANDBOX_KILL_TIMEOUT', '10'))
+SANDBOX_REAP_TTL = int(os.getenv('SANDBOX_REAP_TTL', '3600'))
+SANDBOX_REAP_IDLE = int(os.getenv('SANDBOX_REAP_IDLE', '900'))
+SANDBOX_REAP_INTERVAL = int(os.getenv('SANDBOX_REAP_INTERVAL', '300'))
+
+# Execution backend settings: 'e2b' for remote sandboxes, 'local' for local workspaces
+SANDBOX_BACKEND = os.getenv('SANDBOX_BACKEND', 'e2b')
+LOCAL_WORKSPACE_DIR = os.getenv('LOCAL_WORKSPACE_DIR', os.path.join(CACHE_DIR, 'workspaces'))
+LOCAL_CPU_SECONDS = int(os.getenv('LOCAL_CPU_SECONDS', '300'))
+LOCAL_MEMORY_MB = int(os.getenv('LOCAL_MEMORY_MB', '4096'))
+LOCAL_MAX_PROCESSES = int(os.getenv('LOCAL_MAX_PROCESSES', '32'))
+
+# Every sandbox is tagged with these so the reaper can tell ours apart
+SANDBOX_APP_NAME = 'openoperator'
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+def create_llm_gateway(mistral_client):
+    return LLMGateway(
+        mistral_client,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        queue_timeout=LLM_QUEUE_TIMEOUT,
+        retries=LLM_RETRIES,
+        backoff=LLM_RETRY_BACKOFF,
+        max_backoff=LLM_RETRY_MAX_BACKOFF,
+        hedge=LLM_HEDGE,
+        hedge_quantile=LLM_HEDGE_QUANTILE,
+        hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
+        breaker_failures=LLM_BREAKER_FAILURES,
+        breaker_cooldown=LLM_BREAKER_COOLDOWN
+    )
+
+# Configure clients. Every Mistral call, sync or async, goes through one gateway and a shared connection pool
+client = create_llm_gateway(Mistral(
+    api_key=MISTRAL_API_KEY,
+    client=httpx.Client(limits=LLM_HTTP_LIMITS, timeout=LLM_TIMEOUT_SECONDS),
+    async_client=httpx.AsyncClient(limits=LLM_HTTP_LIMITS, timeout=LLM_TIMEOUT_SECONDS)
+))
+
+if SANDBOX_BACKEND == 'local':
+    execution_backend = LocalBackend(
+        LOCAL_WORKSPACE_DIR,
+        cpu_seconds=LOCAL_CPU_SECONDS,
+        memory_mb=LOCAL_MEMORY_MB,
+        max_processes=LOCAL_MAX_PROCESSES
+    )
+elif SANDBOX_BACKEND == 'e2b':
+    execution_backend = E2BBackend(timeout=SANDBOX_TIMEOUT, kill_timeout=SANDBOX_KILL_TIMEOUT)
+else:
+    raise ValueError(f"Unknown SANDBOX_BACKEND: {SANDBOX_BACKEND}")
+
+dependency_manager = DependencyManager(DEPENDENCY_CACHE_DIR, owner=execution_backend.env_owner)
+optimization_cache = OptimizationCache(
+    OPTIMIZATION_CACHE_PATH,
+    memory_entries=OPTIMIZATION_CACHE_MEMORY_ENTRIES,
+    max_bytes=OPTIMIZATION_CACHE_MAX_BYTES,
+    ttl=OPTIMIZATION_CACHE_TTL
+)
+artifact_store = ArtifactStore(ARTIFACT_DIR, ttl=ARTIFACT_TTL, max_bytes=ARTIFACT_MAX_BYTES)
+model_router = ModelRouter(parse_routes(MODEL_ROUTES), TokenCounter(ROUTING_TOKENIZER))
+# Requests count with the estimate until the tokenizer is ready, never waiting for a download
+model_router.counter.load()
+
+def wait_for_tokenizer():
+    if not model_router.counter.load(ROUTING_TOKENIZER_TIMEOUT):
+        print(f"Tokenizer {ROUTING_TOKENIZER} is still loading after {ROUTING_TOKENIZER_TIMEOUT}s, "
+              f"estimating token counts until it is ready")
+
+
+# Metrics exposed at /metrics
+metrics = Registry()
+HTTP_SECONDS = metrics.histogram('openoperator_http_request_duration_seconds', 'HTTP request latency by endpoint')
+STAGE_SECONDS = metrics.histogram('openoperator_stage_duration_seconds', 'Pipeline stage latency')
+SANDBOX_CALL_SECONDS = metrics.histogram('openoperator_sandbox_call_duration_seconds', 'Latency of sandbox commands and file operations')
+LLM_SECONDS = metrics.histogram('openoperator_llm_request_duration_seconds', 'Mistral request latency')
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram('openoperator_llm_first_token_seconds', 'Time until the first streamed Mistral token')
+LLM_REJECTED = metrics.counter('openoperator_llm_rejected_total', 'Generated code rejected before execution')
+LLM_ROUTED = metrics.counter('openoperator_llm_routed_total', 'Scripts routed to each model, or refused as too large')
+PROMPT_TOKENS = metrics.histogram('openoperator_llm_prompt_tokens', 'Prompt size in tokens as counted by the router',
+                                  buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+RUNS_STOPPED = metrics.counter('openoperator_runs_stopped_total', 'Runs stopped early by a deadline or cancellation')
+RUNS_IN_FLIGHT = metrics.gauge('openoperator_runs_in_flight', 'Pipeline runs currently executing')
+HTTP_IN_FLIGHT = metrics.gauge('openoperator_http_requests_in_flight', 'HTTP requests currently being handled')
+metrics.callback('openoperator_sandbox_pool', 'Sandboxes owned by the pool by state',
+                 lambda: [({'state': state}, value) for state, value in sandbox_pool.stats().items()])
+metrics.callback('openoperator_optimization_cache', 'Optimization cache counters and sizes',
+                 lambda: [({'field': field}, value) for field, value in optimization_cache.stats().items()])
+metrics.callback('openoperator_llm_gateway', 'Mistral gateway counters, in-flight requests and circuit breaker state',
+                 lambda: [({'field': field}, value) for field, value in client.stats().items()])
+metrics.callback('openoperator_jobs', 'Job queue occupancy',
+                 lambda: [({'state': state}, value) for state, value in job_queue.stats().items()])
+metrics.callback('openoperator_step_sessions', 'Open step-by-step sessions',
+                 lambda: [({}, len(step_sessions))])
+
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+job_queue = JobQueue(workers=JOB_WORKERS, max_depth=JOB_QUEUE_DEPTH, retention=JOB_RETENTION)
+
+def create_sandbox():
+    return execution_backend.create({
+        'app': SANDBOX_APP_NAME,
+        'instance': INSTANCE_ID,
+        'created_at': datetime.utcnow().isoformat()
+    })
+
+def kill_sandbox(sandbox_id):
+    execution_backend.kill(sandbox_id)
+
+def prepare_sandbox(sandbox):
+    # Pooled sandboxes get the default environment before they are ever checked out
+    if PREWARM_DEPENDENCIES:
+        dependency_manager.ensure(sandbox, DEFAULT_PACKAGES)
+
+sandbox_pool = SandboxPool(
+    create_sandbox,
+    min_size=SANDBOX_POOL_MIN,
+    max_size=SANDBOX_POOL_MAX,
+    max_age=SANDBOX_MAX_AGE,
+    max_uses=SANDBOX_MAX_USES,
+    health_interval=SANDBOX_HEALTH_INTERVAL,
+    keepalive=SANDBOX_TIMEOUT,
+    reset_command=execution_backend.reset_command,
+    reset_user=execution_backend.reset_user,
+    on_create=prepare_sandbox
+)
+
+sandbox_reaper = SandboxReaper(
+    execution_backend.list,
+    kill_sandbox,
+    app_name=SANDBOX_APP_NAME,
+    instance_id=INSTANCE_ID,
+    is_tracked=sandbox_pool.is_pooled,
+    is_protected=sandbox_pool.is_pooled,
+    ttl=SANDBOX_REAP_TTL,
+    idle=SANDBOX_REAP_IDLE,
+    interval=SANDBOX_REAP_INTERVAL,
+    workers=SANDBOX_KILL_WORKERS
+)
 
 def ensure_directory_exists(sandbox, path):
     result = sandbox.commands.run(f'mkdir -p {os.path.dirname(path)}')
@@ -29,94 +302,7 @@ def ensure_directory_exists(sandbox, path):
     result = sandbox.commands.run(f'ls -la {os.path.dirname(path)}')
     print(f"Directory contents: {result.stdout}")
 
-@app.route('/execute', methods=['POST'])
-def execute_code():
-    try:
-        # Initialize sandbox
-        sandbox = Sandbox()
-        print('Sandbox created', sandbox.sandbox_id)
-        
-        # Initialize timeline events list
-        timeline_events = []
-        
-        # RESPONSE INITIALIZATION
-        response = {
-            'status': 'success',
-            'timeline_events': [],
-            'sandbox_id': sandbox.sandbox_id,
-            'generated_files': []
-        }
-
-        # Handle file upload
-        if 'python_file' not in request.files:
-            raise ValueError("No Python file uploaded")
-        
-        python_file = request.files['python_file']
-        if not python_file.filename.endswith('.py'):
-            raise ValueError("Invalid file type. Must be a .py file")
-        
-        # Read and store Python file
-        python_code = python_file.read().decode('utf-8')
-        sandbox.files.write('script.py', python_code)
-        
-        # Verify file was written
-        result = sandbox.commands.run('cat script.py')
-        print(f"File contents: {result.stdout}")
-        
-        timeline_events.append({
-            "step": "File Upload",
-            "status": "complete",
-            "details": f"Uploaded Python file: {python_file.filename}",
-            "color": "blue",
-            "input": python_code,
-            "output": result.stdout,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        })
-        
-        # Upload data files if present
-        data_files = request.files.getlist('data_files')
-        uploaded_data_files = []
-        if data_files:
-            sandbox.commands.run('mkdir -p data')
-            for data_file in data_files:
-                remote_path = f'data/{data_file.filename}'
-                sandbox.files.write(remote_path, data_file.read())
-                uploaded_data_files.append(remote_path)
-            
-            # List uploaded files for verification
-            result = sandbox.commands.run('ls -la data')
-            
-            timeline_events.append({
-                "step": "Data Upload",
-                "status": "complete",
-                "details": f"Uploaded data files: {', '.join([f.filename for f in data_files]) if data_files else 'No data files'}",
-                "color": "purple",
-                "input": str([f.filename for f in data_files]) if data_files else "No files",
-                "output": result.stdout if data_files else "No files uploaded",
-                "timestamp": datetime.now().strftime("%H:%M:%S")
-            })
-        
-        # Install dependencies
-        dependencies = ['pandas', 'numpy', 'matplotlib', 'scikit-learn', 'seaborn', 'requests']
-        install_command = 'pip install ' + ' '.join(dependencies) + ' --quiet'
-        result = sandbox.commands.run(install_command)
-        print("Installation output:", result.stdout)
-        
-        # Verify installations
-        verify_result = sandbox.commands.run('pip list | grep -E "pandas|numpy|matplotlib|scikit-learn|seaborn|requests"')
-        
-        timeline_events.append({
-            "step": "Dependencies",
-            "status": "complete",
-            "details": "Installed required packages",
-            "color": "orange",
-            "input": install_command,
-            "output": verify_result.stdout or "Installation completed silently",
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        })
-        
-        # Optimize code
-        system_prompt = """You are an expert Python programmer. Analyze and optimize the provided Python code for:
+SYSTEM_PROMPT = """You are an expert Python programmer. Analyze and optimize the provided Python code for:
         1. Better performance
         2. Better readability
         3. Better error handling
@@ -126,141 +312,1122 @@ def execute_code():
         
         Return only the optimized Python code without any markdown formatting, code blocks, or explanations."""
 
-        mistral_response = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": python_code}
+CHUNK_SYSTEM_PROMPT = """You are an expert Python programmer. You are given some definitions from a larger Python module, together with an outline of the rest of the module. Optimize only those definitions for:
+        1. Better performance
+        2. Better readability
+        3. Better error handling
+        4. Better data validation
+        
+        Keep the name and signature of every function and class, since the rest of the module uses them. Put any import the new code needs at the top of your answer.
+        
+        Return only the optimized definitions, without the outline, any other code, markdown formatting, code blocks, or explanations."""
+
+def route_chunks(plan):
+    """The routing decision for each chunk's prompt; a chunk no route takes refuses the script"""
+    routes = []
+    for index, chunk in enumerate(plan.chunks):
+        route = model_router.route(CHUNK_SYSTEM_PROMPT, chunk_prompt(plan, index), required=False)
+        if route['model'] is None:
+            raise model_router.refusal(route, f"chunk with {', '.join(chunk.names)}")
+        routes.append(route)
+    return routes
+
+def route_model(python_code, chunked=True):
+    """The routing decision and chunk plan for a script. Raises PromptTooLarge early.
+
+    A script big enough to be chunked is routed chunk by chunk, so only the whole script's
+    prompt may exceed every route.
+    """
+    try:
+        route = model_router.route(SYSTEM_PROMPT, python_code, required=False)
+        plan = chunk_plan(python_code, route['tokens']) if chunked else None
+        if plan is None and route['model'] is None:
+            raise model_router.refusal(route)
+        route['chunks'] = route_chunks(plan) if plan is not None else None
+    except PromptTooLarge:
+        LLM_ROUTED.inc(model='refused')
+        raise
+    for decision in route['chunks'] or [route]:
+        LLM_ROUTED.inc(model=decision['model'])
+        PROMPT_TOKENS.observe(decision['tokens'], model=decision['model'])
+    return route, plan
+
+def llm_model(run, chunk=None):
+    """The model routed for the whole script, or for one of its chunks"""
+    if chunk is not None:
+        return run['route']['chunks'][chunk]['model']
+    return run['route']['model']
+
+def describe_complexity(route):
+    return route['complexity'] if route['complexity'] is not None else 'unparseable'
+
+def record_route(run):
+    route = run['route']
+    if route['chunks'] is not None:
+        models = [chunk['model'] for chunk in route['chunks']]
+        add_event(run, "Model Routing", "complete",
+                  f"Routed {len(models)} chunks of a {route['tokens']}-token script: "
+                  f"{', '.join(f'{models.count(model)} to {model}' for model in dict.fromkeys(models))}",
+                  "yellow",
+                  '\n'.join(f"Chunk {index}: {chunk['tokens']} tokens ({chunk['tokenizer']}), "
+                            f"{describe_complexity(chunk)} decision points"
+                            for index, chunk in enumerate(route['chunks'])),
+                  '\n'.join(f"Chunk {index}: {chunk['model']} ({chunk['rule']})"
+                            for index, chunk in enumerate(route['chunks'])))
+        return
+    complexity = describe_complexity(route)
+    add_event(run, "Model Routing", "complete",
+              f"Routed to {route['model']}: {route['tokens']} prompt tokens, {complexity} decision points",
+              "yellow", f"{route['tokens']} tokens ({route['tokenizer']}), {complexity} decision points",
+              f"{route['model']} ({route['rule']})")
+
+def add_event(run, step, status, details, color, input, output):
+    event = {
+        "step": step,
+        "status": status,
+        "details": details,
+        "color": color,
+        "input": input,
+        "output": output,
+        "timestamp": datetime.now().strftime("%H:%M:%S")
+    }
+    # Streaming runs hand events to the client instead of collecting them
+    if run.get('emit'):
+        publish(run, {'type': 'timeline_event', 'timeline_event': event})
+    else:
+        run['timeline_events'].append(event)
+    return event
+
+def publish(run, message):
+    if run.get('emit'):
+        run['emit'](message)
+
+def strip_code_fences(code):
+    code = code.strip()
+    code = re.sub(r'^```python\s*', '', code)
+    code = re.sub(r'\s*```$', '', code)
+    return code.strip()
+
+# Pipeline stages. Each takes the shared run dict and stores what later stages need in it.
+
+def checkout_sandbox(run):
+    # Every sandbox call made for this run is timed, added to its trace and bounded by its deadline
+    sandbox = sandbox_pool.checkout(timeout=run['deadline'].timeout('sandbox checkout', sandbox_pool.checkout_timeout))
+    return TracedSandbox(DeadlineSandbox(sandbox, run['deadline'], COMMAND_TIMEOUT_SECONDS),
+                         run['trace'], SANDBOX_CALL_SECONDS)
+
+def stage_sandbox(run):
+    run['sandbox'] = checkout_sandbox(run)
+    print(f"[{run['trace'].trace_id}] Sandbox checked out", run['sandbox'].sandbox_id)
+
+def stage_upload_script(run):
+    run['sandbox'].files.write('script.py', run['python_code'])
+    add_event(run, "File Upload", "complete",
+              f"Uploaded Python file: {run['filename']}", "blue",
+              run['python_code'], f"Wrote script.py ({len(run['python_code'])} characters)")
+
+def stage_upload_data(run):
+    data_files = run['data_files']
+    if not data_files:
+        return
+    uploaded = upload_data_files(run['sandbox'], data_files, workers=DATA_UPLOAD_WORKERS)
+    sent = sum(1 for f in uploaded if not f['reused'])
+    add_event(run, "Data Upload", "complete",
+              f"Uploaded data files: {', '.join([f['name'] for f in uploaded])} "
+              f"({sent} sent, {len(uploaded) - sent} already in sandbox)", "purple",
+              str([f['name'] for f in uploaded]),
+              '\n'.join(f"data/{f['name']}  {f['size']} bytes  {f['hash'][:12]}  {'reused' if f['reused'] else 'sent'}"
+                        for f in uploaded))
+
+def local_modules(run):
+    # The script can import its own uploaded .py files; those are not packages
+    return [os.path.splitext(os.path.basename(name))[0]
+            for name in [run['filename']] + [f.filename for f in run['data_files']]
+            if name.endswith('.py')]
+
+def script_packages(run, source):
+    return packages_for_source(source, local_modules(run))
+
+def ensure_packages(sandbox, packages, guessed):
+    """Prepare an environment, retrying without unknown package names if pip rejects them"""
+    try:
+        return dependency_manager.ensure(sandbox, packages), []
+    except CommandExitException:
+        if not guessed:
+            raise
+        print(f"Install failed, retrying without unknown packages: {', '.join(guessed)}")
+        known = [p for p in packages if p not in guessed]
+        return dependency_manager.ensure(sandbox, known), guessed
+
+def describe_environment(environment, skipped):
+    if environment['source'] == 'empty':
+        details = "No third-party imports, nothing to install"
+    else:
+        details = f"Environment {environment['hash']} ready ({environment['source']})"
+    if skipped:
+        details += f"; could not install {', '.join(skipped)}"
+    return details
+
+def stage_dependencies(run):
+    # Install only what the uploaded script imports; the optimized script's extras follow later
+    packages, guessed = script_packages(run, run['python_code'])
+    environment, skipped = ensure_packages(run['sandbox'], packages, guessed)
+    run['environment'] = environment
+    add_event(run, "Dependencies", "complete", describe_environment(environment, skipped), "orange",
+              ' '.join(packages) or "(none)",
+              environment['output'] or f"Reused prepared environment {environment['hash']}")
+
+def stage_optimized_dependencies(run):
+    # The optimized code may import packages the original did not
+    packages, guessed = script_packages(run, run['optimized_code'])
+    environment = run['environment']
+    held = set(environment['packages'])
+    missing = [p for p in packages if normalize_package(p) not in held]
+    if not missing:
+        return
+    extra, skipped = ensure_packages(run['sandbox'], missing, [p for p in guessed if p in missing])
+    if extra['source'] != 'empty':
+        run['environment'] = dict(environment, envs={
+            'PYTHONPATH': f"{environment['envs']['PYTHONPATH']}:{extra['envs']['PYTHONPATH']}"
+        }, packages=sorted(held | set(extra['packages'])))
+    add_event(run, "Dependencies", "complete",
+              f"Optimized code needs {', '.join(missing)}: {describe_environment(extra, skipped)}", "orange",
+              ' '.join(missing), extra['output'] or f"Reused prepared environment {extra['hash']}")
+
+def llm_timeout_ms(run):
+    return int(run['deadline'].timeout('the optimization request', LLM_TIMEOUT_SECONDS) * 1000)
+
+def stream_optimization(run, messages, candidate=None, chunk=None, **options):
+    """Stream the completion, forwarding each delta and stopping as soon as the code cannot compile"""
+    check = IncrementalSyntaxCheck()
+    content = []
+    start = time.perf_counter()
+    model = llm_model(run, chunk)
+    with timed(LLM_SECONDS, run['trace'], 'llm:chat.stream', model=model):
+        with client.chat.stream(model=model, messages=messages, timeout_ms=llm_timeout_ms(run),
+                                **options) as stream:
+            for event in stream:
+                # The timeout only bounds each read, the deadline bounds the whole completion
+                run['deadline'].check('the optimization finished')
+                if not event.data.choices:
+                    continue
+                text = delta_text(event.data.choices[0].delta)
+                if not text:
+                    continue
+                if not content:
+                    first_token = time.perf_counter() - start
+                    LLM_FIRST_TOKEN_SECONDS.observe(first_token, model=model)
+                    run['trace'].record('llm:first_token', start, first_token, model=model)
+                content.append(text)
+                message = {'type': 'optimized_code_delta', 'delta': text}
+                if candidate is not None:
+                    message['candidate'] = candidate
+                if chunk is not None:
+                    message['chunk'] = chunk
+                publish(run, message)
+                if check.feed(text):
+                    # Leaving the block closes the response, so the rest is never generated
+                    break
+    if check.error:
+        raise PreflightError(f"Optimized code does not compile: {check.error}",
+                             code=check.code, problems=[('syntax', check.error)])
+    return strip_code_fences(''.join(content))
+
+def generate_optimization(run, messages, candidate=None, chunk=None, **options):
+    if OPTIMIZATION_STREAMING:
+        return stream_optimization(run, messages, candidate, chunk, **options)
+    model = llm_model(run, chunk)
+    with timed(LLM_SECONDS, run['trace'], 'llm:chat.complete', model=model):
+        mistral_response = client.chat.complete(model=model, messages=messages,
+                                                timeout_ms=llm_timeout_ms(run), **options)
+    return strip_code_fences(mistral_response.choices[0].message.content)
+
+def check_optimization(run, code):
+    """Local pre-flight checks, so code that cannot run never costs a sandbox execution"""
+    with timed(STAGE_SECONDS, run['trace'], 'stage:preflight', stage='preflight'):
+        return preflight_check(code, extract_imports(run['python_code']) | set(local_modules(run)))
+
+def reject_optimization(run, messages, code, problems, attempt):
+    """Record failed pre-flight checks and return the conversation asking for a fix.
+
+    Raises PreflightError once OPTIMIZATION_REPAIR_ATTEMPTS fixes have been asked for.
+    """
+    for reason in {reason for reason, _ in problems}:
+        LLM_REJECTED.inc(reason=reason)
+    report = '; '.join(message for _, message in problems)
+    publish(run, {'type': 'optimized_code_rejected', 'problems': [message for _, message in problems]})
+    if attempt >= OPTIMIZATION_REPAIR_ATTEMPTS:
+        raise PreflightError(f"Optimized code failed pre-flight checks: {report}", code=code, problems=problems)
+    add_event(run, "Pre-flight Check", "repair",
+              f"Optimized code would fail, asking for a fix ({attempt + 1}/{OPTIMIZATION_REPAIR_ATTEMPTS})",
+              "orange", code, report)
+    return repair_messages(messages, code, problems)
+
+def optimize_with_repairs(run, messages, candidate=None, chunk=None, check=check_optimization, **options):
+    for attempt in range(OPTIMIZATION_REPAIR_ATTEMPTS + 1):
+        try:
+            code = generate_optimization(run, messages, candidate, chunk, **options)
+            problems = check(run, code)
+        except PreflightError as e:
+            code, problems = e.code, e.problems
+        if not problems:
+            return code
+        messages = reject_optimization(run, messages, code, problems, attempt)
+
+def chunk_plan(python_code, tokens):
+    """How to split the script for a chunked optimization, or None if it goes in one piece"""
+    if not OPTIMIZATION_CHUNKING or tokens < CHUNKING_MIN_TOKENS:
+        return None
+    plan = split_module(python_code, model_router.counter.count, CHUNK_TARGET_TOKENS)
+    # A single chunk is no faster than the whole script
+    if plan is None or len(plan.chunks) < 2:
+        return None
+    return plan
+
+def chunk_prompt(plan, index):
+    return f"Module outline:\n{plan.outline(index)}\nDefinitions to optimize:\n{plan.source(index)}"
+
+def start_chunk(run, plan, index):
+    """The chunk's result entry and prompt; on a cache hit the entry already holds the code"""
+    chunk = plan.chunks[index]
+    messages = [
+        {"role": "system", "content": CHUNK_SYSTEM_PROMPT},
+        {"role": "user", "content": chunk_prompt(plan, index)}
+    ]
+    entry = {'chunk': index, 'names': chunk.names, 'tokens': chunk.tokens,
+             'key': cache_key(messages[1]['content'], CHUNK_SYSTEM_PROMPT, llm_model(run, index))}
+    cached = optimization_cache.get(entry['key'])
+    if cached is not None:
+        entry.update(code=cached, status='cached')
+    return entry, messages
+
+def chunk_check(entry):
+    return lambda run, code: chunk_problems(code, entry['names'])
+
+def finish_chunk(entry, code=None, error=None):
+    if error is not None:
+        # The rest of the module is still optimized; this chunk keeps the original code
+        entry.update(status='unchanged', reason=str(error))
+    else:
+        entry.update(code=code, status='optimized')
+        optimization_cache.put(entry['key'], code)
+    return entry
+
+def assemble_chunks(run, plan, entries):
+    """The module rebuilt from the optimized chunks, after the pre-flight checks of the whole"""
+    code = plan.assemble({entry['chunk']: entry.get('code') for entry in entries})
+    problems = check_optimization(run, code)
+    if problems:
+        raise PreflightError(f"Reassembled module failed pre-flight checks: "
+                             f"{'; '.join(message for _, message in problems)}", code=code, problems=problems)
+    counts = {status: sum(1 for entry in entries if entry['status'] == status)
+              for status in ('optimized', 'cached', 'unchanged')}
+    add_event(run, "Chunked Optimization", "complete",
+              f"Optimized {len(entries)} chunks, {min(CHUNK_CONCURRENCY, len(entries))} at a time "
+              f"(largest {max(entry['tokens'] for entry in entries)} tokens): {counts['optimized']} optimized, "
+              f"{counts['cached']} cached, {counts['unchanged']} unchanged", "yellow",
+              '\n'.join(f"Chunk {entry['chunk']}: {', '.join(entry['names'])} ({entry['tokens']} tokens)"
+                        for entry in entries),
+              '\n'.join(f"Chunk {entry['chunk']}: {entry['status']}"
+                        + (f" ({entry['reason']})" if 'reason' in entry else '') for entry in entries))
+    return code
+
+def optimize_chunk(run, plan, index):
+    entry, messages = start_chunk(run, plan, index)
+    if 'code' in entry:
+        return entry
+    try:
+        code = optimize_with_repairs(run, messages, chunk=index, check=chunk_check(entry))
+    except PreflightError as e:
+        return finish_chunk(entry, error=e)
+    return finish_chunk(entry, code)
+
+def optimize_chunks(run, plan):
+    """Optimize the chunks concurrently, so the latency follows the largest one"""
+    workers = min(CHUNK_CONCURRENCY, len(plan.chunks))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk') as executor:
+        entries = list(executor.map(lambda index: optimize_chunk(run, plan, index), range(len(plan.chunks))))
+    return assemble_chunks(run, plan, entries)
+
+def optimization_key(run):
+    """Cache key of the whole script's optimization, which a chunked one owes to every chunk's model"""
+    route = run['route']
+    model = route['model'] if route['chunks'] is None else ','.join(chunk['model'] for chunk in route['chunks'])
+    return cache_key(run['python_code'], SYSTEM_PROMPT, model)
+
+def stage_optimize(run):
+    # Does not touch the sandbox, so it runs alongside the uploads and the install
+    record_route(run)
+    key = optimization_key(run)
+    cached = optimization_cache.get(key)
+    run['optimization_cached'] = cached is not None
+    if cached is not None:
+        run['optimized_code'] = cached
+    else:
+        if run['chunk_plan'] is not None:
+            run['optimized_code'] = optimize_chunks(run, run['chunk_plan'])
+        else:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": run['python_code']}
             ]
+            # Code that fails the pre-flight checks never reaches the sandbox or the cache
+            run['optimized_code'] = optimize_with_repairs(run, messages)
+        optimization_cache.put(key, run['optimized_code'])
+    publish(run, {'type': 'optimized_code', 'optimized_code': run['optimized_code']})
+
+def stage_candidates(run):
+    """Tournament counterpart of stage_optimize: several completions at once, one per temperature"""
+    count = run['tournament_options']['candidates']
+    record_route(run)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": run['python_code']}
+    ]
+
+    def generate(index):
+        temperature = TOURNAMENT_TEMPERATURES[index % len(TOURNAMENT_TEMPERATURES)]
+        entry = {'candidate': index, 'temperature': temperature}
+        try:
+            entry['code'] = optimize_with_repairs(run, messages, candidate=index, temperature=temperature)
+        except (DeadlineExceeded, RunCancelled):
+            # The whole run is over, not just this candidate
+            raise
+        except Exception as e:
+            entry.update(status='rejected', reason=str(e))
+        return entry
+
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix='candidate') as executor:
+        candidates = list(executor.map(generate, range(count)))
+    # Identical completions are only run once
+    seen = {}
+    for entry in candidates:
+        if 'code' not in entry:
+            continue
+        if entry['code'] in seen:
+            entry.update(status='duplicate', reason=f"same code as candidate {seen[entry['code']]}")
+            del entry['code']
+        else:
+            seen[entry['code']] = entry['candidate']
+    run['candidates'] = candidates
+    run['optimization_cached'] = False
+
+def reference_outputs(run):
+    # The original runs in the run's own sandbox; the winner overwrites its files with identical ones
+    result = run['sandbox'].commands.run('python script.py', envs=run['environment']['envs'],
+                                         timeout=EXECUTE_TIMEOUT_SECONDS)
+    return {'stdout': result.stdout, 'files': output_digests(run['sandbox'])}
+
+def trial_candidate(run, entry, reference, upload_lock):
+    """Run a candidate in its own pooled sandbox, check it against the original and time both"""
+    sandbox = None
+    try:
+        sandbox = checkout_sandbox(run)
+        if run['data_files']:
+            # Every trial reads the same spooled uploads, so they take turns
+            with upload_lock:
+                upload_data_files(sandbox, run['data_files'], workers=DATA_UPLOAD_WORKERS)
+        sandbox.files.write('script.py', run['python_code'])
+        sandbox.files.write('optimized_script.py', entry['code'])
+        original_packages, original_guessed = script_packages(run, run['python_code'])
+        packages, guessed = script_packages(run, entry['code'])
+        environment, _ = ensure_packages(sandbox, sorted(set(original_packages) | set(packages)),
+                                         sorted(set(original_guessed) | set(guessed)))
+
+        result = sandbox.commands.run('python optimized_script.py', envs=environment['envs'],
+                                      timeout=EXECUTE_TIMEOUT_SECONDS)
+        reason = compare_outputs(reference.result(), {'stdout': result.stdout, 'files': output_digests(sandbox)})
+        if reason:
+            entry.update(status='rejected', reason=reason)
+            return
+
+        # Timing both scripts on the same host keeps candidates comparable across sandboxes
+        timing = sandbox.commands.run(
+            benchmark_command('script.py', 'optimized_script.py', TOURNAMENT_RUNS, 0),
+            envs=environment['envs'], timeout=BENCHMARK_TIMEOUT
+        )
+        report = benchmark_report(timing.stdout, 'script.py', 'optimized_script.py', TOURNAMENT_RUNS, 0)
+        entry.update(
+            status='passed',
+            wall_seconds=report['optimized']['wall_seconds']['mean'],
+            original_wall_seconds=report['original']['wall_seconds']['mean'],
+            speedup=report['speedup'].get('wall_seconds', {'value': 1.0, 'ci95': [1.0, 1.0]})
+        )
+    except (DeadlineExceeded, RunCancelled):
+        raise
+    except CommandExitException as e:
+        entry.update(status='failed', reason=f"Exited with code {e.exit_code}: {(e.stderr or '').strip()[-300:]}")
+    except Exception as e:
+        entry.update(status='failed', reason=str(e))
+    finally:
+        if sandbox is not None:
+            sandbox_pool.release(sandbox)
+
+def stage_tournament(run):
+    candidates = [entry for entry in run['candidates'] if 'code' in entry]
+    if not candidates:
+        raise RuntimeError(f"No candidate passed the pre-flight checks: {run['candidates'][0]['reason']}")
+    upload_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=len(candidates) + 1, thread_name_prefix='tournament') as executor:
+        reference = executor.submit(reference_outputs, run)
+        trials = [executor.submit(trial_candidate, run, entry, reference, upload_lock) for entry in candidates]
+        for trial in trials:
+            trial.result()
+        try:
+            reference.result()
+        except (DeadlineExceeded, RunCancelled):
+            raise
+        except Exception as e:
+            raise RuntimeError(f"The original script failed, so no candidate can be verified: {str(e)}")
+
+    board = leaderboard(run['candidates'])
+    winner = next((entry for entry in run['candidates'] if entry.get('rank') == 1), None)
+    rejected = sum(1 for entry in board if entry['status'] == 'rejected')
+    if winner is None:
+        # Nothing reproduced the original's results, so the original is what runs
+        run['optimized_code'] = run['python_code']
+        details = f"No candidate matched the original's output ({rejected} rejected); running the original script"
+    elif winner['speedup']['value'] < 1:
+        run['optimized_code'] = run['python_code']
+        details = (f"No candidate beat the original (best: candidate {winner['candidate']}, "
+                   f"{winner['speedup']['value']:.2f}x); running the original script")
+        winner = None
+    else:
+        run['optimized_code'] = winner['code']
+        optimization_cache.put(optimization_key(run), winner['code'])
+        details = (f"Candidate {winner['candidate']} (temperature {winner['temperature']}) won, "
+                   f"{winner['speedup']['value']:.2f}x faster than the original; {rejected} rejected")
+    run['tournament'] = {
+        'candidates': len(run['candidates']),
+        'winner': winner['candidate'] if winner else None,
+        'leaderboard': board
+    }
+    add_event(run, "Tournament", "complete", details, "yellow",
+              f"{len(run['candidates'])} candidates, temperatures {', '.join(str(e['temperature']) for e in run['candidates'])}",
+              '\n'.join(f"#{entry['rank'] or '-'} candidate {entry['candidate']}: {entry['status']}"
+                        + (f" {entry['speedup']['value']:.2f}x" if entry['status'] == 'passed' else f" ({entry['reason']})")
+                        for entry in board))
+    publish(run, {'type': 'tournament', 'tournament': run['tournament']})
+    publish(run, {'type': 'optimized_code', 'optimized_code': run['optimized_code']})
+
+def stage_write_optimized(run):
+    run['sandbox'].files.write('optimized_script.py', run['optimized_code'])
+    details = "Code optimized successfully"
+    if run['optimization_cached']:
+        details += " (cached)"
+    add_event(run, "Code Optimization", "complete", details, "yellow",
+              run['python_code'], run['optimized_code'])
+
+def captured_output(ring, log):
+    """The kept tail of the output, with a note pointing to the full log when the start was dropped"""
+    output = ring.getvalue()
+    if ring.truncated:
+        note = f"full log ({log['size']} bytes): {log['url']}" if log else "full log unavailable"
+        output = f"[output truncated, showing the last {len(output)} characters; {note}]\n{output}"
+    return output
+
+def stage_execute(run):
+    sandbox = run['sandbox']
+    stdout, stderr = OutputRing(OUTPUT_CAPTURE_CHARS), OutputRing(OUTPUT_CAPTURE_CHARS)
+
+    def forward(ring, stream):
+        def on_output(text):
+            ring.write(text)
+            publish(run, {'type': 'output_delta', 'stream': stream, 'data': text})
+        return on_output
+
+    # Output reaches streaming clients while the script runs; only the tails stay in memory
+    try:
+        sandbox.commands.run(
+            tee_command('optimized_script.py', OUTPUT_STREAM_MAX_BYTES, OUTPUT_LOG_MAX_BYTES),
+            envs=run['environment']['envs'],
+            timeout=EXECUTE_TIMEOUT_SECONDS,
+            on_stdout=forward(stdout, 'stdout'),
+            on_stderr=forward(stderr, 'stderr')
         )
+    except CommandExitException as e:
+        # The exception carries everything the script printed; report the tail instead
+        raise RuntimeError(f"Script exited with code {e.exit_code}: {stderr.getvalue()[-2000:].strip()}") from None
+    print(f"[{run['trace'].trace_id}] Execution finished: {stdout.total} characters of output")
 
-        optimized_code = mistral_response.choices[0].message.content.strip()
-        optimized_code = re.sub(r'^```python\s*', '', optimized_code)
-        optimized_code = re.sub(r'\s*```$', '', optimized_code)
-        optimized_code = optimized_code.strip()
-        
-        # Write optimized code to root directory
-        sandbox.files.write('optimized_script.py', optimized_code)
-        
-        # Verify file was written
-        result = sandbox.commands.run('cat optimized_script.py')
-        print(f"Optimized file contents: {result.stdout}")
-        result = sandbox.commands.run('ls -la .')
-        print("Directory contents before execution:", result.stdout)
-        
-        timeline_events.append({
-            "step": "Code Optimization",
-            "status": "complete",
-            "details": "Code optimized successfully",
-            "color": "yellow",
-            "input": python_code,
-            "output": optimized_code,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        })
+    run['output_log'] = None
+    if stdout.truncated or stderr.truncated:
+        try:
+            chunks = sandbox.files.read(OUTPUT_LOG_PATH, format='stream')
+            run['output_log'] = artifact_store.put_stream('output.log', chunks)
+        except Exception as e:
+            print(f"Error saving the output log: {str(e)}")
+    run['output'] = captured_output(stdout, run['output_log'])
+    
+    # Collect generated files in one archive transfer; clients fetch them from /artifacts
+    generated_files = []
+    try:
+        generated_files = collect_artifacts(sandbox, artifact_store, ARTIFACT_GLOBS)
+    except Exception as e:
+        print(f"Error checking for generated files: {str(e)}")
+    run['generated_files'] = generated_files
+    
+    add_event(run, "Execution", "complete", "Code executed successfully", "teal",
+              "Running optimized script", run['output'])
+    publish(run, {'type': 'output', 'output': run['output'], 'generated_files': generated_files,
+                  'output_log': run['output_log']})
+
+def stage_benchmark(run):
+    """Time script.py against optimized_script.py in the same sandbox, after the real run"""
+    options = run['benchmark_options']
+    runs, warmup = options['runs'], options['warmup']
+    try:
+        result = run['sandbox'].commands.run(
+            benchmark_command('script.py', 'optimized_script.py', runs, warmup),
+            envs=run['environment']['envs'], timeout=BENCHMARK_TIMEOUT
+        )
+        report = benchmark_report(result.stdout, 'script.py', 'optimized_script.py', runs, warmup)
+    except Exception as e:
+        # The optimized script already ran; a failed comparison should not fail the run
+        print(f"Error benchmarking: {str(e)}")
+        run['benchmark'] = {'runs': runs, 'warmup': warmup, 'error': str(e)}
+        add_event(run, "Benchmark", "error", f"Benchmark failed: {str(e)}", "red",
+                  f"{runs} runs after {warmup} warmup", str(e))
+        publish(run, {'type': 'benchmark', 'benchmark': run['benchmark']})
+        return
+    run['benchmark'] = report
+    add_event(run, "Benchmark", "complete", describe_benchmark(report), "purple",
+              f"{runs} runs after {warmup} warmup, original and optimized alternating", format_comparison(report))
+    publish(run, {'type': 'benchmark', 'benchmark': report})
+
+def traced(name, stage):
+    def run_stage(run, *args):
+        run['deadline'].check(f"the {name} stage")
+        with timed(STAGE_SECONDS, run['trace'], f'stage:{name}', stage=name):
+            return stage(run, *args)
+    return run_stage
+
+def build_pipeline(benchmark=False, tournament=False):
+    # The LLM call only joins the sandbox work right before the optimized script is written
+    pipeline = (Pipeline(pipeline_executor)
+            .add('sandbox', traced('sandbox', stage_sandbox))
+            .add('upload_script', traced('upload_script', stage_upload_script), after=['sandbox'])
+            .add('upload_data', traced('upload_data', stage_upload_data), after=['sandbox'])
+            .add('dependencies', traced('dependencies', stage_dependencies), after=['sandbox']))
+    if tournament:
+        # The winner is only known once every candidate has been run against the original
+        (pipeline
+            .add('optimize', traced('optimize', stage_candidates))
+            .add('tournament', traced('tournament', stage_tournament),
+                 after=['optimize', 'upload_script', 'upload_data', 'dependencies']))
+        optimized = 'tournament'
+    else:
+        pipeline.add('optimize', traced('optimize', stage_optimize))
+        optimized = 'optimize'
+    (pipeline
+        .add('write_optimized', traced('write_optimized', stage_write_optimized), after=[optimized, 'upload_script'])
+        .add('optimized_dependencies', traced('optimized_dependencies', stage_optimized_dependencies),
+             after=[optimized, 'dependencies'])
+        .add('execute', traced('execute', stage_execute),
+             after=['write_optimized', 'upload_data', 'optimized_dependencies']))
+    if benchmark:
+        pipeline.add('benchmark', traced('benchmark', stage_benchmark), after=['execute'])
+    return pipeline
+
+def new_run(python_code, filename, data_files, chunked=True):
+    route, plan = route_model(python_code, chunked)
+    return {
+        'python_code': python_code,
+        'filename': filename,
+        'data_files': data_files,
+        'timeline_events': [],
+        'sandbox': None,
+        'trace': Trace(),
+        'benchmark_options': None,
+        'benchmark': None,
+        'tournament_options': None,
+        'tournament': None,
+        'route': route,
+        'chunk_plan': plan,
+        'deadline': Deadline(REQUEST_DEADLINE_SECONDS)
+    }
+
+def request_deadline(form):
+    """The run's time budget in seconds, from the optional `deadline` field"""
+    seconds = float(form.get('deadline') or REQUEST_DEADLINE_SECONDS)
+    return min(max(seconds, 1.0), REQUEST_DEADLINE_MAX_SECONDS)
+
+def tournament_options(form):
+    """Tournament settings requested with the `candidates` field (two or more)"""
+    candidates = int(form.get('candidates') or 1)
+    if candidates < 2:
+        return None
+    return {'candidates': min(candidates, TOURNAMENT_MAX_CANDIDATES)}
+
+def benchmark_options(form):
+    """Benchmark settings requested with the `benchmark`, `benchmark_runs` and `benchmark_warmup` fields"""
+    if form.get('benchmark', '').lower() not in ('true', '1', 'yes'):
+        return None
+    runs = int(form.get('benchmark_runs') or BENCHMARK_RUNS)
+    warmup = int(form.get('benchmark_warmup') or BENCHMARK_WARMUP)
+    return {'runs': min(max(runs, 2), BENCHMARK_MAX_RUNS), 'warmup': min(max(warmup, 0), BENCHMARK_MAX_RUNS)}
+
+def read_upload():
+    # Handle file upload
+    if 'python_file' not in request.files:
+        raise ValueError("No Python file uploaded")
+    
+    python_file = request.files['python_file']
+    if not python_file.filename.endswith('.py'):
+        raise ValueError("Invalid file type. Must be a .py file")
+    
+    python_code = python_file.read().decode('utf-8')
+    tournament = tournament_options(request.form)
+    # Tournament candidates are completions of the whole script, so it is routed as a whole
+    run = new_run(python_code, python_file.filename, request.files.getlist('data_files'), chunked=tournament is None)
+    run['benchmark_options'] = benchmark_options(request.form)
+    run['tournament_options'] = tournament
+    run['deadline'] = Deadline(request_deadline(request.form))
+    return run
+
+def error_status(e):
+    if isinstance(e, DeadlineExceeded):
+        return 504
+    if isinstance(e, LLMUnavailable):
+        return 503
+    if isinstance(e, PromptTooLarge):
+        return 413
+    return 500
+
+def error_response(e):
+    return {
+        'status': 'error',
+        'message': str(e),
+        'timeline_events': [{
+            "step": "Execution",
+            "status": "error",
+            "details": f"Error during execution: {str(e)}",
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "color": "red",
+            "input": "Error occurred during processing",
+            "output": str(e)
+        }]
+    }
+
+def execute_run(run, client=None):
+    """Run the pipeline; `client` is the requester's socket, watched for a disconnect"""
+    RUNS_IN_FLIGHT.inc()
+    deadline = run['deadline']
+    try:
+        pipeline = build_pipeline(benchmark=run['benchmark_options'] is not None,
+                                  tournament=run['tournament_options'] is not None)
+        with CancellationWatch(deadline, client, DISCONNECT_POLL_SECONDS):
+            pipeline.run(run, cancel_event=deadline.cancel_event)
+    except PipelineCancelled:
+        RUNS_STOPPED.inc(reason=(deadline.reason or 'cancelled').replace(' ', '_'))
+        raise RunCancelled(f"Run was cancelled ({deadline.reason or 'cancelled'})") from None
+    except Exception as e:
+        if deadline.cancelled:
+            RUNS_STOPPED.inc(reason=(deadline.reason or 'cancelled').replace(' ', '_'))
+        elif isinstance(e, DeadlineExceeded):
+            RUNS_STOPPED.inc(reason='deadline')
+        raise
+    finally:
+        RUNS_IN_FLIGHT.dec()
+        # Return the sandbox to the pool since we're done
+        if run['sandbox']:
+            sandbox_pool.release(run['sandbox'])
+
+# Step engine. The frontend drives a run one step at a time, posting `step` and
+# `sandbox_id` and following `next_step`. Each session keeps its sandbox and the
+# outputs of finished steps, so a retried step never repeats earlier work.
+
+def release_session(session):
+    run = session['run']
+    if run['sandbox'] and not session['released']:
+        session['released'] = True
+        sandbox_pool.release(run['sandbox'])
+
+step_sessions = SessionStore(ttl=SESSION_TTL, on_expire=release_session)
+
+def step_start(run, session):
+    stage_sandbox(run)
+    # The LLM call does not need the sandbox, so it starts now and is joined in the optimize step
+    session['futures']['optimize'] = pipeline_executor.submit(stage_optimize, run)
+    stage_upload_script(run)
+    stage_upload_data(run)
+
+def step_optimize(run, session):
+    future = session['futures'].pop('optimize', None)
+    if future is None:
+        # A retried step: the background optimization was already consumed by the failed attempt
+        stage_optimize(run)
+    else:
+        try:
+            future.result()
+        except Exception as e:
+            # Only a transient API failure is worth a second call; a deadline, a cancellation,
+            # an open circuit or a refused prompt would fail the same way again
+            if not retryable(e):
+                raise
+            print(f"Background optimization failed, retrying: {str(e)}")
+            stage_optimize(run)
+    stage_write_optimized(run)
+    stage_optimized_dependencies(run)
+
+def step_execute(run, session):
+    stage_execute(run)
+    if run['benchmark_options']:
+        stage_benchmark(run)
+    release_session(session)
+
+STEPS = {
+    'start': (step_start, 'dependencies'),
+    'dependencies': (lambda run, session: stage_dependencies(run), 'optimize'),
+    'optimize': (step_optimize, 'execute'),
+    'execute': (step_execute, 'complete')
+}
+
+STEP_OUTPUTS = {
+    'start': ['python_code'],
+    'optimize': ['optimized_code'],
+    'execute': ['output', 'output_log', 'generated_files', 'benchmark']
+}
+
+def run_step(step):
+    if step not in STEPS:
+        return {'status': 'error', 'message': f"Unknown step: {step}"}, 400
+    
+    if step == 'start':
+        run = read_upload()
+        session = {'run': run, 'results': {}, 'futures': {}, 'lock': threading.Lock(), 'released': False}
+    else:
+        sandbox_id = request.form.get('sandbox_id')
+        session = step_sessions.get(sandbox_id) if sandbox_id else None
+        if session is None:
+            return {'status': 'error', 'message': "Session not found or expired, please start again"}, 404
+        run = session['run']
+    
+    with session['lock']:
+        # A retried step that already finished returns its stored result
+        if step in session['results']:
+            return session['results'][step], 200
         
-        # Execute the optimized script
-        result = sandbox.commands.run('python optimized_script.py')
-        print("Execution output:", result.stdout)
+        if step != 'start':
+            # Each step is its own request with its own budget
+            run['deadline'].restart(request_deadline(request.form))
+        handler, next_step = STEPS[step]
+        first_event = len(run['timeline_events'])
+        try:
+            with CancellationWatch(run['deadline'], client_socket(request.environ), DISCONNECT_POLL_SECONDS):
+                traced(step, handler)(run, session)
+        except Exception:
+            # A failed start has nothing worth resuming; later steps stay resumable
+            if step == 'start':
+                release_session(session)
+            raise
+        if step == 'start':
+            step_sessions.put(run['sandbox'].sandbox_id, session)
         
-        # Check for generated files in root directory
-        generated_files = []
+        events = run['timeline_events'][first_event:]
+        payload = {
+            'status': 'success',
+            'step': step,
+            'next_step': next_step,
+            'sandbox_id': run['sandbox'].sandbox_id,
+            'timeline_event': events[-1] if events else None,
+            'timeline_events': events,
+            'trace_id': run['trace'].trace_id
+        }
+        for key in STEP_OUTPUTS.get(step, []):
+            payload[key] = run[key]
+        session['results'][step] = payload
+        return payload, 200
+
+def run_result(run):
+    return {
+        'status': 'success',
+        'sandbox_id': run['sandbox'].sandbox_id,
+        'timeline_events': run['timeline_events'],
+        'generated_files': run['generated_files'],
+        'python_code': run['python_code'],
+        'optimized_code': run['optimized_code'],
+        'output': run['output'],
+        'output_log': run['output_log'],
+        'trace_id': run['trace'].trace_id,
+        'trace': run['trace'].to_list(),
+        'benchmark': run['benchmark'],
+        'tournament': run['tournament']
+    }
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+
+def send_payload(payload, status_code=200):
+    """Send a result body in the negotiated schema version, encoding and compression"""
+    version = requested_version(request.args.get('response_format') or request.form.get('response_format'),
+                                request.headers.get('Accept', ''))
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    if version == 1 and not accept_encoding:
+        return jsonify(payload), status_code
+    body, headers = encode_payload(payload, version, request.headers.get('Accept', ''), accept_encoding,
+                                   RESPONSE_COMPRESSION_MIN_BYTES)
+    return Response(body, status=status_code, headers=headers)
+
+def requested_stream_format():
+    stream_format = request.args.get('stream') or request.form.get('stream')
+    if stream_format in STREAM_FORMATS:
+        return stream_format
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+def encode_message(stream_format, message):
+    data = json.dumps(message)
+    if stream_format == 'sse':
+        return f"event: {message['type']}\ndata: {data}\n\n"
+    return data + '\n'
+
+def stream_run(run, stream_format, client=None):
+    """Run the pipeline in the background and yield each message as soon as it is produced"""
+    messages = queue.Queue()
+    run['emit'] = messages.put
+    
+    def worker():
         try:
-            result = sandbox.commands.run('ls -la .')
-            print("Directory contents after execution:", result.stdout)
-            
-            for line in result.stdout.split('\n'):
-                if any(line.endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.pdf']):
-                    filename = line.split()[-1]
-                    file_content = sandbox.files.read(f'{filename}')
-                    generated_files.append({
-                        'name': filename,
-                        'content': file_content
-                    })
+            execute_run(run, client)
+            messages.put({
+                'type': 'complete',
+                'status': 'success',
+                'sandbox_id': run['sandbox'].sandbox_id,
+                'next_step': 'complete',
+                'trace_id': run['trace'].trace_id,
+                'trace': run['trace'].to_list()
+            })
         except Exception as e:
-            print(f"Error checking for generated files: {str(e)}")
-        
-        timeline_events.append({
-            "step": "Execution",
-            "status": "complete",
-            "details": "Code executed successfully",
-            "color": "teal",
-            "input": "Running optimized script",
-            "output": result.stdout,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
+            print(f"Error in execute_code: {str(e)}")
+            messages.put(dict(error_response(e), type='error'))
+        finally:
+            messages.put(None)
+    
+    threading.Thread(target=worker, daemon=True).start()
+    
+    finished = False
+    try:
+        yield encode_message(stream_format, {
+            'type': 'started',
+            'status': 'running',
+            'trace_id': run['trace'].trace_id,
+            'python_code': run['python_code']
         })
+        while True:
+            message = messages.get()
+            if message is None:
+                finished = True
+                break
+            yield encode_message(stream_format, message)
+    finally:
+        # The client went away: stop the run instead of finishing it for nobody
+        if not finished:
+            run['deadline'].cancel('client disconnected')
+
+@app.route('/execute', methods=['POST'])
+def execute_code():
+    try:
+        if request.form.get('step'):
+            payload, status_code = run_step(request.form['step'])
+            return send_payload(payload, status_code)
         
-        # Close the sandbox since we're done
-        sandbox.close()
+        run = read_upload()
         
-        # Aggregate all timeline events
-        response['timeline_events'] = timeline_events
-        response['generated_files'] = generated_files
-        response['python_code'] = python_code
-        response['optimized_code'] = optimized_code
-        response['output'] = result.stdout
+        stream_format = requested_stream_format()
+        if stream_format:
+            return Response(
+                stream_with_context(stream_run(run, stream_format, client_socket(request.environ))),
+                mimetype=STREAM_FORMATS[stream_format],
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
-        return jsonify(response)
+        execute_run(run, client_socket(request.environ))
+        return send_payload(run_result(run))
     
     except Exception as e:
         print(f"Error in execute_code: {str(e)}")
-        if 'sandbox' in locals():
-            try:
-                sandbox.close()
-            except:
-                pass
-        return jsonify({
-            'status': 'error',
-            'message': str(e),
-            'timeline_events': [{
-                "step": "Execution",
-                "status": "error",
-                "details": f"Error during execution: {str(e)}",
-                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                "color": "red",
-                "input": "Error occurred during processing",
-                "output": str(e)
-            }]
-        }), 500
+        return send_payload(error_response(e), error_status(e))
+
+# Asynchronous jobs. A job owns copies of the uploaded files, since the request that
+# created it is long gone by the time a worker picks it up.
+
+def detach_uploads(run):
+    spool_dir = tempfile.mkdtemp(prefix='openoperator-job-')
+    detached = []
+    for index, data_file in enumerate(run['data_files']):
+        path = os.path.join(spool_dir, str(index))
+        data_file.save(path)
+        detached.append(FileStorage(stream=open(path, 'rb'), filename=data_file.filename))
+    run['data_files'] = detached
+    run['spool_dir'] = spool_dir
+
+def discard_uploads(run):
+    for data_file in run['data_files']:
+        data_file.close()
+    shutil.rmtree(run['spool_dir'], ignore_errors=True)
+
+def run_job(cancel_event, run):
+    # The budget starts when a worker picks the job up, not while it waits in the queue
+    run['deadline'] = Deadline(run['deadline'].seconds, cancel_event)
+    try:
+        execute_run(run)
+        return run_result(run)
+    finally:
+        discard_uploads(run)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    try:
+        run = read_upload()
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413 if isinstance(e, PromptTooLarge) else 400
+    
+    detach_uploads(run)
+    try:
+        job = job_queue.submit(run_job, run, cleanup=discard_uploads)
+    except QueueFull as e:
+        discard_uploads(run)
+        response = jsonify({'status': 'error', 'message': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    return jsonify({
+        'status': 'queued',
+        'job_id': job.id,
+        'status_url': f'/jobs/{job.id}'
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f"Unknown job: {job_id}"}), 404
+    return send_payload(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f"Unknown job: {job_id}"}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({'status': 'error', 'message': f"Job already {job.status}"}), 409
+    return jsonify({'status': 'success', 'message': f"Job {job_id} cancelled", 'job': job.to_dict()})
+
+@app.route('/artifacts/<digest>')
+def get_artifact(digest):
+    path = artifact_store.path(digest)
+    if path is None:
+        return jsonify({'status': 'error', 'message': f"Unknown artifact: {digest}"}), 404
+    metadata = artifact_store.metadata(digest)
+    # Content never changes for a given hash: strong ETag, Range support and long caching
+    response = send_file(
+        path,
+        mimetype=metadata['content_type'],
+        download_name=metadata['name'],
+        conditional=True,
+        etag=digest,
+        max_age=365 * 24 * 3600
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_started' in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_started,
+                             endpoint=request.endpoint or 'unknown', status=str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request(exception=None):
+    if g.pop('request_started', None) is not None:
+        HTTP_IN_FLIGHT.dec()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype=Registry.CONTENT_TYPE)
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify({
+        'status': 'success',
+        'optimization_cache': optimization_cache.stats()
+    })
 
 pattern = re.compile(r'```python\n(.*?)\n```', re.DOTALL)
 
+def kill_summary(killed_count, failed_count):
+    if killed_count > 0 and failed_count == 0:
+        return f"Successfully killed {killed_count} sandboxes"
+    elif killed_count > 0 and failed_count > 0:
+        return f"Killed {killed_count} sandboxes, failed to kill {failed_count}"
+    elif killed_count == 0 and failed_count > 0:
+        return f"Failed to kill {failed_count} sandboxes"
+    return "No active sandboxes found"
+
+def kill_progress(sandbox_ids):
+    """Kill sandboxes in parallel and yield a progress message as each one finishes"""
+    killed_count = 0
+    failed_count = 0
+    error_messages = []
+    
+    for sandbox_id, error in kill_many(sandbox_ids, kill_sandbox, SANDBOX_KILL_WORKERS):
+        if error is None:
+            killed_count += 1
+        else:
+            failed_count += 1
+            error_messages.append(f"Failed to kill sandbox {sandbox_id}: {str(error)}")
+            print(f"Error killing sandbox: {str(error)}")  # Add logging
+        yield {
+            'type': 'progress',
+            'sandbox_id': sandbox_id,
+            'status': 'killed' if error is None else 'failed',
+            'done': killed_count + failed_count,
+            'total': len(sandbox_ids)
+        }
+    
+    # Pooled sandboxes were among the ones killed, so let the pool boot fresh ones
+    sandbox_pool.drain_idle()
+    
+    yield {
+        'type': 'complete',
+        'status': 'success',
+        'message': kill_summary(killed_count, failed_count),
+        'killed_count': killed_count,
+        'failed_count': failed_count,
+        'errors': error_messages
+    }
+
 @app.route('/kill-sandboxes', methods=['POST'])
 def kill_sandboxes():
     try:
         # Get list of all running sandboxes
-        running_sandboxes = Sandbox.list()
-        killed_count = 0
-        failed_count = 0
-        error_messages = []
+        sandbox_ids = [sandbox_info.sandbox_id for sandbox_info in execution_backend.list()]
         
-        # Kill each sandbox
-        for sandbox_info in running_sandboxes:
-            try:
-                sandbox = Sandbox(sandbox_info.sandbox_id)
-                sandbox.kill()
-                killed_count += 1
-            except Exception as e:
-                failed_count += 1
-                error_messages.append(f"Failed to kill sandbox {sandbox_info.sandbox_id}: {str(e)}")
-                print(f"Error killing sandbox: {str(e)}")  # Add logging
+        stream_format = requested_stream_format()
+        if stream_format:
+            return Response(
+                (encode_message(stream_format, message) for message in kill_progress(sandbox_ids)),
+                mimetype=STREAM_FORMATS[stream_format],
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
-        # Prepare response message
-        if killed_count > 0 and failed_count == 0:
-            message = f"Successfully killed {killed_count} sandboxes"
-        elif killed_count > 0 and failed_count > 0:
-            message = f"Killed {killed_count} sandboxes, failed to kill {failed_count}"
-        elif killed_count == 0 and failed_count > 0:
-            message = f"Failed to kill {failed_count} sandboxes"
-        else:
-            message = "No active sandboxes found"
-            
-        return jsonify({
-            'status': 'success',
-            'message': message,
-            'killed_count': killed_count,
-            'failed_count': failed_count,
-            'errors': error_messages
-        })
+        for message in kill_progress(sandbox_ids):
+            pass
+        del message['type']
+        return jsonify(message)
         
     except Exception as e:
         print(f"Error in kill_sandboxes: {str(e)}")  # Add logging
@@ -277,19 +1444,12 @@ def match_code_block(llm_response):
         return code
     return ""
 
-def install_dependencies(code_interpreter):
-    """Install required Python packages in the sandbox"""
+def install_dependencies(sandbox, required_packages=None, source=None):
+    """Install required Python packages in the sandbox (by default, whatever `source` imports)"""
     timeline_events = []
     
-    required_packages = [
-        'pandas',
-        'numpy',
-        'matplotlib',
-        'scikit-learn',
-        'seaborn',
-        'torch',
-        'requests'
-    ]
+    if required_packages is None:
+        required_packages, _ = packages_for_source(source or '')
     
     timeline_events.append({
         "step": "Dependencies", 
@@ -298,22 +1458,21 @@ def install_dependencies(code_interpreter):
         "timestamp": datetime.now().strftime("%H:%M:%S")
     })
     
-    for package in required_packages:
-        try:
-            code_interpreter.notebook.exec_cell(f"!pip install {package} --quiet")
-        except Exception as e:
-            timeline_events.append({
-                "step": "Dependencies", 
-                "status": "error",
-                "details": f"Failed to install {package}: {str(e)}",
-                "timestamp": datetime.now().strftime("%H:%M:%S")
-            })
-            return timeline_events, False
+    try:
+        environment = dependency_manager.ensure(sandbox, required_packages)
+    except Exception as e:
+        timeline_events.append({
+            "step": "Dependencies", 
+            "status": "error",
+            "details": f"Failed to install {', '.join(required_packages)}: {str(e)}",
+            "timestamp": datetime.now().strftime("%H:%M:%S")
+        })
+        return timeline_events, False
     
     timeline_events.append({
         "step": "Dependencies", 
         "status": "complete",
-        "details": "Successfully installed all required packages",
+        "details": f"Environment {environment['hash']} ready ({environment['source']})",
         "timestamp": datetime.now().strftime("%H:%M:%S")
     })
     
@@ -967,19 +2126,6 @@ def openoperator():
                     throw new Error(data.message);
                 }
 
-                // Update timeline with the single timeline event
-                if (data.timeline_event) {
-                    const card = document.createElement('div');
-                    card.className = `timeline-card ${data.timeline_event.status}`;
-                    card.innerHTML = `
-                        <div class="timeline-step">${data.timeline_event.step}</div>
-                        <div class="timeline-details">${data.timeline_event.details}</div>
-                        <div class="timeline-timestamp">${data.timeline_event.timestamp}</div>
-                    `;
-                    timelineCards.appendChild(card);
-                    timelineCards.scrollLeft = timelineCards.scrollWidth;
-                }
-                
                 // Store important data for next steps
                 if (data.sandbox_id) {
                     formData.set('sandbox_id', data.sandbox_id);
@@ -1002,34 +2148,36 @@ def openoperator():
                     const outputDiv = document.getElementById('output');
                     data.generated_files.forEach(file => {
                         const img = document.createElement('img');
-                        img.src = `data:image/png;base64,${file.content}`;
+                        img.src = file.url || `data:image/png;base64,${file.content}`;
                         img.style.maxWidth = '100%';
                         img.style.marginTop = '10px';
                         outputDiv.appendChild(img);
                     });
                 }
 
-                if (data.timeline_event) {
+                // A step can report several events (the start step uploads code and data)
+                const stepEvents = data.timeline_events || (data.timeline_event ? [data.timeline_event] : []);
+                stepEvents.forEach(timelineEvent => {
                     const card = document.createElement('div');
                     card.className = 'timeline-card';
-                    card.setAttribute('data-step', data.timeline_event.step);
-                    card.setAttribute('data-status', data.timeline_event.status);
+                    card.setAttribute('data-step', timelineEvent.step);
+                    card.setAttribute('data-status', timelineEvent.status);
                     
                     card.innerHTML = `
-                        <div class="timeline-header" style="background-color: ${data.timeline_event.color}">
-                            <div class="timeline-step">${data.timeline_event.step}</div>
-                            <div class="timeline-timestamp">${data.timeline_event.timestamp}</div>
+                        <div class="timeline-header" style="background-color: ${timelineEvent.color}">
+                            <div class="timeline-step">${timelineEvent.step}</div>
+                            <div class="timeline-timestamp">${timelineEvent.timestamp}</div>
                         </div>
                         <div class="timeline-content">
-                            <div class="timeline-details">${data.timeline_event.details}</div>
+                            <div class="timeline-details">${timelineEvent.details}</div>
                             <div class="timeline-expanded" style="display: none;">
                                 <div class="timeline-input">
                                     <h4>Input:</h4>
-                                    <pre><code>${data.timeline_event.input || 'No input'}</code></pre>
+                                    <pre><code>${timelineEvent.input || 'No input'}</code></pre>
                                 </div>
                                 <div class="timeline-output">
                                     <h4>Output:</h4>
-                                    <pre><code>${data.timeline_event.output || 'No output'}</code></pre>
+                                    <pre><code>${timelineEvent.output || 'No output'}</code></pre>
                                 </div>
                             </div>
                         </div>
@@ -1043,7 +2191,7 @@ def openoperator():
                     
                     timelineCards.appendChild(card);
                     timelineCards.scrollTop = timelineCards.scrollHeight;
-                }
+                });
 
                 // Handle next step or completion
                 if (data.next_step === 'complete') {
@@ -1207,6 +2355,9 @@ def openoperator():
 
 if __name__ == "__main__":
     try:
+        sandbox_pool.start()
+        sandbox_reaper.start()
+        wait_for_tokenizer()
         app.run(port=port)
     except Exception as e:
         print(f"Failed to start server: {str(e)}")
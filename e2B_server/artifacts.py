@@ -0,0 +1,207 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shlex
+import tarfile
+import tempfile
+import threading
+import time
+
+
+DEFAULT_ARTIFACT_GLOBS = ['*.png', '*.jpg', '*.jpeg', '*.pdf']
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Archives and archive members are copied in pieces of this size, never whole
+CHUNK_SIZE = 1024 * 1024
+
+# How often the store is swept for expired artifacts while it stays under its size cap
+PRUNE_INTERVAL = 60
+
+# Output logs spilled by runs; not in every platform's mime table
+mimetypes.add_type('text/plain', '.log')
+
+# Runs inside the sandbox: packs every file matching the globs into one archive
+# and prints the list of packed paths as JSON.
+COLLECTOR_SCRIPT = '''
+import glob, json, os, sys, tarfile
+archive, patterns = sys.argv[1], json.loads(sys.argv[2])
+names = sorted({p for pattern in patterns for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)})
+with tarfile.open(archive, 'w:gz') as tar:
+    for name in names:
+        tar.add(name)
+print(json.dumps(names))
+'''
+
+
+class ArtifactStore:
+    """Content-addressed storage for files produced by runs.
+
+    Each artifact is stored once under its SHA-256, with a small JSON sidecar holding
+    the original file name and content type.
+
+    Artifacts not stored again for `ttl` seconds are deleted, and when the store holds
+    more than `max_bytes` the least recently stored go first. The artifact just stored is
+    never evicted by its own put, so a result never links to a file that is already gone.
+    """
+
+    def __init__(self, root, ttl=None, max_bytes=None):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = 0
+        self._pruned_at = 0.0
+        os.makedirs(root, exist_ok=True)
+        self.prune()
+
+    def path(self, digest):
+        if not HASH_PATTERN.match(digest):
+            return None
+        path = os.path.join(self.root, digest)
+        return path if os.path.exists(path) else None
+
+    def metadata(self, digest):
+        with open(os.path.join(self.root, f'{digest}.json')) as f:
+            return json.load(f)
+
+    def put(self, name, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.root, digest)
+        with self._lock:
+            stored = self._refresh(path)
+        if not stored:
+            self._write_atomic(path, data)
+        return self._stored(name, digest, len(data), stored)
+
+    def put_stream(self, name, chunks):
+        """Like put, for content too large to hold in memory: hashed while it is written"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, partial = tempfile.mkstemp(dir=self.root, prefix='.partial-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(partial)
+            raise
+        digest = digest.hexdigest()
+        path = os.path.join(self.root, digest)
+        with self._lock:
+            stored = self._refresh(path)
+        if stored:
+            os.unlink(partial)
+        else:
+            os.replace(partial, path)
+        return self._stored(name, digest, size, stored)
+
+    def prune(self, keep=None):
+        """Delete expired artifacts, then the oldest ones while the store is over `max_bytes`"""
+        with self._lock:
+            self._prune(keep)
+
+    def _refresh(self, path):
+        # Storing existing content again restarts its time to live
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _stored(self, name, digest, size, existed):
+        description = self._describe(name, digest, size)
+        with self._lock:
+            if not existed:
+                self._size += size
+            over = self.max_bytes is not None and self._size > self.max_bytes
+            if over or (self.ttl is not None and time.monotonic() - self._pruned_at > PRUNE_INTERVAL):
+                self._prune(keep=digest)
+        return description
+
+    def _prune(self, keep=None):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.partial-'):
+                # Left behind by a write that died; live ones are seconds old
+                if now - entry.stat().st_mtime > 3600:
+                    self._remove(entry.path)
+                continue
+            if not HASH_PATTERN.match(entry.name):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, digest in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            over = self.max_bytes is not None and total > self.max_bytes
+            if digest == keep or not (expired or over):
+                continue
+            self._remove(os.path.join(self.root, digest))
+            self._remove(os.path.join(self.root, f'{digest}.json'))
+            total -= size
+        self._size = total
+        self._pruned_at = time.monotonic()
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _describe(self, name, digest, size):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        sidecar = os.path.join(self.root, f'{digest}.json')
+        if not os.path.exists(sidecar):
+            self._write_atomic(sidecar, json.dumps({
+                'name': os.path.basename(name),
+                'content_type': content_type,
+                'size': size
+            }).encode('utf-8'))
+        return {
+            'name': name,
+            'hash': digest,
+            'size': size,
+            'content_type': content_type,
+            'url': f'/artifacts/{digest}'
+        }
+
+    def _write_atomic(self, path, data):
+        fd, partial = tempfile.mkstemp(dir=self.root, prefix='.partial-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+
+def collect_artifacts(sandbox, store, globs, archive='/tmp/openoperator-artifacts.tar.gz'):
+    """Pack matching files inside the sandbox, fetch them in one transfer and store them"""
+    result = sandbox.commands.run(
+        f"python -c {shlex.quote(COLLECTOR_SCRIPT)} {archive} {shlex.quote(json.dumps(globs))}"
+    )
+    if not json.loads(result.stdout or '[]'):
+        return []
+
+    # Spooled to disk, so neither the archive nor a member is ever held in memory whole
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+        for chunk in sandbox.files.read(archive, format='stream'):
+            spool.write(chunk)
+        spool.seek(0)
+        return store_archive(store, spool)
+
+
+def store_archive(store, archive):
+    """Store every file of a tar.gz read from the file object `archive`"""
+    artifacts = []
+    with tarfile.open(fileobj=archive, mode='r:gz') as tar:
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            f = tar.extractfile(member)
+            artifacts.append(store.put_stream(member.name, iter(lambda: f.read(CHUNK_SIZE), b'')))
+    return artifacts
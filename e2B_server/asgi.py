@@ -0,0 +1,845 @@
+"""ASGI variant of the execution server.
+
+Serves `/execute`, `/kill-sandboxes` and `/test` on a single event loop with the async
+Mistral and E2B clients, so a run waiting on the network holds a coroutine instead of
+a thread. Run it with:
+
+    uvicorn asgi:app --port 8000
+
+Configuration, caches, metrics, the Mistral gateway and the helpers that do no I/O are shared
+with app.py. This variant always uses E2B sandboxes.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import json
+import os
+import shlex
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from e2b import AsyncSandbox, CommandExitException
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import FileStorage
+
+from app import (
+    ARTIFACT_GLOBS, BENCHMARK_TIMEOUT, CHUNK_CONCURRENCY, COMMAND_TIMEOUT_SECONDS, DATA_UPLOAD_WORKERS,
+    DISCONNECT_POLL_SECONDS, EXECUTE_TIMEOUT_SECONDS, INSTANCE_ID, LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS,
+    OPTIMIZATION_REPAIR_ATTEMPTS, OPTIMIZATION_STREAMING, OUTPUT_CAPTURE_CHARS, OUTPUT_LOG_MAX_BYTES,
+    OUTPUT_STREAM_MAX_BYTES, RESPONSE_COMPRESSION_MIN_BYTES, RUNS_IN_FLIGHT, RUNS_STOPPED, SANDBOX_APP_NAME,
+    SANDBOX_CALL_SECONDS, SANDBOX_HEALTH_INTERVAL, SANDBOX_KILL_TIMEOUT, SANDBOX_KILL_WORKERS,
+    SANDBOX_POOL_MIN, SANDBOX_REAP_IDLE, SANDBOX_REAP_INTERVAL, SANDBOX_REAP_TTL, SANDBOX_TIMEOUT,
+    STAGE_SECONDS, STREAM_FORMATS, SYSTEM_PROMPT, add_event, artifact_store, assemble_chunks,
+    benchmark_options, captured_output, check_optimization, chunk_check, client, describe_environment,
+    encode_message, ensure_packages, error_response, error_status, finish_chunk, kill_summary, llm_model,
+    llm_timeout_ms, metrics, new_run, optimization_cache, optimization_key, publish, record_route,
+    reject_optimization, request_deadline, run_result, script_packages, start_chunk, strip_code_fences,
+    tournament_options, wait_for_tokenizer
+)
+from artifacts import CHUNK_SIZE as ARTIFACT_CHUNK_SIZE, COLLECTOR_SCRIPT, store_archive
+from backends import E2BBackend
+from benchmark import benchmark_command, benchmark_report, describe as describe_benchmark, format_comparison
+from deadlines import AsyncDeadlineCommands, Deadline, DeadlineExceeded, RunCancelled
+from dependencies import normalize_package
+from metrics import timed
+from output_capture import OUTPUT_LOG_PATH, OutputRing, tee_command
+from preflight import IncrementalSyntaxCheck, PreflightError, delta_text
+from reaper import SandboxReaper
+from response_format import encode_payload, requested_version
+from routing import PromptTooLarge
+from uploads import upload_data_files
+
+# Async server settings
+ASYNC_MAX_RUNS = int(os.getenv('ASYNC_MAX_RUNS', '500'))
+ASYNC_MAX_SANDBOXES = int(os.getenv('ASYNC_MAX_SANDBOXES', '50'))
+ASYNC_MAX_LLM_CALLS = int(os.getenv('ASYNC_MAX_LLM_CALLS', '64'))
+ASYNC_WARM_SANDBOXES = int(os.getenv('ASYNC_WARM_SANDBOXES', str(SANDBOX_POOL_MIN)))
+# Seconds a warm sandbox gets to answer the probe on checkout
+SANDBOX_PROBE_TIMEOUT = float(os.getenv('SANDBOX_PROBE_TIMEOUT', '10'))
+
+# Created on startup, inside the server's event loop
+run_slots = None
+sandbox_slots = None
+llm_slots = None
+warm_sandboxes = None
+background_tasks = set()
+# Sandboxes this server holds, warm or serving a run; the reaper leaves them alone
+held_sandboxes = set()
+# Same reaper as app.py, listing and killing through the synchronous SDK on its own thread
+reaper_backend = E2BBackend(timeout=SANDBOX_TIMEOUT, kill_timeout=SANDBOX_KILL_TIMEOUT)
+sandbox_reaper = SandboxReaper(
+    reaper_backend.list,
+    reaper_backend.kill,
+    app_name=SANDBOX_APP_NAME,
+    instance_id=INSTANCE_ID,
+    is_tracked=held_sandboxes.__contains__,
+    is_protected=held_sandboxes.__contains__,
+    ttl=SANDBOX_REAP_TTL,
+    idle=SANDBOX_REAP_IDLE,
+    interval=SANDBOX_REAP_INTERVAL,
+    workers=SANDBOX_KILL_WORKERS
+)
+# Blocking helpers shared with app.py (data uploads, dependencies), at most two per sandbox. Kept off
+# the default executor so a crowd of them waiting on the loop cannot starve other to_thread calls
+helper_threads = concurrent.futures.ThreadPoolExecutor(max_workers=2 * ASYNC_MAX_SANDBOXES,
+                                                       thread_name_prefix='sandbox-helper')
+
+
+def spawn(coroutine):
+    # Keep a reference so fire-and-forget tasks are not garbage collected mid-flight
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def create_sandbox():
+    sandbox = await AsyncSandbox.create(timeout=SANDBOX_TIMEOUT, metadata={
+        'app': SANDBOX_APP_NAME,
+        'instance': INSTANCE_ID,
+        'created_at': datetime.utcnow().isoformat()
+    })
+    held_sandboxes.add(sandbox.sandbox_id)
+    return sandbox
+
+
+async def kill_sandbox(sandbox_id):
+    try:
+        await AsyncSandbox.kill(sandbox_id, request_timeout=SANDBOX_KILL_TIMEOUT)
+    finally:
+        held_sandboxes.discard(sandbox_id)
+
+
+async def refresh_warm_sandboxes():
+    """Extend the timeout of warm sandboxes idle for a health interval, dropping any that are gone"""
+    now = time.monotonic()
+    entries = []
+    while not warm_sandboxes.empty():
+        entries.append(warm_sandboxes.get_nowait())
+    for sandbox, checked_at in entries:
+        if now - checked_at < SANDBOX_HEALTH_INTERVAL:
+            warm_sandboxes.put_nowait((sandbox, checked_at))
+            continue
+        try:
+            # Without this E2B kills the sandbox SANDBOX_TIMEOUT seconds after it booted
+            await sandbox.set_timeout(SANDBOX_TIMEOUT)
+            warm_sandboxes.put_nowait((sandbox, time.monotonic()))
+        except Exception as e:
+            print(f"Health check failed for sandbox {sandbox.sandbox_id}: {str(e)}")
+            spawn(discard_sandbox(sandbox))
+
+
+async def keep_warm():
+    """Keep ASYNC_WARM_SANDBOXES booted sandboxes ready so runs skip boot latency"""
+    while True:
+        await refresh_warm_sandboxes()
+        if warm_sandboxes.qsize() < ASYNC_WARM_SANDBOXES:
+            try:
+                warm_sandboxes.put_nowait((await create_sandbox(), time.monotonic()))
+                continue
+            except Exception as e:
+                print(f"Error warming sandbox: {str(e)}")
+        await asyncio.sleep(1)
+
+
+async def discard_sandbox(sandbox):
+    try:
+        await kill_sandbox(sandbox.sandbox_id)
+    except Exception as e:
+        print(f"Error killing sandbox {sandbox.sandbox_id}: {str(e)}")
+
+
+async def checkout_sandbox():
+    """A warm sandbox that still answers, or a new one"""
+    while True:
+        try:
+            sandbox, _ = warm_sandboxes.get_nowait()
+        except asyncio.QueueEmpty:
+            return await create_sandbox()
+        try:
+            await sandbox.commands.run('true', timeout=SANDBOX_PROBE_TIMEOUT)
+            return sandbox
+        except Exception as e:
+            print(f"Discarding dead warm sandbox {sandbox.sandbox_id}: {str(e)}")
+            spawn(discard_sandbox(sandbox))
+
+
+async def retire_sandbox(sandbox):
+    try:
+        await sandbox.kill(request_timeout=SANDBOX_KILL_TIMEOUT)
+    except Exception as e:
+        print(f"Error killing sandbox {sandbox.sandbox_id}: {str(e)}")
+    finally:
+        held_sandboxes.discard(sandbox.sandbox_id)
+        sandbox_slots.release()
+
+
+class Timed:
+    """Times awaited sandbox calls the way TracedSandbox does for the synchronous app"""
+
+    def __init__(self, target, prefix, trace):
+        self._target = target
+        self._prefix = prefix
+        self._trace = trace
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        operation = f'{self._prefix}.{name}'
+
+        async def call(*args, **kwargs):
+            with timed(SANDBOX_CALL_SECONDS, self._trace, f'sandbox:{operation}', operation=operation):
+                return await attribute(*args, **kwargs)
+        return call
+
+
+class Blocking:
+    """Synchronous view of an async sandbox API for helpers shared with app.py.
+
+    Only for worker threads: each call is run on the server's event loop and waited for.
+    Async iterators, such as a streamed file read, are handed back as plain iterators.
+    """
+
+    def __init__(self, target, sandbox):
+        self._target = target
+        self._sandbox = sandbox
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+
+        def call(*args, **kwargs):
+            result = self._sandbox.wait(attribute(*args, **kwargs))
+            if hasattr(result, '__anext__'):
+                return self._sandbox.iterate(result)
+            return result
+        return call
+
+
+class BlockingSandbox:
+    """The run's sandbox as seen from a worker thread, stopped together with the run.
+
+    Once the run is cancelled, calls in flight are cancelled on the loop and later ones raise
+    RunCancelled, so the helper winds down instead of working in a sandbox being retired.
+    """
+
+    def __init__(self, run, loop):
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._cancelled = False
+        self.commands = Blocking(run['commands'], self)
+        self.files = Blocking(run['files'], self)
+
+    def wait(self, coroutine):
+        with self._lock:
+            if self._cancelled:
+                coroutine.close()
+                raise RunCancelled("Run was cancelled")
+            future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+            self._pending.add(future)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise RunCancelled("Run was cancelled") from None
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+
+    def iterate(self, chunks):
+        async def step():
+            try:
+                return False, await chunks.__anext__()
+            except StopAsyncIteration:
+                return True, None
+        while True:
+            done, chunk = self.wait(step())
+            if done:
+                return
+            yield chunk
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+
+async def in_thread(run, helper, *args, **kwargs):
+    """Run a blocking helper shared with app.py against the run's sandbox in a worker thread"""
+    sandbox = BlockingSandbox(run, asyncio.get_running_loop())
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            helper_threads, functools.partial(helper, sandbox, *args, **kwargs))
+    except asyncio.CancelledError:
+        sandbox.cancel()
+        raise
+
+
+async def run_together(*coroutines):
+    """Await the stages concurrently; when one fails the others are cancelled and waited for"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in tasks:
+        if task in done and not task.cancelled() and task.exception():
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+def traced(name, stage):
+    async def run_stage(run):
+        run['deadline'].check(f"the {name} stage")
+        with timed(STAGE_SECONDS, run['trace'], f'stage:{name}', stage=name):
+            return await stage(run)
+    return run_stage
+
+
+# Pipeline stages, mirroring the synchronous ones in app.py
+
+async def stage_sandbox(run):
+    await sandbox_slots.acquire()
+    try:
+        sandbox = await checkout_sandbox()
+    except BaseException:
+        sandbox_slots.release()
+        raise
+    run['sandbox'] = sandbox
+    commands = AsyncDeadlineCommands(sandbox.commands, run['deadline'], COMMAND_TIMEOUT_SECONDS)
+    run['commands'] = Timed(commands, 'commands', run['trace'])
+    run['files'] = Timed(sandbox.files, 'files', run['trace'])
+    print(f"[{run['trace'].trace_id}] Sandbox checked out", sandbox.sandbox_id)
+
+
+async def stage_upload_script(run):
+    await run['files'].write('script.py', run['python_code'])
+    add_event(run, "File Upload", "complete",
+              f"Uploaded Python file: {run['filename']}", "blue",
+              run['python_code'], f"Wrote script.py ({len(run['python_code'])} characters)")
+
+
+async def stage_upload_data(run):
+    data_files = run['data_files']
+    if not data_files:
+        return
+    # Starlette has spooled the uploads already; hashing and sending them from their spool
+    # files blocks, so the shared helper runs in a thread and calls back into the loop
+    uploaded = await in_thread(
+        run, upload_data_files,
+        [FileStorage(stream=data_file.file, filename=data_file.filename) for data_file in data_files],
+        workers=DATA_UPLOAD_WORKERS
+    )
+    sent = sum(1 for f in uploaded if not f['reused'])
+    add_event(run, "Data Upload", "complete",
+              f"Uploaded data files: {', '.join([f['name'] for f in uploaded])} "
+              f"({sent} sent, {len(uploaded) - sent} already in sandbox)", "purple",
+              str([f['name'] for f in uploaded]),
+              '\n'.join(f"data/{f['name']}  {f['size']} bytes  {f['hash'][:12]}  {'reused' if f['reused'] else 'sent'}"
+                        for f in uploaded))
+
+
+async def stage_dependencies(run):
+    # Shares DependencyManager with app.py, so both servers seal and reuse environments alike
+    packages, guessed = script_packages(run, run['python_code'])
+    environment, skipped = await in_thread(run, ensure_packages, packages, guessed)
+    run['environment'] = environment
+    add_event(run, "Dependencies", "complete", describe_environment(environment, skipped), "orange",
+              ' '.join(packages) or "(none)",
+              environment['output'] or f"Reused prepared environment {environment['hash']}")
+
+
+async def stage_optimized_dependencies(run):
+    packages, guessed = script_packages(run, run['optimized_code'])
+    environment = run['environment']
+    held = set(environment['packages'])
+    missing = [p for p in packages if normalize_package(p) not in held]
+    if not missing:
+        return
+    extra, skipped = await in_thread(run, ensure_packages, missing, [p for p in guessed if p in missing])
+    if extra['source'] != 'empty':
+        run['environment'] = dict(environment, envs={
+            'PYTHONPATH': f"{environment['envs']['PYTHONPATH']}:{extra['envs']['PYTHONPATH']}"
+        }, packages=sorted(held | set(extra['packages'])))
+    add_event(run, "Dependencies", "complete",
+              f"Optimized code needs {', '.join(missing)}: {describe_environment(extra, skipped)}", "orange",
+              ' '.join(missing), extra['output'] or f"Reused prepared environment {extra['hash']}")
+
+
+async def stream_optimization(run, messages, chunk=None):
+    check = IncrementalSyntaxCheck()
+    content = []
+    start = time.perf_counter()
+    model = llm_model(run, chunk)
+    with timed(LLM_SECONDS, run['trace'], 'llm:chat.stream', model=model):
+        stream = await client.chat.stream_async(model=model, messages=messages,
+                                                timeout_ms=llm_timeout_ms(run))
+        async with stream:
+            async for event in stream:
+                run['deadline'].check('the optimization finished')
+                if not event.data.choices:
+                    continue
+                text = delta_text(event.data.choices[0].delta)
+                if not text:
+                    continue
+                if not content:
+                    first_token = time.perf_counter() - start
+                    LLM_FIRST_TOKEN_SECONDS.observe(first_token, model=model)
+                    run['trace'].record('llm:first_token', start, first_token, model=model)
+                content.append(text)
+                message = {'type': 'optimized_code_delta', 'delta': text}
+                if chunk is not None:
+                    message['chunk'] = chunk
+                publish(run, message)
+                if check.feed(text):
+                    break
+    if check.error:
+        raise PreflightError(f"Optimized code does not compile: {check.error}",
+                             code=check.code, problems=[('syntax', check.error)])
+    return strip_code_fences(''.join(content))
+
+
+async def generate_optimization(run, messages, chunk=None):
+    async with llm_slots:
+        if OPTIMIZATION_STREAMING:
+            return await stream_optimization(run, messages, chunk)
+        model = llm_model(run, chunk)
+        with timed(LLM_SECONDS, run['trace'], 'llm:chat.complete', model=model):
+            mistral_response = await client.chat.complete_async(model=model, messages=messages,
+                                                                timeout_ms=llm_timeout_ms(run))
+        return strip_code_fences(mistral_response.choices[0].message.content)
+
+
+async def optimize_with_repairs(run, messages, chunk=None, check=check_optimization):
+    for attempt in range(OPTIMIZATION_REPAIR_ATTEMPTS + 1):
+        try:
+            code = await generate_optimization(run, messages, chunk)
+            problems = check(run, code)
+        except PreflightError as e:
+            code, problems = e.code, e.problems
+        if not problems:
+            return code
+        messages = reject_optimization(run, messages, code, problems, attempt)
+
+
+async def optimize_chunk(run, plan, index, slots):
+    entry, messages = start_chunk(run, plan, index)
+    if 'code' in entry:
+        return entry
+    async with slots:
+        try:
+            code = await optimize_with_repairs(run, messages, chunk=index, check=chunk_check(entry))
+        except PreflightError as e:
+            return finish_chunk(entry, error=e)
+    return finish_chunk(entry, code)
+
+
+async def optimize_chunks(run, plan):
+    slots = asyncio.Semaphore(CHUNK_CONCURRENCY)
+    tasks = [asyncio.create_task(optimize_chunk(run, plan, index, slots)) for index in range(len(plan.chunks))]
+    try:
+        entries = await asyncio.gather(*tasks)
+    except BaseException:
+        # A failing chunk (deadline, Mistral unavailable) stops the others
+        for task in tasks:
+            task.cancel()
+        raise
+    return assemble_chunks(run, plan, entries)
+
+
+async def stage_optimize(run):
+    record_route(run)
+    key = optimization_key(run)
+    cached = optimization_cache.get(key)
+    run['optimization_cached'] = cached is not None
+    if cached is not None:
+        run['optimized_code'] = cached
+    else:
+        if run['chunk_plan'] is not None:
+            run['optimized_code'] = await optimize_chunks(run, run['chunk_plan'])
+        else:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": run['python_code']}
+            ]
+            run['optimized_code'] = await optimize_with_repairs(run, messages)
+        optimization_cache.put(key, run['optimized_code'])
+    publish(run, {'type': 'optimized_code', 'optimized_code': run['optimized_code']})
+
+
+async def stage_write_optimized(run):
+    await run['files'].write('optimized_script.py', run['optimized_code'])
+    details = "Code optimized successfully"
+    if run['optimization_cached']:
+        details += " (cached)"
+    add_event(run, "Code Optimization", "complete", details, "yellow",
+              run['python_code'], run['optimized_code'])
+
+
+async def stage_execute(run):
+    stdout, stderr = OutputRing(OUTPUT_CAPTURE_CHARS), OutputRing(OUTPUT_CAPTURE_CHARS)
+
+    def forward(ring, stream):
+        def on_output(text):
+            ring.write(text)
+            publish(run, {'type': 'output_delta', 'stream': stream, 'data': text})
+        return on_output
+
+    try:
+        await run['commands'].run(
+            tee_command('optimized_script.py', OUTPUT_STREAM_MAX_BYTES, OUTPUT_LOG_MAX_BYTES),
+            envs=run['environment']['envs'],
+            timeout=EXECUTE_TIMEOUT_SECONDS,
+            on_stdout=forward(stdout, 'stdout'),
+            on_stderr=forward(stderr, 'stderr')
+        )
+    except CommandExitException as e:
+        raise RuntimeError(f"Script exited with code {e.exit_code}: {stderr.getvalue()[-2000:].strip()}") from None
+
+    run['output_log'] = None
+    if stdout.truncated or stderr.truncated:
+        try:
+            run['output_log'] = await spill_output_log(run)
+        except Exception as e:
+            print(f"Error saving the output log: {str(e)}")
+    run['output'] = captured_output(stdout, run['output_log'])
+
+    generated_files = []
+    try:
+        generated_files = await collect_artifacts(run)
+    except Exception as e:
+        print(f"Error checking for generated files: {str(e)}")
+    run['generated_files'] = generated_files
+
+    add_event(run, "Execution", "complete", "Code executed successfully", "teal",
+              "Running optimized script", run['output'])
+    publish(run, {'type': 'output', 'output': run['output'], 'generated_files': generated_files,
+                  'output_log': run['output_log']})
+
+
+async def spill_output_log(run):
+    # Buffered in a spooled file, so a large log never sits in memory
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with spool:
+        async for chunk in await run['files'].read(OUTPUT_LOG_PATH, format='stream'):
+            spool.write(chunk)
+        spool.seek(0)
+        return await asyncio.to_thread(artifact_store.put_stream, 'output.log',
+                                       iter(lambda: spool.read(1024 * 1024), b''))
+
+
+async def stage_benchmark(run):
+    options = run['benchmark_options']
+    runs, warmup = options['runs'], options['warmup']
+    try:
+        result = await run['commands'].run(
+            benchmark_command('script.py', 'optimized_script.py', runs, warmup),
+            envs=run['environment']['envs'], timeout=BENCHMARK_TIMEOUT
+        )
+        report = benchmark_report(result.stdout, 'script.py', 'optimized_script.py', runs, warmup)
+    except Exception as e:
+        print(f"Error benchmarking: {str(e)}")
+        run['benchmark'] = {'runs': runs, 'warmup': warmup, 'error': str(e)}
+        add_event(run, "Benchmark", "error", f"Benchmark failed: {str(e)}", "red",
+                  f"{runs} runs after {warmup} warmup", str(e))
+        publish(run, {'type': 'benchmark', 'benchmark': run['benchmark']})
+        return
+    run['benchmark'] = report
+    add_event(run, "Benchmark", "complete", describe_benchmark(report), "purple",
+              f"{runs} runs after {warmup} warmup, original and optimized alternating", format_comparison(report))
+    publish(run, {'type': 'benchmark', 'benchmark': report})
+
+
+async def collect_artifacts(run, archive='/tmp/openoperator-artifacts.tar.gz'):
+    result = await run['commands'].run(
+        f"python -c {shlex.quote(COLLECTOR_SCRIPT)} {archive} {shlex.quote(json.dumps(ARTIFACT_GLOBS))}"
+    )
+    if not json.loads(result.stdout or '[]'):
+        return []
+    with tempfile.SpooledTemporaryFile(max_size=ARTIFACT_CHUNK_SIZE) as spool:
+        async for chunk in await run['files'].read(archive, format='stream'):
+            spool.write(chunk)
+        spool.seek(0)
+        return await asyncio.to_thread(store_archive, artifact_store, spool)
+
+
+async def execute_run(run):
+    """Same stage graph as app.build_pipeline, expressed with tasks"""
+    RUNS_IN_FLIGHT.inc()
+    deadline = run['deadline']
+    # Whatever is still running when the budget runs out is cancelled, and the sandbox killed below
+    budget = asyncio.timeout(deadline.remaining())
+    optimize = asyncio.create_task(traced('optimize', stage_optimize)(run))
+    try:
+        async with budget:
+            await traced('sandbox', stage_sandbox)(run)
+            await run_together(
+                traced('upload_script', stage_upload_script)(run),
+                traced('upload_data', stage_upload_data)(run),
+                traced('dependencies', stage_dependencies)(run)
+            )
+            await optimize
+            await run_together(
+                traced('write_optimized', stage_write_optimized)(run),
+                traced('optimized_dependencies', stage_optimized_dependencies)(run)
+            )
+            await traced('execute', stage_execute)(run)
+            if run['benchmark_options']:
+                await traced('benchmark', stage_benchmark)(run)
+    except TimeoutError:
+        if not budget.expired():
+            raise
+        RUNS_STOPPED.inc(reason='deadline')
+        raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded") from None
+    except DeadlineExceeded:
+        RUNS_STOPPED.inc(reason='deadline')
+        raise
+    except asyncio.CancelledError:
+        # The client disconnected
+        RUNS_STOPPED.inc(reason='client_disconnected')
+        raise
+    finally:
+        RUNS_IN_FLIGHT.dec()
+        if not optimize.done():
+            optimize.cancel()
+        # Sandboxes are not reused here; kill in the background and let the warmer replace it
+        if run['sandbox']:
+            spawn(retire_sandbox(run['sandbox']))
+
+
+async def read_upload(request):
+    form = await request.form()
+    python_file = form.get('python_file')
+    if python_file is None or isinstance(python_file, str):
+        raise ValueError("No Python file uploaded")
+    if not python_file.filename.endswith('.py'):
+        raise ValueError("Invalid file type. Must be a .py file")
+    if tournament_options(form):
+        raise ValueError("Tournaments (candidates) are not supported by the async server")
+    python_code = (await python_file.read()).decode('utf-8')
+    data_files = [f for f in form.getlist('data_files') if not isinstance(f, str)]
+    run = new_run(python_code, python_file.filename, data_files)
+    run['benchmark_options'] = benchmark_options(form)
+    run['deadline'] = Deadline(request_deadline(form))
+    return run, form
+
+
+async def until_disconnect(request, coroutine):
+    """Await `coroutine`, cancelling it if the client hangs up first"""
+    task = asyncio.create_task(coroutine)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            raise RunCancelled("Run was cancelled (client disconnected)")
+
+
+def requested_stream_format(request, form):
+    stream_format = request.query_params.get('stream') or form.get('stream')
+    if stream_format in STREAM_FORMATS:
+        return stream_format
+    accept = request.headers.get('accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+
+async def stream_run(run, stream_format):
+    await run_slots.acquire()
+    messages = asyncio.Queue()
+    run['emit'] = messages.put_nowait
+
+    async def worker():
+        try:
+            await execute_run(run)
+            messages.put_nowait({
+                'type': 'complete',
+                'status': 'success',
+                'sandbox_id': run['sandbox'].sandbox_id,
+                'next_step': 'complete',
+                'trace_id': run['trace'].trace_id,
+                'trace': run['trace'].to_list()
+            })
+        except Exception as e:
+            print(f"Error in execute_code: {str(e)}")
+            messages.put_nowait(dict(error_response(e), type='error'))
+        finally:
+            messages.put_nowait(None)
+            run_slots.release()
+
+    task = asyncio.create_task(worker())
+    try:
+        yield encode_message(stream_format, {
+            'type': 'started',
+            'status': 'running',
+            'trace_id': run['trace'].trace_id,
+            'python_code': run['python_code']
+        })
+        while True:
+            message = await messages.get()
+            if message is None:
+                break
+            yield encode_message(stream_format, message)
+    finally:
+        # The client went away: stop the run instead of finishing it for nobody
+        if not task.done():
+            task.cancel()
+
+
+def send_payload(request, form, payload, status_code=200):
+    version = requested_version(request.query_params.get('response_format') or form.get('response_format'),
+                                request.headers.get('accept', ''))
+    accept_encoding = request.headers.get('accept-encoding', '')
+    if version == 1 and not accept_encoding:
+        return JSONResponse(payload, status_code=status_code)
+    body, headers = encode_payload(payload, version, request.headers.get('accept', ''), accept_encoding,
+                                   RESPONSE_COMPRESSION_MIN_BYTES)
+    return Response(body, status_code=status_code, headers=headers)
+
+
+async def execute_code(request):
+    try:
+        run, form = await read_upload(request)
+    except Exception as e:
+        return JSONResponse(error_response(e), status_code=413 if isinstance(e, PromptTooLarge) else 400)
+
+    stream_format = requested_stream_format(request, form)
+    if stream_format:
+        return StreamingResponse(
+            stream_run(run, stream_format),
+            media_type=STREAM_FORMATS[stream_format],
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    await run_slots.acquire()
+    try:
+        await until_disconnect(request, execute_run(run))
+        return send_payload(request, form, run_result(run))
+    except Exception as e:
+        print(f"Error in execute_code: {str(e)}")
+        return send_payload(request, form, error_response(e), error_status(e))
+    finally:
+        run_slots.release()
+
+
+async def kill_sandboxes(request):
+    try:
+        sandbox_ids = [sandbox_info.sandbox_id for sandbox_info in await AsyncSandbox.list()]
+    except Exception as e:
+        print(f"Error in kill_sandboxes: {str(e)}")
+        return JSONResponse({
+            'status': 'error',
+            'message': f"Failed to list/kill sandboxes: {str(e)}",
+            'errors': [str(e)]
+        }, status_code=500)
+
+    kill_slots = asyncio.Semaphore(SANDBOX_KILL_WORKERS)
+
+    async def kill(sandbox_id):
+        async with kill_slots:
+            try:
+                await kill_sandbox(sandbox_id)
+                return None
+            except Exception as e:
+                return e
+
+    errors = await asyncio.gather(*[kill(sandbox_id) for sandbox_id in sandbox_ids])
+    error_messages = [f"Failed to kill sandbox {sandbox_id}: {str(error)}"
+                      for sandbox_id, error in zip(sandbox_ids, errors) if error is not None]
+    killed_count = len(sandbox_ids) - len(error_messages)
+
+    # The warm sandboxes were among the ones killed
+    while not warm_sandboxes.empty():
+        warm_sandboxes.get_nowait()
+
+    return JSONResponse({
+        'status': 'success',
+        'message': kill_summary(killed_count, len(error_messages)),
+        'killed_count': killed_count,
+        'failed_count': len(error_messages),
+        'errors': error_messages
+    })
+
+
+async def test_connection(request):
+    try:
+        system_prompt = "You are a helpful assistant that can execute python code in a Jupyter notebook. Only respond with the code to be executed and nothing else. Strip backticks in code blocks."
+        prompt = "Write a simple Python code that prints 'Hello from E2B!' and does a basic math calculation of 2 + 2"
+
+        async with llm_slots:
+            response = await client.chat.complete_async(
+                model="mistral-large-latest",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+        code = strip_code_fences(response.choices[0].message.content)
+
+        async with sandbox_slots:
+            sandbox = await create_sandbox()
+            try:
+                await sandbox.files.write('test.py', code)
+                execution = await sandbox.commands.run('python test.py')
+            finally:
+                spawn(kill_sandbox(sandbox.sandbox_id))
+
+        return JSONResponse({
+            'status': 'success',
+            'response': str(response),
+            'message': 'E2B Sandbox is working correctly',
+            'test_output': execution.stdout,
+            'logs': execution.stderr or None
+        })
+    except Exception as e:
+        return JSONResponse({
+            'status': 'error',
+            'message': 'E2B Sandbox encountered an error',
+            'error': str(e)
+        }, status_code=500)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global run_slots, sandbox_slots, llm_slots, warm_sandboxes
+    run_slots = asyncio.Semaphore(ASYNC_MAX_RUNS)
+    sandbox_slots = asyncio.Semaphore(ASYNC_MAX_SANDBOXES)
+    llm_slots = asyncio.Semaphore(ASYNC_MAX_LLM_CALLS)
+    warm_sandboxes = asyncio.Queue()
+    warmer = asyncio.create_task(keep_warm())
+    sandbox_reaper.start()
+    await asyncio.to_thread(wait_for_tokenizer)
+    try:
+        yield
+    finally:
+        warmer.cancel()
+        sandbox_reaper.stop()
+        leftovers = []
+        while not warm_sandboxes.empty():
+            leftovers.append(warm_sandboxes.get_nowait())
+        await asyncio.gather(*[kill_sandbox(s.sandbox_id) for s, _ in leftovers], return_exceptions=True)
+
+
+app = Starlette(routes=[
+    Route('/execute', execute_code, methods=['POST']),
+    Route('/kill-sandboxes', kill_sandboxes, methods=['POST']),
+    Route('/test', test_connection),
+    Route('/metrics', metrics_endpoint)
+], lifespan=lifespan)
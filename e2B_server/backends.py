@@ -0,0 +1,402 @@
+import json
+import os
+import re
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import types
+import uuid
+from datetime import datetime, timezone
+
+from e2b import (CommandExitException, CommandResult, EntryInfo, FileType, NotFoundException, Sandbox,
+                 TimeoutException)
+
+from dependencies import REMOTE_ENV_ROOT
+from uploads import REMOTE_BLOB_ROOT
+
+
+class ExecutionBackend:
+    """Where scripts run.
+
+    `create` returns a workspace object shaped like an e2b Sandbox: `sandbox_id`,
+    `commands.run(cmd, background=False, envs=None, cwd=None, on_stdout=None,
+    on_stderr=None, timeout=60)`, `commands.kill(pid)`, `files.write/read/exists/list/
+    remove`, `is_running()`, `set_timeout(seconds)` and `kill()`. `list` returns objects
+    with `sandbox_id`, `metadata` and `started_at`, which is what the reaper needs.
+    `reset_command` is run by the pool, as `reset_user` if set, to clean a workspace
+    between runs. `env_owner` owns finished dependency environments.
+    """
+
+    name = None
+    reset_command = None
+    reset_user = None
+    env_owner = None
+
+    def create(self, metadata):
+        raise NotImplementedError
+
+    def list(self):
+        raise NotImplementedError
+
+    def kill(self, sandbox_id):
+        raise NotImplementedError
+
+
+class E2BBackend(ExecutionBackend):
+    """Remote E2B sandboxes"""
+
+    name = 'e2b'
+    # Clears everything a previous run left in the working directory and /tmp, and its
+    # uploads. Dependency environments stay only while they are sealed: the tree above them
+    # and every environment must be owned by root and not writable, anything else a script
+    # could have planted is removed
+    reset_command = (
+        "find /home/user -mindepth 1 -maxdepth 1 ! -name '.*' -exec rm -rf {} + ; "
+        "find /tmp -mindepth 1 -maxdepth 1 -user user -exec rm -rf {} + ; "
+        f"rm -rf {REMOTE_BLOB_ROOT} ; "
+        f"for d in {os.path.dirname(REMOTE_ENV_ROOT)} {REMOTE_ENV_ROOT}; do "
+        f"[ -e $d ] && [ \"$(stat -c %U $d)\" != root ] && rm -rf {os.path.dirname(REMOTE_ENV_ROOT)}; done ; "
+        f"find {REMOTE_ENV_ROOT} -mindepth 1 -maxdepth 1 \\( ! -user root -o -perm /222 -o ! -type d \\) "
+        "-exec rm -rf {} + 2>/dev/null ; true"
+    )
+    reset_user = 'root'
+    env_owner = 'root'
+
+    def __init__(self, timeout=600, kill_timeout=10, sandbox_class=Sandbox):
+        self.timeout = timeout
+        self.kill_timeout = kill_timeout
+        self.sandbox_class = sandbox_class
+
+    def create(self, metadata):
+        return self.sandbox_class(timeout=self.timeout, metadata=metadata)
+
+    def list(self):
+        return self.sandbox_class.list()
+
+    def kill(self, sandbox_id):
+        self.sandbox_class.kill(sandbox_id, request_timeout=self.kill_timeout)
+
+
+# Paths the server uses inside an E2B sandbox, mapped into each local workspace
+SANDBOX_HOME = '/home/user'
+SANDBOX_TMP = '/tmp'
+SANDBOX_PATH_PATTERN = re.compile(r'(?<![\w./-])(/home/user|/tmp)(?=/|\s|$|[\'";&|)])')
+# Sets the rlimits given as `resource:value,...` and execs the rest of its arguments
+LIMITS_SHIM = (
+    "import os, resource, sys\n"
+    "for item in filter(None, sys.argv[1].split(',')):\n"
+    "    limit, value = map(int, item.split(':'))\n"
+    "    resource.setrlimit(limit, (value, value))\n"
+    "os.execv(sys.argv[2], sys.argv[2:])\n"
+)
+
+
+class LocalCommandHandle:
+    """Mirrors e2b's CommandHandle for a local process"""
+
+    def __init__(self, process, workspace, on_stdout=None, on_stderr=None, timeout=None):
+        self.process = process
+        self.pid = process.pid
+        self._workspace = workspace
+        self._timeout = timeout
+        self._stdout = []
+        self._stderr = []
+        self._callbacks = {'stdout': on_stdout, 'stderr': on_stderr}
+        workspace._started(self)
+        self._readers = [
+            threading.Thread(target=self._pump, args=(process.stdout, self._stdout, 'stdout'), daemon=True),
+            threading.Thread(target=self._pump, args=(process.stderr, self._stderr, 'stderr'), daemon=True)
+        ]
+        for reader in self._readers:
+            reader.start()
+        self._reaper = threading.Thread(target=self._reap, daemon=True)
+        self._reaper.start()
+
+    def _pump(self, stream, chunks, name):
+        for line in iter(stream.readline, ''):
+            chunks.append(line)
+            callback = self._callbacks[name]
+            if callback:
+                callback(line)
+        stream.close()
+
+    def _reap(self):
+        # Frees the process slot once the process is gone, even if nobody waits on it
+        self.process.wait()
+        for reader in self._readers:
+            reader.join()
+        self._workspace._finished(self)
+
+    def wait(self, on_stdout=None, on_stderr=None):
+        self._callbacks['stdout'] = on_stdout or self._callbacks['stdout']
+        self._callbacks['stderr'] = on_stderr or self._callbacks['stderr']
+        try:
+            self.process.wait(timeout=self._timeout or None)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise TimeoutException(f"Command timed out after {self._timeout}s")
+        finally:
+            self._reaper.join()
+
+        result = dict(stdout=''.join(self._stdout), stderr=''.join(self._stderr),
+                      exit_code=self.process.returncode, error=None)
+        if self.process.returncode != 0:
+            raise CommandExitException(**result)
+        return CommandResult(**result)
+
+    def kill(self):
+        try:
+            # Commands run in their own session, so this also reaches their children
+            os.killpg(self.process.pid, signal.SIGKILL)
+            return True
+        except ProcessLookupError:
+            return False
+
+
+class LocalWorkspace:
+    """A directory and a process group standing in for one E2B sandbox.
+
+    `/home/user` and `/tmp` in paths, commands and environment values are mapped into
+    the workspace, so the server's sandbox code runs unchanged. Every process is started
+    in its own session with CPU, memory, file size and open-file rlimits applied.
+    `/home/user/.openoperator` is shared between workspaces, so dependency environments
+    are reused the same way they are in a pooled E2B sandbox.
+    """
+
+    def __init__(self, backend, sandbox_id, metadata):
+        self.backend = backend
+        self.sandbox_id = sandbox_id
+        self.metadata = metadata
+        self.started_at = datetime.now(timezone.utc)
+        self.root = os.path.join(backend.root, sandbox_id)
+        self.home = os.path.join(self.root, 'home')
+        self.tmp = os.path.join(self.root, 'tmp')
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._killed = False
+
+        os.makedirs(self.home)
+        os.makedirs(self.tmp)
+        os.symlink(backend.shared_dir, os.path.join(self.home, '.openoperator'))
+        with open(os.path.join(self.root, 'metadata.json'), 'w') as f:
+            json.dump({'metadata': metadata, 'started_at': self.started_at.isoformat()}, f)
+
+        self.commands = types.SimpleNamespace(run=self._run, kill=self._kill_process)
+        self.files = types.SimpleNamespace(write=self._write, read=self._read, exists=self._exists,
+                                           list=self._list, remove=self._remove)
+
+    def _translate(self, text):
+        return SANDBOX_PATH_PATTERN.sub(
+            lambda match: self.home if match.group(1) == SANDBOX_HOME else self.tmp, text)
+
+    def _path(self, path):
+        if not path.startswith('/'):
+            path = f'{SANDBOX_HOME}/{path}'
+        local = os.path.normpath(self._translate(path))
+        if not local.startswith(self.root + os.sep):
+            raise ValueError(f"Path outside the workspace: {path}")
+        return local
+
+    def _environment(self, envs):
+        environment = {
+            'PATH': os.pathsep.join([os.path.dirname(sys.executable), os.environ.get('PATH', '')]),
+            'HOME': self.home,
+            'TMPDIR': self.tmp,
+            'LANG': os.environ.get('LANG', 'C.UTF-8'),
+            'PYTHONUNBUFFERED': '1'
+        }
+        for key, value in (envs or {}).items():
+            environment[key] = self._translate(value)
+        return environment
+
+    def _run(self, cmd, background=False, envs=None, user=None, cwd=None, on_stdout=None,
+             on_stderr=None, timeout=60, request_timeout=None):
+        if self._killed:
+            raise RuntimeError(f"Workspace {self.sandbox_id} was killed")
+        self.backend.process_slots.acquire()
+        try:
+            process = subprocess.Popen(
+                self.backend.limit_prefix + ['/bin/sh', '-c', self._translate(cmd)],
+                cwd=self._path(cwd) if cwd else self.home,
+                env=self._environment(envs),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                errors='replace',
+                start_new_session=True
+            )
+        except Exception:
+            self.backend.process_slots.release()
+            raise
+        handle = LocalCommandHandle(process, self, on_stdout, on_stderr, timeout)
+        if background:
+            return handle
+        return handle.wait()
+
+    def _started(self, handle):
+        with self._lock:
+            self._handles[handle.pid] = handle
+
+    def _finished(self, handle):
+        with self._lock:
+            self._handles.pop(handle.pid, None)
+        self.backend.process_slots.release()
+
+    def _kill_process(self, pid, request_timeout=None):
+        with self._lock:
+            handle = self._handles.get(pid)
+        return handle.kill() if handle else False
+
+    def _write(self, path, data, user=None, request_timeout=None):
+        local = self._path(path)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(local, 'wb') as f:
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f)
+        return EntryInfo(name=os.path.basename(local), type=FileType.FILE, path=path)
+
+    def _read(self, path, format='text', user=None, request_timeout=None):
+        local = self._path(path)
+        if not os.path.isfile(local):
+            raise NotFoundException(f"File {path} not found")
+        if format == 'stream':
+            def chunks():
+                with open(local, 'rb') as f:
+                    yield from iter(lambda: f.read(1024 * 1024), b'')
+            return chunks()
+        with open(local, 'rb') as f:
+            data = f.read()
+        return data.decode('utf-8') if format == 'text' else bytearray(data)
+
+    def _exists(self, path, request_timeout=None):
+        return os.path.exists(self._path(path))
+
+    def _list(self, path, user=None, request_timeout=None):
+        local = self._path(path)
+        entries = []
+        for name in sorted(os.listdir(local)):
+            kind = FileType.DIR if os.path.isdir(os.path.join(local, name)) else FileType.FILE
+            entries.append(EntryInfo(name=name, type=kind, path=f'{path.rstrip("/")}/{name}'))
+        return entries
+
+    def _remove(self, path, user=None, request_timeout=None):
+        local = self._path(path)
+        if os.path.isdir(local) and not os.path.islink(local):
+            shutil.rmtree(local)
+        elif os.path.lexists(local):
+            os.remove(local)
+
+    def is_running(self, request_timeout=None):
+        return not self._killed and os.path.isdir(self.root)
+
+    def set_timeout(self, timeout, request_timeout=None):
+        # Local workspaces never expire on their own; the pool and the reaper retire them
+        pass
+
+    def kill(self, request_timeout=None):
+        self._killed = True
+        with self._lock:
+            handles = list(self._handles.values())
+        for handle in handles:
+            handle.kill()
+        self.backend.forget(self.sandbox_id)
+        shutil.rmtree(self.root, ignore_errors=True)
+        return True
+
+
+class LocalBackend(ExecutionBackend):
+    """Runs scripts in isolated local workspaces instead of remote sandboxes.
+
+    There is no network round trip per command or file operation, which makes it the
+    fast choice for trusted internal scripts. It is not a security boundary: scripts run
+    as the server's user, contained only by rlimits and their own working directory.
+    `max_processes` caps how many commands run at the same time across all workspaces.
+    """
+
+    name = 'local'
+    # The workspace's /tmp is private to it, so it needs no owner filter
+    reset_command = (
+        "find /home/user -mindepth 1 -maxdepth 1 ! -name '.*' -exec rm -rf {} + ; "
+        "find /tmp -mindepth 1 -maxdepth 1 -exec rm -rf {} + ; "
+        f"rm -rf {REMOTE_BLOB_ROOT} ; true"
+    )
+
+    def __init__(self, root, cpu_seconds=300, memory_mb=4096, file_size_mb=1024, open_files=1024,
+                 max_processes=32):
+        self.root = os.path.abspath(root)
+        self.shared_dir = os.path.join(self.root, 'shared')
+        os.makedirs(self.shared_dir, exist_ok=True)
+        self.limits = [
+            ('cpu', resource.RLIMIT_CPU, cpu_seconds),
+            ('as', resource.RLIMIT_AS, memory_mb * 1024 * 1024),
+            ('fsize', resource.RLIMIT_FSIZE, file_size_mb * 1024 * 1024),
+            ('nofile', resource.RLIMIT_NOFILE, open_files)
+        ]
+        self.limit_prefix = self._limit_prefix()
+        self.process_slots = threading.BoundedSemaphore(max_processes)
+        self._workspaces = {}
+        self._lock = threading.Lock()
+
+    def _limit_prefix(self):
+        """Command prefix that applies the rlimits and then execs the command.
+
+        The limits are set by a separate program rather than a preexec_fn, which is not safe
+        to run in a multithreaded server. prlimit is used where installed, as it starts in
+        a millisecond; otherwise a small Python shim does the same.
+        """
+        limits = [(option, limit, value) for option, limit, value in self.limits if value]
+        prlimit = shutil.which('prlimit')
+        if prlimit:
+            return [prlimit] + [f'--{option}={value}:{value}' for option, _, value in limits] + ['--']
+        return [sys.executable, '-S', '-c', LIMITS_SHIM,
+                ','.join(f'{limit}:{value}' for _, limit, value in limits)]
+
+    def create(self, metadata):
+        workspace = LocalWorkspace(self, f'local-{uuid.uuid4().hex[:12]}', metadata)
+        with self._lock:
+            self._workspaces[workspace.sandbox_id] = workspace
+        return workspace
+
+    def forget(self, sandbox_id):
+        with self._lock:
+            self._workspaces.pop(sandbox_id, None)
+
+    def list(self):
+        # Read from disk so workspaces left behind by an earlier process are reaped too
+        infos = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name, 'metadata.json')
+            if not name.startswith('local-') or not os.path.exists(path):
+                continue
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                continue
+            infos.append(types.SimpleNamespace(
+                sandbox_id=name,
+                template_id='local',
+                name='local',
+                metadata=saved['metadata'],
+                started_at=datetime.fromisoformat(saved['started_at'])
+            ))
+        return infos
+
+    def kill(self, sandbox_id):
+        with self._lock:
+            workspace = self._workspaces.get(sandbox_id)
+        if workspace is not None:
+            return workspace.kill()
+        if not re.match(r'^local-[0-9a-f]{12}$', sandbox_id):
+            raise ValueError(f"Unknown workspace: {sandbox_id}")
+        shutil.rmtree(os.path.join(self.root, sandbox_id), ignore_errors=True)
+        return True
+
@@ -0,0 +1,276 @@
+"""In-process stand-ins for e2b.Sandbox and the Mistral client.
+
+They never touch the network: every operation sleeps for a latency drawn from a
+configurable distribution, fails at a configurable rate and keeps just enough
+in-memory file state for the server's code paths (dependency markers, blobs,
+snapshots) to behave as they would against the real services.
+"""
+import itertools
+import json
+import math
+import random
+import re
+import shlex
+import threading
+import time
+import types
+from datetime import datetime, timezone
+
+from uploads import REMOTE_BLOB_ROOT
+
+
+class Latency:
+    """Log-normal latency in seconds, described by its median and spread (sigma)"""
+
+    def __init__(self, median, sigma=0.25):
+        self.median = median
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, text):
+        # "0.5" or "0.5:0.3" (median seconds, sigma)
+        parts = text.split(':')
+        return cls(float(parts[0]), float(parts[1]) if len(parts) > 1 else 0.25)
+
+    def sample(self, rng):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(rng.gauss(0, self.sigma))
+
+
+# Rough shape of the real services, in seconds
+DEFAULT_PROFILE = {
+    'boot': Latency(3.0, 0.4),
+    'command': Latency(0.05, 0.3),
+    'file': Latency(0.04, 0.3),
+    'pip': Latency(25.0, 0.3),
+    'exec': Latency(1.5, 0.5),
+    'llm': Latency(6.0, 0.4),
+    'llm_first_token': Latency(0.5, 0.4),
+    'llm_token': Latency(0.02, 0.2),
+}
+
+
+class FakeBackend:
+    """Shared configuration and randomness for one benchmark run"""
+
+    def __init__(self, profile=None, failure_rates=None, scale=1.0, seed=None):
+        self.profile = dict(DEFAULT_PROFILE)
+        self.profile.update(profile or {})
+        self.failure_rates = failure_rates or {}
+        self.scale = scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sandboxes = {}
+
+    def delay(self, kind):
+        with self._lock:
+            seconds = self.profile[kind].sample(self._rng) * self.scale
+            failed = self._rng.random() < self.failure_rates.get(kind, 0.0)
+        time.sleep(seconds)
+        if failed:
+            raise RuntimeError(f"Injected {kind} failure")
+        return seconds
+
+    def sandbox_class(self):
+        backend = self
+
+        class BoundFakeSandbox(FakeSandbox):
+            def __init__(self, *args, **kwargs):
+                super().__init__(backend, *args, **kwargs)
+
+            @staticmethod
+            def list(**kwargs):
+                return [types.SimpleNamespace(sandbox_id=s.sandbox_id, metadata=s.metadata, started_at=s.started_at,
+                                              template_id='fake', name='fake')
+                        for s in list(backend.sandboxes.values())]
+
+            def kill(self_or_id, **kwargs):
+                sandbox_id = self_or_id if isinstance(self_or_id, str) else self_or_id.sandbox_id
+                backend.delay('command')
+                return backend.sandboxes.pop(sandbox_id, None) is not None
+
+        return BoundFakeSandbox
+
+    def mistral_client(self):
+        return FakeMistral(self)
+
+
+class FakeSandbox:
+    _ids = itertools.count()
+
+    def __init__(self, backend, template=None, timeout=None, metadata=None, **kwargs):
+        backend.delay('boot')
+        self.backend = backend
+        self.sandbox_id = f'fake-{next(self._ids)}'
+        self.metadata = metadata or {}
+        self.started_at = datetime.now(timezone.utc)
+        self.fs = {}
+        self._lock = threading.Lock()
+        self.commands = types.SimpleNamespace(run=self._run, kill=lambda pid, **kw: True)
+        self.files = types.SimpleNamespace(write=self._write, read=self._read, exists=self._exists,
+                                           list=lambda path, **kw: [], remove=self._remove)
+        backend.sandboxes[self.sandbox_id] = self
+
+    def is_running(self, **kwargs):
+        return self.sandbox_id in self.backend.sandboxes
+
+    def set_timeout(self, timeout, **kwargs):
+        self.backend.delay('command')
+
+    def _path(self, path):
+        return path if path.startswith('/') else f'/home/user/{path}'
+
+    def _write(self, path, data, **kwargs):
+        self.backend.delay('file')
+        if hasattr(data, 'read'):
+            data = data.read()
+        with self._lock:
+            self.fs[self._path(path)] = data if isinstance(data, bytes) else str(data).encode('utf-8')
+
+    def _read(self, path, format='text', **kwargs):
+        self.backend.delay('file')
+        with self._lock:
+            data = self.fs.get(self._path(path), b'')
+        if format == 'text':
+            return data.decode('utf-8', 'replace')
+        return data if format == 'bytes' else iter([data])
+
+    def _exists(self, path, **kwargs):
+        self.backend.delay('file')
+        with self._lock:
+            return self._path(path) in self.fs
+
+    def _remove(self, path, **kwargs):
+        self.backend.delay('file')
+        with self._lock:
+            self.fs.pop(self._path(path), None)
+
+    def _run(self, cmd, background=None, envs=None, on_stdout=None, on_stderr=None, timeout=60, **kwargs):
+        if 'os.wait4' in cmd:
+            return self._benchmark(cmd)
+        kind = 'command'
+        if 'pip install' in cmd:
+            kind = 'pip'
+        elif re.search(r'python3? (\S+\.py)\b', cmd) and 'python -c' not in cmd:
+            kind = 'exec'
+        elif 'openoperator-output.log' in cmd:
+            # The output tee wrapping the script
+            kind = 'exec'
+        self.backend.delay(kind)
+
+        stdout = self._interpret(cmd)
+        if kind == 'exec':
+            stdout = 'Benchmark run finished\n'
+        if on_stdout and stdout:
+            on_stdout(stdout)
+        result = types.SimpleNamespace(stdout=stdout, stderr='', exit_code=0, error=None)
+        if background:
+            return types.SimpleNamespace(pid=1, wait=lambda **kw: result, kill=lambda: True)
+        return result
+
+    def _benchmark(self, cmd):
+        """Answer the A/B benchmark harness, one script execution per sample"""
+        _, _, _, scripts, runs, warmup = shlex.split(cmd)
+        scripts = json.loads(scripts)
+        samples = {script: [] for script in scripts}
+        for round_index in range(int(warmup) + int(runs)):
+            for script in scripts:
+                seconds = self.backend.delay('exec')
+                if round_index >= int(warmup):
+                    samples[script].append({'wall': seconds, 'cpu': seconds * 0.9, 'rss_kb': 40960})
+        stdout = json.dumps({'samples': samples}) + '\n'
+        return types.SimpleNamespace(stdout=stdout, stderr='', exit_code=0, error=None)
+
+    def _interpret(self, cmd):
+        """Apply the file effects of the shell snippets the server sends"""
+        output = []
+        with self._lock:
+            if cmd.startswith('python -c'):
+                # Output digests are a mapping, the artifact collector prints a list
+                return '{}' if 'hashlib' in cmd else '[]'
+            # The pool reset, checked first since it loops over paths too
+            if cmd.startswith('find /home/user'):
+                for path in [p for p in self.fs if p.startswith('/home/user/') and not p.startswith('/home/user/.')
+                             or p.startswith(REMOTE_BLOB_ROOT + '/')]:
+                    del self.fs[path]
+                return ''
+            if cmd.startswith('for d in') or ' for d in ' in cmd:
+                digests = re.search(r'for d in (.*?); do', cmd).group(1).split()
+                root = re.search(r'cd (\S+)', cmd).group(1)
+                suffix = re.search(r'test -f "\$d([^"]*)"', cmd).group(1)
+                return ''.join(f'{d}\n' for d in digests if f'{root}/{d}{suffix}' in self.fs)
+            for part in re.split(r'&&|;', cmd):
+                try:
+                    words = shlex.split(part)
+                except ValueError:
+                    continue
+                if not words:
+                    continue
+                if words[0] == 'touch':
+                    for path in words[1:]:
+                        self.fs.setdefault(self._path(path), b'')
+                elif words[0] == 'tar' and '-czf' in words:
+                    self.fs[self._path(words[words.index('-czf') + 1])] = b'snapshot'
+                elif words[0] == 'mv' and len(words) == 3:
+                    self.fs[self._path(words[2])] = self.fs.pop(self._path(words[1]), b'')
+                elif words[0] == 'cp' and len(words) == 3:
+                    self.fs[self._path(words[2])] = self.fs.get(self._path(words[1]), b'')
+                elif words[0] == 'rm':
+                    for path in words[1:]:
+                        self.fs.pop(self._path(path), None)
+        return ''.join(output)
+
+
+class FakeMistral:
+    """Echoes the user's code back inside a fenced block after an LLM-like delay"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.chat = types.SimpleNamespace(complete=self._complete, stream=self._stream)
+
+    def _answer(self, messages):
+        code = messages[-1]['content'] if messages else ''
+        return f"```python\n{code}\n```"
+
+    def _complete(self, model=None, messages=None, **kwargs):
+        self.backend.delay('llm')
+        content = self._answer(messages)
+        message = types.SimpleNamespace(content=content, role='assistant')
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason='stop')],
+                                     model=model, usage=None)
+
+    def _stream(self, model=None, messages=None, **kwargs):
+        return FakeEventStream(self._events(messages))
+
+    def _events(self, messages):
+        content = self._answer(messages)
+        # Time to first token, then a steady trickle of 16-character deltas
+        self.backend.delay('llm_first_token')
+        for i in range(0, len(content), 16):
+            self.backend.delay('llm_token')
+            delta = types.SimpleNamespace(content=content[i:i + 16], role='assistant')
+            choice = types.SimpleNamespace(delta=delta, finish_reason=None, index=0)
+            yield types.SimpleNamespace(data=types.SimpleNamespace(choices=[choice]))
+
+
+class FakeEventStream:
+    """Iterable context manager, like mistralai's EventStream"""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __iter__(self):
+        return self.events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.events.close()
+
+
+def install(app_module, backend):
+    """Point an imported app module at the fake backends"""
+    app_module.execution_backend.sandbox_class = backend.sandbox_class()
+    app_module.client = app_module.create_llm_gateway(backend.mistral_client())
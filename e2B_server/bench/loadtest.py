@@ -0,0 +1,382 @@
+"""Offline load test for the execution server.
+
+Runs the Flask app in-process against fake E2B and Mistral backends, drives it from
+concurrent clients and reports latency percentiles per endpoint and per traced
+stage. The load is run several times and each latency figure is the median over the
+repetitions, so one noisy run does not decide a check. Results can be saved as a
+baseline and later checked against it:
+
+    python -m bench.loadtest --save-baseline bench/baselines/default.json
+    python -m bench.loadtest --check-baseline bench/baselines/default.json
+
+Run from the e2B_server directory. No network access or API keys are needed.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fakes import FakeBackend, Latency, install
+
+
+ENDPOINTS = ['execute', 'stream', 'steps', 'jobs']
+
+# Run settings that define a benchmark; they are stored with a baseline and reused
+# when checking against it, so both runs measure the same thing
+DEFAULTS = {
+    'requests': 120,
+    'repetitions': 5,
+    'concurrency': 8,
+    'endpoints': ENDPOINTS,
+    'scale': 0.05,
+    'seed': 1234,
+    'latency': {},
+    'failures': {},
+    'data_bytes': 4096,
+    'repeat_scripts': False,
+    'pool_min': 4,
+    'pool_max': 8
+}
+
+TERMINAL_JOB_STATES = ('succeeded', 'failed', 'cancelled')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(samples):
+    durations = sorted(sample for sample in samples['durations'])
+    return {
+        'count': len(durations),
+        'errors': samples['errors'],
+        'mean_ms': round(sum(durations) / len(durations), 3) if durations else 0.0,
+        'p50_ms': round(percentile(durations, 0.50), 3),
+        'p95_ms': round(percentile(durations, 0.95), 3),
+        'p99_ms': round(percentile(durations, 0.99), 3)
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.endpoints = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def _series(self, table, name):
+        return table.setdefault(name, {'durations': [], 'errors': 0})
+
+    def endpoint(self, name, duration_ms, ok):
+        with self._lock:
+            series = self._series(self.endpoints, name)
+            if ok:
+                series['durations'].append(duration_ms)
+            else:
+                series['errors'] += 1
+
+    def trace(self, spans):
+        with self._lock:
+            for span in spans or []:
+                series = self._series(self.spans, span['name'])
+                if span.get('error'):
+                    series['errors'] += 1
+                else:
+                    series['durations'].append(span['duration_ms'])
+
+    def report(self):
+        return {
+            'endpoints': {name: summarize(s) for name, s in sorted(self.endpoints.items())},
+            'stages': {name: summarize(s) for name, s in sorted(self.spans.items())}
+        }
+
+
+def upload(script_id, config):
+    code = f"# benchmark script {script_id}\nimport numpy as np\nprint(np.sqrt(np.arange(100000)).sum())\n"
+    files = {'python_file': (io.BytesIO(code.encode('utf-8')), f'bench_{script_id}.py')}
+    if config['data_bytes']:
+        files['data_files'] = (io.BytesIO(b'x' * config['data_bytes']), 'data.csv')
+    return files
+
+
+def call_execute(client, files, recorder):
+    response = client.post('/execute', data=files, content_type='multipart/form-data')
+    payload = response.get_json()
+    recorder.trace(payload.get('trace'))
+    return response.status_code == 200
+
+
+def call_stream(client, files, recorder):
+    response = client.post('/execute?stream=ndjson', data=files, content_type='multipart/form-data',
+                           buffered=False)
+    ok = False
+    for line in response.response:
+        message = json.loads(line)
+        if message['type'] == 'complete':
+            recorder.trace(message.get('trace'))
+            ok = True
+        elif message['type'] == 'error':
+            ok = False
+    response.close()
+    return ok
+
+
+def call_steps(client, files, recorder):
+    data = dict(files, step='start')
+    while True:
+        started = time.perf_counter()
+        step = data['step']
+        response = client.post('/execute', data=data, content_type='multipart/form-data')
+        payload = response.get_json()
+        ok = response.status_code == 200
+        recorder.endpoint(f'steps:{step}', (time.perf_counter() - started) * 1000, ok)
+        if not ok:
+            return False
+        if payload['next_step'] == 'complete':
+            return True
+        data = {'step': payload['next_step'], 'sandbox_id': payload['sandbox_id']}
+
+
+def call_jobs(client, files, recorder, poll_interval):
+    response = client.post('/jobs', data=files, content_type='multipart/form-data')
+    if response.status_code != 202:
+        return False
+    status_url = response.get_json()['status_url']
+    while True:
+        job = client.get(status_url).get_json()
+        if job['status'] in TERMINAL_JOB_STATES:
+            if job['result']:
+                recorder.trace(job['result'].get('trace'))
+            return job['status'] == 'succeeded'
+        time.sleep(poll_interval)
+
+
+def run_load(app_module, config, repetition=0):
+    recorder = Recorder()
+    client = app_module.app.test_client()
+    endpoints = config['endpoints']
+    poll_interval = max(0.005, 0.05 * config['scale'])
+
+    def one_request(index):
+        endpoint = endpoints[index % len(endpoints)]
+        # Each repetition uploads new scripts, unless the cache is what is being measured
+        script_id = index % len(endpoints) if config['repeat_scripts'] else repetition * config['requests'] + index
+        files = upload(script_id, config)
+        started = time.perf_counter()
+        try:
+            if endpoint == 'execute':
+                ok = call_execute(client, files, recorder)
+            elif endpoint == 'stream':
+                ok = call_stream(client, files, recorder)
+            elif endpoint == 'steps':
+                ok = call_steps(client, files, recorder)
+            else:
+                ok = call_jobs(client, files, recorder, poll_interval)
+        except Exception as e:
+            print(f"Error in {endpoint} request: {str(e)}", file=sys.stderr)
+            ok = False
+        recorder.endpoint(endpoint, (time.perf_counter() - started) * 1000, ok)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config['concurrency'], thread_name_prefix='bench-client') as executor:
+        list(executor.map(one_request, range(config['requests'])))
+    elapsed = time.perf_counter() - started
+
+    result = recorder.report()
+    result['wall_seconds'] = round(elapsed, 3)
+    result['throughput_rps'] = round(config['requests'] / elapsed, 3) if elapsed else 0.0
+    return result
+
+
+def combine(results):
+    """One result from several repetitions: the median of each latency figure, counts added up"""
+    combined = {}
+    for section in ('endpoints', 'stages'):
+        combined[section] = {}
+        for name in sorted({name for result in results for name in result[section]}):
+            rows = [result[section][name] for result in results if name in result[section]]
+            combined[section][name] = {
+                'count': sum(row['count'] for row in rows),
+                'errors': sum(row['errors'] for row in rows),
+                **{key: round(statistics.median(row[key] for row in rows), 3)
+                   for key in ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms')}
+            }
+    combined['wall_seconds'] = round(sum(result['wall_seconds'] for result in results), 3)
+    combined['throughput_rps'] = round(statistics.median(result['throughput_rps'] for result in results), 3)
+    return combined
+
+
+def load_app(config, workdir):
+    """Import the app with throwaway caches and its clients swapped for fakes"""
+    os.environ.update({
+        'DEPENDENCY_CACHE_DIR': os.path.join(workdir, 'envs'),
+        'OPTIMIZATION_CACHE_PATH': os.path.join(workdir, 'optimizations.sqlite3'),
+        'ARTIFACT_DIR': os.path.join(workdir, 'artifacts'),
+        'SANDBOX_POOL_MIN': str(config['pool_min']),
+        'SANDBOX_POOL_MAX': str(config['pool_max']),
+        'E2B_API_KEY': 'offline',
+        'MISTRAL_API_KEY': 'offline',
+        'SANDBOX_BACKEND': 'e2b'
+    })
+    import app as app_module
+
+    backend = FakeBackend(
+        profile={kind: Latency.parse(spec) for kind, spec in config['latency'].items()},
+        failure_rates={kind: float(rate) for kind, rate in config['failures'].items()},
+        scale=config['scale'],
+        seed=config['seed']
+    )
+    install(app_module, backend)
+    return app_module
+
+
+def warm_pool(app_module, timeout=60):
+    pool = app_module.sandbox_pool
+    pool.start()
+    deadline = time.monotonic() + timeout
+    while pool.stats()['idle'] < pool.min_size and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def check_baseline(result, baseline, tolerance, slack_ms):
+    """Return a list of regressions of `result` against `baseline`"""
+    regressions = []
+    for section in ('endpoints', 'stages'):
+        for name, expected in baseline[section].items():
+            actual = result[section].get(name)
+            if actual is None:
+                # A span that disappears is work the server no longer does
+                if section == 'endpoints':
+                    regressions.append(f"endpoint {name}: missing from this run")
+                continue
+            # Tail latencies are noisier than medians, so they get twice the tolerance
+            for key, allowed in (('p50_ms', tolerance), ('p95_ms', 2 * tolerance)):
+                limit = expected[key] * (1 + allowed) + slack_ms
+                if actual[key] > limit:
+                    regressions.append(f"{name} {key}: {actual[key]:.1f} > {limit:.1f} (baseline {expected[key]:.1f})")
+            expected_rate = expected['errors'] / max(1, expected['count'] + expected['errors'])
+            actual_rate = actual['errors'] / max(1, actual['count'] + actual['errors'])
+            if actual_rate > expected_rate + tolerance / 5:
+                regressions.append(f"{name} error rate: {actual_rate:.1%} > {expected_rate:.1%}")
+    return regressions
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"  {'name':<32} {'count':>6} {'errors':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, row in rows.items():
+        print(f"  {name:<32} {row['count']:>6} {row['errors']:>6} {row['mean_ms']:>9.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+
+def parse_pairs(pairs):
+    parsed = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        parsed[key] = value
+    return parsed
+
+
+def build_config(args, baseline):
+    config = dict(DEFAULTS)
+    if baseline:
+        config.update(baseline['config'])
+    for key in DEFAULTS:
+        value = getattr(args, key, None)
+        if value is None:
+            continue
+        if key == 'endpoints':
+            value = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = set(value) - set(ENDPOINTS)
+            if unknown:
+                raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        elif key in ('latency', 'failures'):
+            value = dict(config[key], **parse_pairs(value))
+        config[key] = value
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, help='total number of client requests per repetition')
+    parser.add_argument('--repetitions', type=int, help='number of times the load is run (default 5)')
+    parser.add_argument('--concurrency', type=int, help='number of concurrent clients')
+    parser.add_argument('--endpoints', help=f"comma separated, from {','.join(ENDPOINTS)}")
+    parser.add_argument('--scale', type=float, help='multiplier applied to every fake latency')
+    parser.add_argument('--seed', type=int, help='random seed for latencies and failures')
+    parser.add_argument('--latency', action='append', metavar='KIND=MEDIAN[:SIGMA]',
+                        help='override a latency distribution (boot, command, file, pip, exec, llm, llm_token)')
+    parser.add_argument('--failures', action='append', metavar='KIND=RATE', help='inject failures for an operation')
+    parser.add_argument('--data-bytes', type=int, help='size of the data file sent with each request (0 for none)')
+    parser.add_argument('--repeat-scripts', action='store_true', default=None,
+                        help='reuse scripts across requests so the optimization cache is exercised')
+    parser.add_argument('--pool-min', type=int)
+    parser.add_argument('--pool-max', type=int)
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results as a new baseline')
+    parser.add_argument('--check-baseline', metavar='PATH', help='fail if results regress against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='allowed relative slowdown of p50, doubled for p95 (default 0.3)')
+    parser.add_argument('--slack-ms', type=float, default=25.0, help='allowed absolute slowdown in ms (default 25)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the server's own log output")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.check_baseline:
+        with open(args.check_baseline) as f:
+            baseline = json.load(f)
+    config = build_config(args, baseline)
+
+    workdir = tempfile.mkdtemp(prefix='openoperator-bench-')
+    try:
+        server_log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with server_log:
+            app_module = load_app(config, workdir)
+            warm_pool(app_module)
+            result = combine([run_load(app_module, config, repetition)
+                              for repetition in range(config['repetitions'])])
+            app_module.sandbox_pool.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result['config'] = config
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{config['requests']} requests x {config['repetitions']} repetitions, "
+              f"concurrency {config['concurrency']}, {result['wall_seconds']}s wall, "
+              f"{result['throughput_rps']} req/s (median)")
+        print_table('Endpoints (ms)', result['endpoints'])
+        print_table('Stages and spans (ms)', result['stages'])
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if baseline:
+        regressions = check_baseline(result, baseline, args.tolerance, args.slack_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.check_baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.check_baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import json
+import math
+import random
+import shlex
+import statistics
+
+
+# Runs inside the sandbox: times both scripts back to back, alternating which one goes
+# first in every round so drift (thermal, caches, noisy neighbours) hits both equally.
+# Each script is a child process reaped with wait4, which gives CPU time and peak RSS
+# for that process alone. Prints the samples as JSON.
+HARNESS_SCRIPT = '''
+import json, os, subprocess, sys, tempfile, time
+scripts, runs, warmup = json.loads(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+samples = {name: [] for name in scripts}
+
+def measure(script):
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script], stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            stderr.seek(0)
+            tail = stderr.read().decode('utf-8', 'replace').strip().splitlines()[-3:]
+            return {'error': f"{script} exited with status {process.returncode}: " + ' '.join(tail)}
+    return {'wall': wall, 'cpu': usage.ru_utime + usage.ru_stime, 'rss_kb': usage.ru_maxrss}
+
+for round_index in range(warmup + runs):
+    order = scripts if round_index % 2 == 0 else scripts[::-1]
+    for script in order:
+        sample = measure(script)
+        if 'error' in sample:
+            print(json.dumps({'error': sample['error']}))
+            sys.exit(0)
+        if round_index >= warmup:
+            samples[script].append(sample)
+print(json.dumps({'samples': samples}))
+'''
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom
+T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+    10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042
+}
+
+BOOTSTRAP_RESAMPLES = 2000
+
+METRIC_LABELS = [('wall_seconds', 'Wall time', 's'), ('cpu_seconds', 'CPU time', 's'), ('peak_rss_mb', 'Peak RSS', ' MB')]
+
+
+def t_quantile(degrees_of_freedom):
+    if degrees_of_freedom > 30:
+        return 1.96
+    # Use the next smaller tabulated value, which gives a slightly wider interval
+    return T_95[max(df for df in T_95 if df <= degrees_of_freedom)]
+
+
+def summarize(values):
+    """Mean with a 95% t confidence interval"""
+    mean = statistics.fmean(values)
+    stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+    margin = t_quantile(len(values) - 1) * stdev / math.sqrt(len(values)) if len(values) > 1 else 0.0
+    return {
+        'mean': round(mean, 6),
+        'stdev': round(stdev, 6),
+        'ci95': [round(mean - margin, 6), round(mean + margin, 6)],
+        'min': round(min(values), 6),
+        'max': round(max(values), 6)
+    }
+
+
+def ratio_of_means(baseline, candidate, seed=0):
+    """baseline / candidate with a 95% percentile bootstrap interval"""
+    value = statistics.fmean(baseline) / statistics.fmean(candidate)
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(BOOTSTRAP_RESAMPLES):
+        baseline_mean = statistics.fmean(rng.choices(baseline, k=len(baseline)))
+        candidate_mean = statistics.fmean(rng.choices(candidate, k=len(candidate)))
+        if candidate_mean > 0:
+            ratios.append(baseline_mean / candidate_mean)
+    ratios.sort()
+    low = ratios[int(0.025 * (len(ratios) - 1))]
+    high = ratios[int(0.975 * (len(ratios) - 1))]
+    return {'value': round(value, 4), 'ci95': [round(low, 4), round(high, 4)]}
+
+
+def benchmark_command(original, optimized, runs, warmup):
+    return (f"python -c {shlex.quote(HARNESS_SCRIPT)} "
+            f"{shlex.quote(json.dumps([original, optimized]))} {int(runs)} {int(warmup)}")
+
+
+def benchmark_report(output, original, optimized, runs, warmup):
+    """Turn the harness output into per-script statistics and speedups.
+
+    Speedups are original / optimized, so values above 1 mean the optimized script is
+    faster (or, for peak RSS, smaller).
+    """
+    result = json.loads(output.strip().splitlines()[-1])
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    samples = result['samples']
+
+    def metrics(script):
+        return {
+            'wall_seconds': [sample['wall'] for sample in samples[script]],
+            'cpu_seconds': [sample['cpu'] for sample in samples[script]],
+            'peak_rss_mb': [sample['rss_kb'] / 1024 for sample in samples[script]]
+        }
+
+    before, after = metrics(original), metrics(optimized)
+    speedup = {name: ratio_of_means(before[name], after[name])
+               for name in before if min(after[name]) > 0}
+    wall = speedup.get('wall_seconds')
+    if wall is None:
+        verdict = 'inconclusive'
+    elif wall['ci95'][0] > 1:
+        verdict = 'faster'
+    elif wall['ci95'][1] < 1:
+        verdict = 'slower'
+    else:
+        verdict = 'inconclusive'
+    return {
+        'runs': runs,
+        'warmup': warmup,
+        'original': {name: summarize(values) for name, values in before.items()},
+        'optimized': {name: summarize(values) for name, values in after.items()},
+        'speedup': speedup,
+        'verdict': verdict
+    }
+
+
+def describe(report):
+    wall = report['speedup'].get('wall_seconds')
+    if wall is None:
+        return f"Benchmark over {report['runs']} runs: no measurable wall time"
+    low, high = wall['ci95']
+    if report['verdict'] == 'slower':
+        summary = f"Optimized script is {1 / wall['value']:.2f}x slower"
+    elif report['verdict'] == 'faster':
+        summary = f"Optimized script is {wall['value']:.2f}x faster"
+    else:
+        summary = f"No significant difference ({wall['value']:.2f}x)"
+    return f"{summary} (95% CI {low:.2f}x-{high:.2f}x, {report['runs']} runs)"
+
+
+def format_comparison(report):
+    """Plain-text table of means with their 95% intervals, for the timeline"""
+    lines = []
+    for name, label, unit in METRIC_LABELS:
+        before, after = report['original'][name], report['optimized'][name]
+        line = (f"{label}: {before['mean']:.3f}{unit} ± {before['ci95'][1] - before['mean']:.3f}"
+                f" -> {after['mean']:.3f}{unit} ± {after['ci95'][1] - after['mean']:.3f}")
+        if name in report['speedup']:
+            line += f" ({report['speedup'][name]['value']:.2f}x)"
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,143 @@
+"""Splits a module into definitions that are optimized separately, and puts it back together.
+
+Top-level functions and classes, with their decorators, are the chunks. Everything else
+(imports, globals, the `if __name__ == '__main__'` block, comments) is shared context: it
+is kept verbatim, and every chunk's prompt gets it as an outline of the module in which
+the other chunks are reduced to their signatures. Adjacent definitions are grouped until
+a group reaches the target size, so a module of many small functions does not turn into
+one request per function.
+"""
+import ast
+import copy
+
+from preflight import syntax_error
+
+
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# What an optimized chunk may contain besides its definitions
+ALLOWED_STATEMENTS = DEFINITIONS + (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)
+
+PLACEHOLDER = "# <<< the definitions being optimized go here >>>\n"
+
+
+class Chunk:
+    def __init__(self, start, end, nodes, tokens):
+        # Lines start:end (0-based, end exclusive) of the module
+        self.start = start
+        self.end = end
+        self.nodes = nodes
+        self.tokens = tokens
+
+    @property
+    def names(self):
+        return [node.name for node in self.nodes]
+
+
+def _stub(node):
+    """The definition without its bodies: signatures, decorators and class attributes"""
+    node = copy.deepcopy(node)
+    if isinstance(node, ast.ClassDef):
+        body = [_stub(child) if isinstance(child, DEFINITIONS) else child
+                for child in node.body if isinstance(child, DEFINITIONS + (ast.Assign, ast.AnnAssign))]
+        node.body = body or [ast.Expr(ast.Constant(Ellipsis))]
+    else:
+        node.body = [ast.Expr(ast.Constant(Ellipsis))]
+    return node
+
+
+def _alone(lines, node, start):
+    # `x = 1; def f(): ...` cannot be cut out on line boundaries, so it stays in the context
+    first = lines[start].lstrip()
+    last = lines[node.end_lineno - 1].encode('utf-8')[node.end_col_offset:].decode('utf-8', 'replace').strip()
+    return first.startswith(('@', 'def ', 'async ', 'class ')) and (not last or last.startswith('#'))
+
+
+class ModulePlan:
+    def __init__(self, source, chunks):
+        self.lines = source.splitlines(keepends=True)
+        self.chunks = chunks
+
+    def source(self, index):
+        chunk = self.chunks[index]
+        return ''.join(self.lines[chunk.start:chunk.end])
+
+    def outline(self, index):
+        """The module as context for chunk `index`: other chunks stubbed, this one a placeholder"""
+        parts = []
+        position = 0
+        for other, chunk in enumerate(self.chunks):
+            parts.append(''.join(self.lines[position:chunk.start]))
+            if other == index:
+                parts.append(PLACEHOLDER)
+            else:
+                parts.append('\n\n'.join(ast.unparse(_stub(node)) for node in chunk.nodes) + '\n')
+            position = chunk.end
+        parts.append(''.join(self.lines[position:]))
+        return ''.join(parts)
+
+    def assemble(self, replacements):
+        """The module with chunk `i` replaced by `replacements[i]`; missing ones keep the original"""
+        parts = []
+        position = 0
+        for index, chunk in enumerate(self.chunks):
+            parts.append(''.join(self.lines[position:chunk.start]))
+            code = replacements.get(index)
+            parts.append(code.strip('\n') + '\n' if code else self.source(index))
+            position = chunk.end
+        parts.append(''.join(self.lines[position:]))
+        return ''.join(parts)
+
+
+def split_module(source, count_tokens, target_tokens):
+    """A ModulePlan for `source`, or None if it does not parse"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    lines = source.splitlines(keepends=True)
+    chunks = []
+    # Set while the previous statement was a definition, so the next one may join its chunk
+    joinable = False
+    for node in tree.body:
+        if not isinstance(node, DEFINITIONS):
+            joinable = False
+            continue
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+        if not _alone(lines, node, start):
+            joinable = False
+            continue
+        tokens = count_tokens(''.join(lines[start:node.end_lineno]))
+        if joinable and chunks[-1].tokens + tokens <= target_tokens:
+            # Only blank lines and comments lie between the two, so they go with the chunk
+            chunk = chunks[-1]
+            chunk.end = node.end_lineno
+            chunk.nodes.append(node)
+            chunk.tokens += tokens
+        else:
+            chunks.append(Chunk(start, node.end_lineno, [node], tokens))
+        joinable = True
+    return ModulePlan(source, chunks)
+
+
+def chunk_problems(code, names):
+    """Pre-flight problems of an optimized chunk that would break the reassembled module"""
+    error = syntax_error(code)
+    if error:
+        return [('syntax', error)]
+    problems = []
+    defined = set()
+    for node in ast.parse(code).body:
+        if isinstance(node, DEFINITIONS):
+            defined.add(node.name)
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue
+        elif not isinstance(node, ALLOWED_STATEMENTS):
+            # It would run at import time, next to the module's own top-level code
+            problems.append(('top_level_code', f"Line {node.lineno}: return only the definitions, "
+                                               f"without other top-level code"))
+            break
+    missing = [name for name in names if name not in defined]
+    if missing:
+        problems.append(('missing_definition', f"The code must still define {', '.join(missing)}"))
+    return problems
@@ -0,0 +1,247 @@
+"""Per-request time budgets and cancellation for pipeline runs.
+
+Every run carries a Deadline. Sandbox commands, file transfers and LLM calls take their
+timeout from it: their own cap, or what is left of the run's budget if that is less.
+Cancelling the deadline (the client hung up, a job was cancelled) kills the sandbox
+commands it is waiting on, so the stage blocked on them fails at once and the sandbox
+goes back to the pool instead of running on for nobody.
+"""
+import shlex
+import socket
+import threading
+import time
+
+from e2b import TimeoutException
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds, cancel_event=None):
+        self.seconds = seconds
+        self.cancel_event = cancel_event or threading.Event()
+        self.reason = None
+        self._handles = {}
+        self._lock = threading.Lock()
+        self.expires_at = time.monotonic() + seconds
+
+    def restart(self, seconds=None):
+        """A fresh budget for the next request on the same run (step sessions)"""
+        self.seconds = seconds or self.seconds
+        self.expires_at = time.monotonic() + self.seconds
+        self.reason = None
+        self.cancel_event.clear()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self, what):
+        """Raise if the run was cancelled or its budget is spent"""
+        if self.cancelled:
+            raise RunCancelled(f"Run was cancelled ({self.reason or 'cancelled'}) before {what}")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded before {what}")
+
+    def timeout(self, what, cap=None):
+        """Seconds the next call may take: its own cap or the rest of the budget, whichever is less"""
+        self.check(what)
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def track(self, handle):
+        with self._lock:
+            self._handles[id(handle)] = handle
+        # Cancelled between the check and the start: the command must not outlive the run
+        if self.cancelled:
+            self._kill(handle)
+
+    def untrack(self, handle):
+        with self._lock:
+            self._handles.pop(id(handle), None)
+
+    def cancel(self, reason):
+        """Stop the run: nothing new starts and every command it is waiting on is killed"""
+        with self._lock:
+            self.reason = self.reason or reason
+            handles = list(self._handles.values())
+        self.cancel_event.set()
+        for handle in handles:
+            self._kill(handle)
+
+    def _kill(self, handle):
+        try:
+            handle.kill()
+        except Exception as e:
+            print(f"Error killing command {getattr(handle, 'pid', '?')}: {str(e)}")
+
+
+def _label(cmd):
+    # Enough of the command to recognise it in an error, without a whole inline script
+    try:
+        words = shlex.split(cmd)
+        cmd = ' '.join('...' if index and words[index - 1] == '-c' else word for index, word in enumerate(words))
+    except ValueError:
+        cmd = ' '.join(cmd.split())
+    return cmd if len(cmd) <= 60 else cmd[:57] + '...'
+
+
+class _DeadlineCommands:
+    def __init__(self, commands, deadline, default_timeout):
+        self._commands = commands
+        self._deadline = deadline
+        self._default_timeout = default_timeout
+
+    def run(self, cmd, background=None, timeout=None, on_stdout=None, on_stderr=None, **kwargs):
+        deadline = self._deadline
+        seconds = deadline.timeout(f"`{_label(cmd)}`", timeout or self._default_timeout)
+        # The callbacks go to both calls: e2b only uses them in wait(), the local backend's
+        # readers start with the process and would otherwise drop the first lines
+        handle = self._commands.run(cmd, background=True, timeout=seconds, on_stdout=on_stdout,
+                                    on_stderr=on_stderr, **kwargs)
+        if background:
+            return handle
+        # Waited on here rather than by the SDK, so the handle can be killed if the run is cancelled
+        deadline.track(handle)
+        try:
+            return handle.wait(on_stdout=on_stdout, on_stderr=on_stderr)
+        except TimeoutException:
+            deadline._kill(handle)
+            if deadline.remaining() <= 0:
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded "
+                                       f"while running `{_label(cmd)}`") from None
+            raise
+        except Exception:
+            if deadline.cancelled:
+                raise RunCancelled(f"Run was cancelled ({deadline.reason}) while running `{_label(cmd)}`") from None
+            raise
+        finally:
+            deadline.untrack(handle)
+
+    def __getattr__(self, name):
+        return getattr(self._commands, name)
+
+
+class _DeadlineFiles:
+    """File transfers whose request timeout is capped by what is left of the budget"""
+
+    def __init__(self, files, deadline):
+        self._files = files
+        self._deadline = deadline
+
+    def read(self, path, *args, **kwargs):
+        return self._call(self._files.read, f"reading {path}", path, *args, **kwargs)
+
+    def write(self, path, *args, **kwargs):
+        return self._call(self._files.write, f"writing {path}", path, *args, **kwargs)
+
+    def _call(self, method, what, *args, request_timeout=None, **kwargs):
+        deadline = self._deadline
+        try:
+            return method(*args, request_timeout=deadline.timeout(what, request_timeout), **kwargs)
+        except TimeoutException:
+            if deadline.remaining() <= 0:
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded while {what}") from None
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._files, name)
+
+
+class AsyncDeadlineCommands:
+    """Async sandbox commands that observe a Deadline, for the ASGI server.
+
+    There are no handles to track: cancelling the task awaiting a command already stops it.
+    """
+
+    def __init__(self, commands, deadline, default_timeout):
+        self._commands = commands
+        self._deadline = deadline
+        self._default_timeout = default_timeout
+
+    async def run(self, cmd, timeout=None, **kwargs):
+        deadline = self._deadline
+        seconds = deadline.timeout(f"`{_label(cmd)}`", timeout or self._default_timeout)
+        try:
+            return await self._commands.run(cmd, timeout=seconds, **kwargs)
+        except TimeoutException:
+            if deadline.remaining() <= 0:
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded "
+                                       f"while running `{_label(cmd)}`") from None
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._commands, name)
+
+
+class DeadlineSandbox:
+    """Sandbox proxy whose commands and file transfers observe a Deadline.
+
+    Commands can also be killed through it; a transfer cannot, but it times out with the budget.
+    """
+
+    def __init__(self, sandbox, deadline, default_timeout=60):
+        self.sandbox = sandbox
+        self.commands = _DeadlineCommands(sandbox.commands, deadline, default_timeout)
+        self.files = _DeadlineFiles(sandbox.files, deadline)
+
+    def __getattr__(self, name):
+        return getattr(self.sandbox, name)
+
+
+def client_socket(environ):
+    """The WSGI client connection, where the server exposes it (werkzeug, gunicorn)"""
+    return environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+
+
+def client_disconnected(sock):
+    """True once the peer has closed the connection. Peeks, so no request data is consumed"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except ValueError:
+        # TLS sockets refuse recv flags; there is no telling from here
+        return False
+    except OSError:
+        return True
+
+
+class CancellationWatch:
+    """Background watch over a run that cancels it when the client hangs up.
+
+    It also kills the run's commands when the cancel event is set from elsewhere, such
+    as a job cancellation, which only sets the event.
+    """
+
+    def __init__(self, deadline, client=None, interval=1.0):
+        self.deadline = deadline
+        self.client = client
+        self.interval = interval
+        self._finished = threading.Event()
+
+    def _watch(self):
+        while not self._finished.is_set():
+            if self.deadline.cancel_event.wait(self.interval):
+                if not self._finished.is_set():
+                    self.deadline.cancel('cancelled')
+                return
+            if self.client is not None and client_disconnected(self.client):
+                self.deadline.cancel('client disconnected')
+                return
+
+    def __enter__(self):
+        threading.Thread(target=self._watch, daemon=True, name='cancellation-watch').start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._finished.set()
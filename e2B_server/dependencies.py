@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import threading
+
+
+DEFAULT_PACKAGES = ['pandas', 'numpy', 'matplotlib', 'scikit-learn', 'seaborn', 'requests']
+
+REMOTE_ENV_ROOT = '/home/user/.openoperator/envs'
+
+
+def normalize_package(name):
+    """Canonical form of a requirement name, so 'Scikit_Learn' and 'scikit-learn' hash the same"""
+    return re.sub(r'[-_.]+', '-', name.strip()).lower()
+
+
+def env_hash(packages, salt=''):
+    """Stable hash of a package set; order and duplicates do not matter"""
+    normalized = sorted({normalize_package(p) for p in packages if p.strip()})
+    digest = hashlib.sha256((salt + '\n' + '\n'.join(normalized)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class DependencyManager:
+    """Prepares one reusable environment per package-set hash.
+
+    The first time a hash is seen its packages are pip-installed into a dedicated
+    directory inside the sandbox, and that directory is snapshotted to a tarball in
+    the local cache. Later sandboxes restore the snapshot instead of running pip, and a
+    sandbox that already holds the environment (pooled sandboxes keep it across resets)
+    skips the step entirely, as does one holding a larger environment that contains every
+    requested package. Scripts use the environment through PYTHONPATH.
+
+    Finished environments are sealed read-only. With an `owner` (root in E2B sandboxes)
+    they are built and restored as that user and handed over to it, so the scripts that
+    later import from them cannot change them.
+    """
+
+    def __init__(self, cache_dir, remote_root=REMOTE_ENV_ROOT, salt='', install_timeout=600, owner=None):
+        self.cache_dir = cache_dir
+        self.remote_root = remote_root
+        self.owner = owner
+        self.salt = salt
+        self.install_timeout = install_timeout
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # Package set of every environment we know about, by hash
+        self._environments = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(cache_dir, name)) as f:
+                        self._environments[name[:-len('.json')]] = frozenset(json.load(f)['packages'])
+                except (OSError, ValueError, KeyError):
+                    continue
+
+    def snapshot_path(self, digest):
+        return os.path.join(self.cache_dir, f'{digest}.tar.gz')
+
+    def ensure(self, sandbox, packages):
+        """Make the environment for `packages` available in the sandbox.
+
+        Returns a dict with the hash, the packages the environment holds, how it was
+        provided ('empty', 'cached', 'snapshot' or 'installed'), the env vars to run
+        scripts with and any installer output.
+        """
+        digest = env_hash(packages, self.salt)
+        env_dir = f'{self.remote_root}/{digest}'
+        marker = f'{env_dir}/.ready'
+        result = {
+            'hash': digest,
+            'packages': sorted({normalize_package(p) for p in packages}),
+            'envs': {'PYTHONPATH': env_dir},
+            'output': ''
+        }
+
+        if not result['packages']:
+            result['source'] = 'empty'
+            return result
+
+        ready = self._ready_environments(sandbox, digest, set(result['packages']))
+        if ready:
+            if ready == digest:
+                self._environments.setdefault(digest, frozenset(result['packages']))
+            else:
+                result['hash'] = ready
+                result['packages'] = sorted(self._environments[ready])
+                result['envs'] = {'PYTHONPATH': f'{self.remote_root}/{ready}'}
+            result['source'] = 'cached'
+            return result
+
+        # Only one build per hash at a time; everyone else waits for the snapshot
+        with self._lock_for(digest):
+            snapshot = self.snapshot_path(digest)
+            if os.path.exists(snapshot):
+                self._restore(sandbox, snapshot, env_dir, marker)
+                if digest not in self._environments:
+                    self.remember(digest, result['packages'])
+                result['source'] = 'snapshot'
+                return result
+
+            result['output'] = self._install(sandbox, result['packages'], env_dir)
+            self._snapshot(sandbox, env_dir, snapshot)
+            self._seal(sandbox, env_dir, marker)
+            self.remember(digest, result['packages'])
+            result['source'] = 'installed'
+            return result
+
+    def _ready_environments(self, sandbox, digest, packages):
+        """Hash of an environment in the sandbox that covers `packages`, preferring an exact match"""
+        supersets = sorted(
+            (d for d, held in list(self._environments.items()) if d != digest and held >= packages),
+            key=lambda d: len(self._environments[d])
+        )
+        if not supersets:
+            return digest if sandbox.files.exists(f'{self.remote_root}/{digest}/.ready') else None
+        # One round trip for every candidate
+        candidates = [digest] + supersets
+        result = sandbox.commands.run(
+            f'cd {shlex.quote(self.remote_root)} 2>/dev/null && '
+            f'for d in {" ".join(candidates)}; do test -f "$d/.ready" && echo "$d"; done; true'
+        )
+        found = set(result.stdout.split())
+        return next((d for d in candidates if d in found), None)
+
+    def remember(self, digest, packages):
+        self._environments[digest] = frozenset(packages)
+        partial = os.path.join(self.cache_dir, f'{digest}.json.partial')
+        with open(partial, 'w') as f:
+            json.dump({'packages': sorted(packages)}, f)
+        os.replace(partial, os.path.join(self.cache_dir, f'{digest}.json'))
+
+    def _lock_for(self, digest):
+        with self._locks_guard:
+            return self._locks.setdefault(digest, threading.Lock())
+
+    def _as_owner(self):
+        return {'user': self.owner} if self.owner else {}
+
+    def _seal(self, sandbox, env_dir, marker):
+        """Mark the environment ready and make it read-only, owned by `owner` if there is one"""
+        command = f'touch {shlex.quote(marker)} && '
+        if self.owner:
+            command += f'chown -R {self.owner}:{self.owner} {shlex.quote(env_dir)} && '
+        command += f'chmod -R a-w {shlex.quote(env_dir)}'
+        sandbox.commands.run(command, timeout=self.install_timeout, **self._as_owner())
+
+    def _install(self, sandbox, packages, env_dir):
+        if self.owner:
+            # The owner creates the directory (and the root above it); pip runs as the sandbox user
+            sandbox.commands.run(f'mkdir -p {shlex.quote(env_dir)} && chown user:user {shlex.quote(env_dir)}',
+                                 **self._as_owner())
+        command = (
+            f'mkdir -p {shlex.quote(env_dir)} && '
+            f'pip install --quiet --no-warn-script-location --target {shlex.quote(env_dir)} '
+            + ' '.join(shlex.quote(p) for p in packages)
+        )
+        result = sandbox.commands.run(command, timeout=self.install_timeout)
+        print("Installation output:", result.stdout)
+        return result.stdout
+
+    def _snapshot(self, sandbox, env_dir, snapshot):
+        remote_archive = f'/tmp/{os.path.basename(snapshot)}'
+        sandbox.commands.run(
+            f'tar -czf {shlex.quote(remote_archive)} -C {shlex.quote(env_dir)} .',
+            timeout=self.install_timeout
+        )
+        partial = snapshot + '.partial'
+        with open(partial, 'wb') as f:
+            for chunk in sandbox.files.read(remote_archive, format='stream'):
+                f.write(chunk)
+        os.replace(partial, snapshot)
+        sandbox.commands.run(f'rm -f {shlex.quote(remote_archive)}')
+
+    def _restore(self, sandbox, snapshot, env_dir, marker):
+        remote_archive = f'/tmp/{os.path.basename(snapshot)}'
+        with open(snapshot, 'rb') as f:
+            sandbox.files.write(remote_archive, f)
+        sandbox.commands.run(
+            f'mkdir -p {shlex.quote(env_dir)} && '
+            f'tar --no-same-owner -xzf {shlex.quote(remote_archive)} -C {shlex.quote(env_dir)} && '
+            f'rm -f {shlex.quote(remote_archive)}',
+            timeout=self.install_timeout,
+            **self._as_owner()
+        )
+        self._seal(sandbox, env_dir, marker)
@@ -0,0 +1,124 @@
+import ast
+import re
+import sys
+from functools import lru_cache
+
+
+# Import names whose distribution on PyPI is called something else. Anything not
+# listed here is assumed to be published under its import name.
+DISTRIBUTION_NAMES = {
+    'attr': 'attrs',
+    'bs4': 'beautifulsoup4',
+    'Crypto': 'pycryptodome',
+    'cv2': 'opencv-python',
+    'dateutil': 'python-dateutil',
+    'docx': 'python-docx',
+    'dotenv': 'python-dotenv',
+    'fitz': 'PyMuPDF',
+    'jose': 'python-jose',
+    'jwt': 'PyJWT',
+    'Levenshtein': 'python-Levenshtein',
+    'magic': 'python-magic',
+    'mpl_toolkits': 'matplotlib',
+    'MySQLdb': 'mysqlclient',
+    'OpenSSL': 'pyOpenSSL',
+    'PIL': 'Pillow',
+    'pptx': 'python-pptx',
+    'psycopg2': 'psycopg2-binary',
+    'serial': 'pyserial',
+    'skimage': 'scikit-image',
+    'sklearn': 'scikit-learn',
+    'slugify': 'python-slugify',
+    'telegram': 'python-telegram-bot',
+    'win32api': 'pywin32',
+    'yaml': 'PyYAML',
+    'zmq': 'pyzmq',
+}
+
+# Common packages published under their import name
+SAME_NAME = {
+    'aiohttp', 'boto3', 'bokeh', 'click', 'dask', 'django', 'fastapi', 'flask', 'httpx', 'jinja2',
+    'joblib', 'lightgbm', 'lxml', 'matplotlib', 'networkx', 'nltk', 'numba', 'numpy', 'openai',
+    'openpyxl', 'pandas', 'plotly', 'polars', 'pyarrow', 'pydantic', 'pytest', 'requests', 'scipy',
+    'seaborn', 'six', 'spacy', 'statsmodels', 'sympy', 'tabulate', 'tensorflow', 'torch',
+    'torchvision', 'tqdm', 'transformers', 'xgboost',
+}
+
+# Modules that ship with another package or with the interpreter image and must never
+# be pip-installed on their own
+NOT_INSTALLABLE = {'__future__', '__main__', 'pip', 'pkg_resources', 'setuptools'}
+
+STDLIB_MODULES = frozenset(sys.stdlib_module_names)
+
+# Fallback for scripts that do not parse (the LLM occasionally returns prose)
+IMPORT_PATTERN = re.compile(r'^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w., ]+))', re.MULTILINE)
+
+
+def _dynamic_import(node):
+    """Module name of `importlib.import_module('x')` or `__import__('x')` calls"""
+    if not isinstance(node, ast.Call) or not node.args:
+        return None
+    func = node.func
+    name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+    if name not in ('import_module', '__import__'):
+        return None
+    argument = node.args[0]
+    if isinstance(argument, ast.Constant) and isinstance(argument.value, str) and not argument.value.startswith('.'):
+        return argument.value
+    return None
+
+
+def extract_imports(source):
+    """Top-level module names of every absolute import in `source`, including ones inside functions"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        names = set()
+        for from_name, import_names in IMPORT_PATTERN.findall(source):
+            for name in [from_name] if from_name else import_names.split(','):
+                name = name.strip().split(' ')[0]
+                if name:
+                    names.add(name.split('.')[0])
+        return names
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0 and node.module:
+                names.add(node.module)
+        else:
+            module = _dynamic_import(node)
+            if module:
+                names.add(module)
+    return {name.split('.')[0] for name in names}
+
+
+def is_third_party(module):
+    return module not in STDLIB_MODULES and module not in NOT_INSTALLABLE and not module.startswith('_')
+
+
+@lru_cache(maxsize=1024)
+def resolve_packages(imports):
+    """Map a frozenset of import names to the distributions that provide them.
+
+    Returns (packages, guessed): every distribution to install, and the subset that
+    is in neither table and is only assumed to be published under its import name.
+    """
+    packages = set()
+    guessed = set()
+    for module in imports:
+        if not is_third_party(module):
+            continue
+        distribution = DISTRIBUTION_NAMES.get(module, module)
+        if module not in DISTRIBUTION_NAMES and module not in SAME_NAME:
+            guessed.add(distribution)
+        packages.add(distribution)
+    return sorted(packages), sorted(guessed)
+
+
+def required_packages(source, local_modules=()):
+    """Minimal install set for a script, as (packages, guessed)"""
+    imports = extract_imports(source) - set(local_modules)
+    return resolve_packages(frozenset(imports))
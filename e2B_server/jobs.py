@@ -0,0 +1,159 @@
+import collections
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, fn, args, cleanup=None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.cleanup = cleanup
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """Bounded job queue drained by a fixed pool of worker threads.
+
+    `submit` never blocks: when `max_depth` jobs are already waiting it raises QueueFull
+    with a Retry-After estimate based on recent job durations. Jobs receive their cancel
+    event as the first argument so running work can stop early. A job cancelled before it
+    starts leaves the queue at once, freeing its slot, and its `cleanup` runs in place of
+    the job. Finished jobs are kept for `retention` seconds so their results can be fetched.
+    """
+
+    def __init__(self, workers=4, max_depth=50, retention=3600):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retention = retention
+        self._pending = collections.deque()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._running = 0
+        self._average_duration = 30.0
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, cleanup=None):
+        """Queue `fn(cancel_event, *args)`; `cleanup(*args)` runs instead if it is cancelled while queued"""
+        self.start()
+        self._purge()
+        job = Job(fn, args, cleanup)
+        with self._lock:
+            if len(self._pending) >= self.max_depth:
+                raise QueueFull(self._retry_after())
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._ready.notify()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_event.set()
+            queued = job.status == 'queued'
+            if queued:
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+                self._pending.remove(job)
+        if queued and job.cleanup is not None:
+            try:
+                job.cleanup(*job.args)
+            except Exception as e:
+                print(f"Error cleaning up cancelled job {job_id}: {str(e)}")
+        return True
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self):
+        backlog = len(self._pending) + self._running
+        return max(1, int(self._average_duration * backlog / max(self.workers, 1)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._pending),
+                'running': self._running,
+                'workers': self.workers,
+                'max_depth': self.max_depth,
+                'tracked': len(self._jobs)
+            }
+
+    def _work(self):
+        while True:
+            with self._ready:
+                while not self._pending:
+                    self._ready.wait()
+                job = self._pending.popleft()
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running += 1
+            try:
+                result = job.fn(job.cancel_event, *job.args)
+                status, error = 'succeeded', None
+            except Exception as e:
+                result, error = None, str(e)
+                status = 'cancelled' if job.cancel_event.is_set() else 'failed'
+            with self._lock:
+                job.result = result
+                job.error = error
+                job.status = status
+                job.finished_at = time.time()
+                self._running -= 1
+                # Exponential moving average feeds the Retry-After estimate
+                duration = job.finished_at - job.started_at
+                self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,450 @@
+"""Resilient access to the Mistral chat API.
+
+LLMGateway wraps a Mistral client and offers the same `chat.complete`, `chat.stream`,
+`chat.complete_async` and `chat.stream_async` calls, adding:
+
+- a limit on concurrent requests, so a burst of runs queues here instead of at the API;
+- retries with jittered exponential backoff on 429, 5xx and connection errors, honouring
+  Retry-After and the caller's `timeout_ms` as the budget for all attempts;
+- optional hedging: a request that has not answered (a stream: produced its first event)
+  by the p95 of recent ones is sent a second time, and the first answer wins;
+- a circuit breaker that fails fast after consecutive 5xx or connection failures until a
+  cooldown has passed; timeouts do not count towards it.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from mistralai import models
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the API: the circuit is open or no request slot freed up in time"""
+
+
+def retryable(error):
+    if isinstance(error, models.SDKError):
+        return error.status_code in RETRY_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+def outage(error):
+    """Whether a failure says the API is unhealthy: a 5xx, or no connection could be made.
+
+    Timeouts do not count: a slow answer or the caller's own short budget says nothing about
+    whether the API is up, and a 4xx or 429 is about the request, not the service.
+    """
+    if isinstance(error, models.SDKError):
+        return error.status_code >= 500
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def retry_after(error):
+    response = getattr(error, 'raw_response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def describe(error):
+    if isinstance(error, models.SDKError):
+        return f"status {error.status_code}"
+    return type(error).__name__
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive outage errors, then lets one trial request through
+    every `cooldown` seconds until one succeeds"""
+
+    def __init__(self, failures=5, cooldown=30):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        # A trial request that ended without an answer either way
+        with self._lock:
+            self._trial = False
+
+    def retry_in(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half_open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+
+class LatencyWindow:
+    """The most recent latencies of one kind of request"""
+
+    def __init__(self, size=200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def quantile(self, q, min_samples):
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StartedStream:
+    """A completion stream whose first event has already arrived, used like mistralai's EventStream"""
+
+    def __init__(self, stream, events, first, on_close):
+        self._stream = stream
+        self._events = events
+        self._first = first
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+            yield from self._events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._stream.__exit__(None, None, None)
+        finally:
+            self._on_close()
+
+
+class StartedAsyncStream:
+    """Async counterpart of StartedStream"""
+
+    def __init__(self, stream, events, first):
+        self._stream = stream
+        self._events = events
+        self._first = first
+        self._closed = False
+
+    async def _iterate(self):
+        if self._first is not None:
+            yield self._first
+            async for event in self._events:
+                yield event
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._stream.__aexit__(None, None, None)
+
+
+class _Chat:
+    def __init__(self, gateway):
+        self.complete = gateway.complete
+        self.stream = gateway.stream
+        self.complete_async = gateway.complete_async
+        self.stream_async = gateway.stream_async
+
+
+class LLMGateway:
+    """Retries, hedging, a concurrency limit and a circuit breaker in front of a Mistral client.
+
+    The async calls are not limited here; the async server bounds them with its own semaphore.
+    """
+
+    def __init__(self, client, max_concurrency=16, queue_timeout=30, retries=3, backoff=0.5, max_backoff=8,
+                 hedge=False, hedge_quantile=0.95, hedge_min_samples=20, breaker_failures=5, breaker_cooldown=30):
+        self.client = client
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self.latencies = {'complete': LatencyWindow(), 'stream': LatencyWindow()}
+        self.chat = _Chat(self)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Hedged attempts run here; two per request at most
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_concurrency, thread_name_prefix='llm')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counts = {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'failures': 0,
+                        'short_circuited': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts, in_flight=self._in_flight)
+        state = self.breaker.state
+        stats['circuit_open'] = 1 if state == 'open' else 0
+        stats['circuit_half_open'] = 1 if state == 'half_open' else 0
+        for kind, window in self.latencies.items():
+            stats[f'{kind}_p95_seconds'] = window.quantile(0.95, 1) or 0.0
+        return stats
+
+    def _hedge_after(self, kind):
+        if not self.hedge:
+            return None
+        return self.latencies[kind].quantile(self.hedge_quantile, self.hedge_min_samples)
+
+    def _backoff_delay(self, attempt, error):
+        # Full jitter: anywhere up to the exponential bound, so retries from many runs spread out
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        server_delay = retry_after(error)
+        return max(delay, server_delay) if server_delay is not None else delay
+
+    def _admit(self):
+        if self.breaker.allow():
+            return
+        self._count('short_circuited')
+        raise LLMUnavailable(f"Mistral is failing, not sending requests for another "
+                             f"{self.breaker.retry_in():.0f}s (circuit breaker open)")
+
+    def _settle(self, error):
+        if error is not None and outage(error):
+            self._count('failures')
+            self.breaker.failure()
+        elif isinstance(error, httpx.TransportError):
+            # Timed out or dropped mid-answer: no sign of an outage, nor that the API is up
+            self.breaker.release()
+        else:
+            # Anything the API answered, even with a 4xx, shows it is up
+            self.breaker.success()
+
+    # Synchronous calls
+
+    def _attempt(self, call, kwargs, kind, expires, slot_held=False):
+        """One request: a slot and the breaker's permission first, latency and outcome after"""
+        if not slot_held:
+            wait_for = self.queue_timeout if expires is None else min(self.queue_timeout, expires - time.monotonic())
+            if wait_for <= 0 or not self._slots.acquire(timeout=wait_for):
+                raise LLMUnavailable("Too many concurrent Mistral requests, no slot freed up in time")
+        keep_slot = False
+        try:
+            self._admit()
+            with self._lock:
+                self._in_flight += 1
+            start = time.monotonic()
+            try:
+                result = call(kwargs)
+            except Exception as e:
+                self._settle(e)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+            self._settle(None)
+            self.latencies[kind].add(time.monotonic() - start)
+            keep_slot = isinstance(result, StartedStream)
+            return result
+        finally:
+            if not keep_slot:
+                self._slots.release()
+
+    def _hedged(self, call, kwargs, kind, expires, discard):
+        hedge_after = self._hedge_after(kind)
+        if hedge_after is None:
+            return self._attempt(call, kwargs, kind, expires)
+        primary = self._executor.submit(self._attempt, call, kwargs, kind, expires)
+        if wait([primary], timeout=hedge_after).done or not self._slots.acquire(blocking=False):
+            # Answered in time, or there is no spare capacity for a duplicate
+            return primary.result()
+        self._count('hedges')
+        hedge = self._executor.submit(self._attempt, call, kwargs, kind, expires, True)
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is None:
+                error = error or next(iter(done)).exception()
+                continue
+            if winner is hedge:
+                self._count('hedge_wins')
+            # The other answer is thrown away whenever it arrives
+            for loser in {primary, hedge} - {winner}:
+                loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+            return winner.result()
+        raise error
+
+    def _call(self, call, kwargs, kind, discard=lambda result: None):
+        self._count('requests')
+        budget_ms = kwargs.get('timeout_ms')
+        expires = time.monotonic() + budget_ms / 1000 if budget_ms else None
+        for attempt in range(self.retries + 1):
+            if expires is not None:
+                kwargs = dict(kwargs, timeout_ms=max(1, int((expires - time.monotonic()) * 1000)))
+            try:
+                return self._hedged(call, kwargs, kind, expires, discard)
+            except Exception as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                if expires is not None and time.monotonic() + delay >= expires:
+                    raise
+                self._count('retries')
+                print(f"Mistral request failed ({describe(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _open_stream(self, kwargs):
+        stream = self.client.chat.stream(**kwargs)
+        events = iter(stream.__enter__())
+        try:
+            first = next(events, None)
+        except BaseException:
+            stream.__exit__(None, None, None)
+            raise
+        return StartedStream(stream, events, first, self._slots.release)
+
+    def complete(self, **kwargs):
+        return self._call(lambda options: self.client.chat.complete(**options), kwargs, 'complete')
+
+    def stream(self, **kwargs):
+        """A stream whose first event has arrived; only opening it is retried or hedged"""
+        return self._call(self._open_stream, kwargs, 'stream', discard=lambda stream: stream.close())
+
+    # Async calls
+
+    async def _attempt_async(self, call, kwargs, kind):
+        self._admit()
+        with self._lock:
+            self._in_flight += 1
+        start = time.monotonic()
+        try:
+            result = await call(kwargs)
+        except asyncio.CancelledError:
+            # A hedge that lost, or a cancelled run: says nothing about the API
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._settle(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        self._settle(None)
+        self.latencies[kind].add(time.monotonic() - start)
+        return result
+
+    async def _hedged_async(self, call, kwargs, kind):
+        hedge_after = self._hedge_after(kind)
+        if hedge_after is None:
+            return await self._attempt_async(call, kwargs, kind)
+        primary = asyncio.ensure_future(self._attempt_async(call, kwargs, kind))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+        self._count('hedges')
+        hedge = asyncio.ensure_future(self._attempt_async(call, kwargs, kind))
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is None:
+                error = error or next(iter(done)).exception()
+                continue
+            if winner is hedge:
+                self._count('hedge_wins')
+            for loser in {primary, hedge} - {winner}:
+                if not loser.done():
+                    loser.cancel()
+                elif loser.exception() is None and isinstance(loser.result(), StartedAsyncStream):
+                    await loser.result().close()
+            return winner.result()
+        raise error
+
+    async def _call_async(self, call, kwargs, kind):
+        self._count('requests')
+        budget_ms = kwargs.get('timeout_ms')
+        expires = time.monotonic() + budget_ms / 1000 if budget_ms else None
+        for attempt in range(self.retries + 1):
+            if expires is not None:
+                kwargs = dict(kwargs, timeout_ms=max(1, int((expires - time.monotonic()) * 1000)))
+            try:
+                return await self._hedged_async(call, kwargs, kind)
+            except Exception as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                if expires is not None and time.monotonic() + delay >= expires:
+                    raise
+                self._count('retries')
+                print(f"Mistral request failed ({describe(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _open_stream_async(self, kwargs):
+        stream = await self.client.chat.stream_async(**kwargs)
+        events = (await stream.__aenter__()).__aiter__()
+        try:
+            first = await events.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.__aexit__(None, None, None)
+            raise
+        return StartedAsyncStream(stream, events, first)
+
+    async def complete_async(self, **kwargs):
+        return await self._call_async(lambda options: self.client.chat.complete_async(**options), kwargs, 'complete')
+
+    async def stream_async(self, **kwargs):
+        return await self._call_async(self._open_stream_async, kwargs, 'stream')
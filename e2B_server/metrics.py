@@ -0,0 +1,223 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    labels = _format_labels(key + (('le', _format_value(float(bound))),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(key + (('le', '+Inf'),))
+                lines.append(f'{self.name}_bucket{labels} {series["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(series["sum"])}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {series["count"]}')
+        return lines
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class CallbackMetric:
+    """Metric whose samples are read from a callback at scrape time.
+
+    The callback returns a list of (labels dict, value) pairs.
+    """
+
+    def __init__(self, name, help, callback, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        try:
+            samples = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {str(e)}")
+            samples = []
+        for labels, value in samples:
+            lines.append(f'{self.name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """Holds every metric and renders them in the Prometheus text exposition format"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def callback(self, name, help, callback, kind='gauge'):
+        return self.register(CallbackMetric(name, help, callback, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """Per-run trace: an id plus the timed spans recorded while the run was processed"""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, error=None, **attributes):
+        span = {
+            'name': name,
+            'start_ms': round((start - self.started) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3)
+        }
+        span.update(attributes)
+        if error is not None:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+    def to_list(self):
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span['start_ms'])
+
+
+@contextmanager
+def timed(histogram, trace, span_name, **labels):
+    """Time a block with perf_counter, feeding both the histogram and the trace"""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        histogram.observe(duration, **labels)
+        if trace is not None:
+            trace.record(span_name, start, duration, error=error, **labels)
+
+
+class _TracedCalls:
+    def __init__(self, target, prefix, trace, histogram):
+        self._target = target
+        self._prefix = prefix
+        self._trace = trace
+        self._histogram = histogram
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+        operation = f'{self._prefix}.{name}'
+
+        def call(*args, **kwargs):
+            with timed(self._histogram, self._trace, f'sandbox:{operation}', operation=operation):
+                return attribute(*args, **kwargs)
+        return call
+
+
+class TracedSandbox:
+    """Sandbox proxy that times every commands.* and files.* call"""
+
+    def __init__(self, sandbox, trace, histogram):
+        self.sandbox = sandbox
+        self.commands = _TracedCalls(sandbox.commands, 'commands', trace, histogram)
+        self.files = _TracedCalls(sandbox.files, 'files', trace, histogram)
+
+    def __getattr__(self, name):
+        return getattr(self.sandbox, name)
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(source, system_prompt, model):
+    """Content address of an optimization request"""
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, source):
+        data = part.encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class OptimizationCache:
+    """Two-tier cache of optimized code: an in-memory LRU in front of a SQLite file.
+
+    Entries expire after `ttl` seconds. The memory tier holds at most `memory_entries`
+    items and the disk tier is trimmed, least recently used first, once the stored code
+    exceeds `max_bytes`.
+    """
+
+    def __init__(self, path, memory_entries=256, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS optimizations ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS optimizations_accessed ON optimizations (accessed_at)')
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                'SELECT value, created_at FROM optimizations WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                if row is not None:
+                    self._db.execute('DELETE FROM optimizations WHERE key = ?', (key,))
+                    self._db.commit()
+                    self.counters['evictions'] += 1
+                self.counters['misses'] += 1
+                return None
+
+            self._db.execute('UPDATE optimizations SET accessed_at = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.counters['disk_hits'] += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                'INSERT OR REPLACE INTO optimizations (key, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            self.counters['writes'] += 1
+            self._trim_disk(now)
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM optimizations'
+            ).fetchone()
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            return dict(self.counters,
+                        memory_entries=len(self._memory),
+                        disk_entries=entries,
+                        disk_bytes=size,
+                        hit_rate=hits / lookups if lookups else 0.0)
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _trim_disk(self, now):
+        expired = self._db.execute(
+            'DELETE FROM optimizations WHERE created_at <= ?', (now - self.ttl,)
+        ).rowcount
+        self.counters['evictions'] += expired
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM optimizations').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute('SELECT key, size FROM optimizations ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM optimizations WHERE key = ?', (key,))
+            self._memory.pop(key, None)
+            total -= size
+            self.counters['evictions'] += 1
@@ -0,0 +1,94 @@
+import shlex
+import threading
+from collections import deque
+
+
+OUTPUT_LOG_PATH = '/tmp/openoperator-output.log'
+
+# Runs inside the sandbox in place of `python <script>`. The script's stdout and stderr
+# go to one log file (up to a cap) and are forwarded live, but only up to a smaller cap,
+# so neither the sandbox SDK, which keeps everything it receives, nor the server ever
+# hold more than that. The script dies with the wrapper and its exit code is passed on.
+TEE_SCRIPT = '''
+import ctypes, signal, subprocess, sys, threading
+script, log_path, stream_limit, log_limit = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+
+def die_with_parent():
+    try:
+        ctypes.CDLL(None).prctl(1, signal.SIGKILL)
+    except Exception:
+        pass
+
+process = subprocess.Popen([sys.executable, '-u', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           preexec_fn=die_with_parent)
+lock = threading.Lock()
+counts = {'streamed': 0, 'logged': 0}
+log = open(log_path, 'wb')
+
+def pump(source, target):
+    for chunk in iter(lambda: source.read1(65536), b''):
+        with lock:
+            if counts['logged'] < log_limit:
+                log.write(chunk[:log_limit - counts['logged']])
+            counts['logged'] += len(chunk)
+            allowed = max(0, stream_limit - counts['streamed'])
+            counts['streamed'] += len(chunk)
+            if allowed:
+                target.write(chunk[:allowed])
+                target.flush()
+            if allowed < len(chunk) and counts['streamed'] - len(chunk) <= stream_limit:
+                sys.stderr.buffer.write(b"\\n[output limit reached, the rest is only written to the log]\\n")
+                sys.stderr.buffer.flush()
+
+pumps = [threading.Thread(target=pump, args=(process.stdout, sys.stdout.buffer)),
+         threading.Thread(target=pump, args=(process.stderr, sys.stderr.buffer))]
+for thread in pumps:
+    thread.start()
+for thread in pumps:
+    thread.join()
+log.close()
+code = process.wait()
+sys.exit(code if code >= 0 else 128 - code)
+'''
+
+
+def tee_command(script, stream_limit, log_limit, log_path=OUTPUT_LOG_PATH):
+    return (f"python -c {shlex.quote(TEE_SCRIPT)} {shlex.quote(script)} {shlex.quote(log_path)} "
+            f"{int(stream_limit)} {int(log_limit)}")
+
+
+class OutputRing:
+    """The last `limit` characters of a stream, plus a count of everything written"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.total = 0
+        self._chunks = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self.total += len(text)
+            if len(text) >= self.limit:
+                self._chunks.clear()
+                text = text[len(text) - self.limit:]
+                self._size = 0
+            self._chunks.append(text)
+            self._size += len(text)
+            while self._size > self.limit:
+                excess = self._size - self.limit
+                first = self._chunks.popleft()
+                if len(first) > excess:
+                    self._chunks.appendleft(first[excess:])
+                    self._size -= excess
+                else:
+                    self._size -= len(first)
+
+    @property
+    def truncated(self):
+        return self.total > self._size
+
+    def getvalue(self):
+        with self._lock:
+            return ''.join(self._chunks)
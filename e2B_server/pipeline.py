@@ -0,0 +1,65 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Pipeline:
+    """A small stage DAG: every stage starts as soon as the stages it depends on have finished.
+
+    Stages are callables taking the shared run context. Their return values are collected
+    by name. If a stage fails, nothing new is scheduled, stages already running are allowed
+    to finish (so nobody is still using shared resources such as the sandbox) and the first
+    error is re-raised. Setting `cancel_event` has the same effect and raises PipelineCancelled.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.stages = {}
+
+    def add(self, name, fn, after=()):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = (fn, tuple(after))
+        return self
+
+    def run(self, context, cancel_event=None):
+        for name, (_, after) in self.stages.items():
+            missing = [dep for dep in after if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {name} depends on unknown stages: {', '.join(missing)}")
+
+        results = {}
+        waiting = dict(self.stages)
+        running = {}
+        error = None
+
+        while waiting or running:
+            if error is None and cancel_event is not None and cancel_event.is_set():
+                error = PipelineCancelled("Run was cancelled")
+            if error is None:
+                ready = [name for name, (_, after) in waiting.items() if all(dep in results for dep in after)]
+                for name in ready:
+                    fn, _ = waiting.pop(name)
+                    running[self.executor.submit(fn, context)] = name
+                if not running:
+                    raise ValueError(f"Stages can never run: {', '.join(waiting)}")
+            elif not running:
+                break
+
+            # Wake up periodically so a cancellation is noticed between stage completions
+            done, _ = wait(running, timeout=0.5 if cancel_event is not None else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+
+        if error is not None:
+            raise error
+        return results
+
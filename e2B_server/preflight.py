@@ -0,0 +1,185 @@
+import ast
+import builtins
+import codeop
+import warnings
+
+from imports import DISTRIBUTION_NAMES, SAME_NAME, extract_imports, is_third_party
+
+
+class PreflightError(Exception):
+    """Generated code was rejected before it reached a sandbox"""
+
+    def __init__(self, message, code='', problems=()):
+        super().__init__(message)
+        self.code = code
+        self.problems = list(problems)
+
+
+# Names every module can use without binding them
+MODULE_NAMES = frozenset(dir(builtins)) | {
+    '__annotations__', '__builtins__', '__doc__', '__file__', '__loader__', '__name__', '__package__', '__spec__'
+}
+
+# Scripts calling these can bind names the AST does not show, so they are not checked for undefined names
+DYNAMIC_SCOPE_CALLS = {'exec', 'globals', 'locals', 'vars'}
+
+# Keep the report short, it is sent back to the LLM
+MAX_PROBLEMS = 5
+
+
+# Lines that continue the statement before them even though they start in column 0
+CONTINUATION_PREFIXES = ('else', 'elif ', 'except', 'finally', 'case ', ')', ']', '}')
+
+
+def syntax_error(code, filename='optimized_script.py'):
+    """Compact description of the first syntax error in `code`, or None if it compiles"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            compile(code, filename, 'exec')
+    except SyntaxError as e:
+        return f"{e.msg} at line {e.lineno}: {(e.text or '').strip()}"
+    except ValueError as e:
+        # e.g. source containing null bytes
+        return str(e)
+    return None
+
+
+class IncrementalSyntaxCheck:
+    """Syntax-checks code while it is still being generated.
+
+    `feed` takes chunks of text as they arrive. Whenever a line starts in column 0, the
+    code before it is a candidate complete module and gets compiled; a definite error
+    (not just unfinished input) is returned right away so the generation can be stopped.
+    Leading and trailing markdown fences are skipped the same way strip_code_fences does.
+    """
+
+    def __init__(self):
+        self.code = ''
+        self.error = None
+        self.finished = False
+        self._pending = ''
+        self._started = False
+        self._checked_lines = 0
+
+    def feed(self, text):
+        if self.error or self.finished:
+            return self.error
+        self._pending += text
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            self._line(line)
+            if self.error or self.finished:
+                break
+        return self.error
+
+    def _line(self, line):
+        stripped = line.strip()
+        if not self._started:
+            if not stripped:
+                return
+            self._started = True
+            if stripped.startswith('```'):
+                return
+        if stripped == '```':
+            self.finished = True
+            return
+
+        if line[:1] not in ('', ' ', '\t', '#') and not line.startswith(CONTINUATION_PREFIXES):
+            self._check_prefix()
+        self.code += line + '\n'
+
+    def _check_prefix(self):
+        lines = self.code.count('\n')
+        if lines == self._checked_lines:
+            return
+        self._checked_lines = lines
+        last = next((l.strip() for l in reversed(self.code.splitlines()) if l.strip()), '')
+        if last.startswith('@') or last.endswith('\\'):
+            return
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                codeop.compile_command(self.code, 'optimized_script.py', 'exec')
+        except (SyntaxError, ValueError, OverflowError):
+            self.error = syntax_error(self.code)
+
+
+def _bound_names(tree):
+    """Every name the module binds anywhere, in any scope"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(alias.asname or alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def undefined_names(tree):
+    """Names that are read but bound nowhere in the module, as (name, line) pairs.
+
+    Scopes are deliberately flattened: a name bound in any function counts as bound
+    everywhere. That misses some NameErrors but never reports working code.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+            return []
+        if isinstance(node, ast.Name) and node.id in DYNAMIC_SCOPE_CALLS:
+            return []
+    bound = _bound_names(tree) | MODULE_NAMES
+    undefined = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in bound:
+            undefined[node.id] = min(node.lineno, undefined.get(node.id, node.lineno))
+    return sorted(undefined.items(), key=lambda item: item[1])
+
+
+def check(code, known_modules=()):
+    """Problems that would make `code` fail in the sandbox, as (reason, message) pairs.
+
+    `known_modules` are the imports the code may use besides the standard library and
+    the packages in the distribution tables, i.e. the original script's imports and
+    its uploaded modules. Anything else is a module nobody is going to install.
+    """
+    error = syntax_error(code)
+    if error:
+        return [('syntax', error)]
+
+    problems = []
+    for name, line in undefined_names(ast.parse(code)):
+        problems.append(('undefined_name', f"name '{name}' is not defined at line {line}"))
+    known = set(known_modules)
+    for module in sorted(extract_imports(code)):
+        if is_third_party(module) and module not in known and module not in DISTRIBUTION_NAMES and module not in SAME_NAME:
+            problems.append(('import', f"imports '{module}', which is not installed and not a known package"))
+    return problems[:MAX_PROBLEMS]
+
+
+def repair_messages(messages, code, problems):
+    """The conversation extended with the rejected code and a compact list of its problems"""
+    report = '\n'.join(f"- {message}" for _, message in problems)
+    return messages + [
+        {"role": "assistant", "content": code},
+        {"role": "user", "content": f"This code fails before running:\n{report}\nReturn the complete corrected script."}
+    ]
+
+
+def delta_text(delta):
+    """Text of a streamed Mistral delta, whose content is a string or a list of chunks"""
+    content = getattr(delta, 'content', None)
+    if not content:
+        return ''
+    if isinstance(content, str):
+        return content
+    return ''.join(getattr(chunk, 'text', '') or '' for chunk in content)
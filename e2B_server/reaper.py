@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+
+def kill_many(sandbox_ids, kill, workers=16):
+    """Kill sandboxes concurrently, yielding (sandbox_id, error) as each one finishes.
+
+    `kill` is called with a single sandbox id and is expected to enforce its own
+    per-sandbox request timeout. `error` is None when the kill succeeded.
+    """
+    if not sandbox_ids:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(sandbox_ids)), thread_name_prefix='sandbox-kill') as executor:
+        futures = {executor.submit(kill, sandbox_id): sandbox_id for sandbox_id in sandbox_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                yield futures[future], None
+            except Exception as e:
+                yield futures[future], e
+
+
+def sandbox_age(sandbox_info, now=None):
+    now = now or datetime.now(timezone.utc)
+    started_at = sandbox_info.started_at
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    return (now - started_at).total_seconds()
+
+
+class SandboxReaper:
+    """Background thread that kills sandboxes this app leaked.
+
+    Only sandboxes tagged with our `app` metadata are considered. Any of them older than
+    `ttl` seconds is killed unless it is protected (held by this process, idle or in use).
+    Sandboxes created by this server instance that are no longer tracked by the process
+    (not pooled, not in a session) are killed once they have been idle for `idle` seconds.
+    """
+
+    def __init__(self, list_sandboxes, kill, app_name, instance_id, is_tracked, is_protected,
+                 ttl=3600, idle=900, interval=300, workers=16):
+        self.list_sandboxes = list_sandboxes
+        self.kill = kill
+        self.app_name = app_name
+        self.instance_id = instance_id
+        self.is_tracked = is_tracked
+        self.is_protected = is_protected
+        self.ttl = ttl
+        self.idle = idle
+        self.interval = interval
+        self.workers = workers
+        self._first_untracked = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='sandbox-reaper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def candidates(self):
+        now = datetime.now(timezone.utc)
+        seen_at = time.monotonic()
+        doomed = []
+        untracked = {}
+        for info in self.list_sandboxes():
+            metadata = info.metadata or {}
+            if metadata.get('app') != self.app_name:
+                continue
+            sandbox_id = info.sandbox_id
+            if self.is_protected(sandbox_id):
+                continue
+            if sandbox_age(info, now) >= self.ttl:
+                doomed.append(sandbox_id)
+                continue
+            if metadata.get('instance') == self.instance_id and not self.is_tracked(sandbox_id):
+                # Idle time counts from the first sweep that found it untracked
+                untracked[sandbox_id] = self._first_untracked.get(sandbox_id, seen_at)
+                if seen_at - untracked[sandbox_id] >= self.idle:
+                    doomed.append(sandbox_id)
+        self._first_untracked = untracked
+        return doomed
+
+    def reap(self):
+        killed = 0
+        for sandbox_id, error in kill_many(self.candidates(), self.kill, self.workers):
+            if error is None:
+                killed += 1
+                print('Reaped sandbox', sandbox_id)
+            else:
+                print(f"Error reaping sandbox {sandbox_id}: {str(error)}")
+        return killed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error in sandbox reaper: {str(e)}")
@@ -0,0 +1,130 @@
+"""Response schema versions, encodings and compression for /execute and the job API.
+
+v1 is the original body: every event carries its input and output inline, so the
+uploaded source, the optimized code and the output each appear several times. v2 stores
+every text once in a `content` list and refers to it by index everywhere else:
+
+    {"version": 2, "content": ["print(1)", "1\\n"], "python_code": 0, "output": 1,
+     "timeline_events": [{"step": "File Upload", "input": 0, "output": ...}, ...]}
+
+v2 can be encoded as msgpack instead of JSON. Either version is compressed with zstd or
+gzip when the client accepts it.
+"""
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+V2_MEDIA_TYPE = 'application/vnd.openoperator.v2'
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack', '+msgpack')
+
+# Top-level fields holding large texts, and the event fields that repeat them
+TEXT_FIELDS = ('python_code', 'optimized_code', 'output')
+EVENT_TEXT_FIELDS = ('input', 'output')
+NESTED_FIELDS = ('result', 'error')
+
+
+class ContentTable:
+    """Each distinct text once, addressed by its position"""
+
+    def __init__(self):
+        self.blobs = []
+        self._index = {}
+
+    def ref(self, text):
+        if not isinstance(text, str):
+            return text
+        index = self._index.get(text)
+        if index is None:
+            index = self._index[text] = len(self.blobs)
+            self.blobs.append(text)
+        return index
+
+
+def _compact_event(event, table):
+    return dict(event, **{field: table.ref(event[field]) for field in EVENT_TEXT_FIELDS if field in event})
+
+
+def _compact(body, table):
+    body = dict(body)
+    for field in TEXT_FIELDS:
+        if field in body:
+            body[field] = table.ref(body[field])
+    # Step responses repeat their last event on its own next to the list
+    if isinstance(body.get('timeline_event'), dict):
+        body['timeline_event'] = _compact_event(body['timeline_event'], table)
+    if 'timeline_events' in body:
+        body['timeline_events'] = [_compact_event(event, table) for event in body['timeline_events']]
+    # A job's result or error body shares the table with the job
+    for field in NESTED_FIELDS:
+        if isinstance(body.get(field), dict):
+            body[field] = _compact(body[field], table)
+    return body
+
+
+def to_v2(payload):
+    """The v2 form of a result, step, error or job body"""
+    table = ContentTable()
+    body = _compact(payload, table)
+    body['version'] = 2
+    body['content'] = table.blobs
+    return body
+
+
+def requested_version(param, accept):
+    if param in ('2', 'v2') or V2_MEDIA_TYPE in accept:
+        return 2
+    return 1
+
+
+def wants_msgpack(accept):
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def accepted_encodings(accept_encoding):
+    """Codings the client accepts, ignoring those it refuses with q=0"""
+    codings = set()
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            codings.add(name.strip().lower())
+    return codings
+
+
+def compress(body, accept_encoding, min_bytes):
+    """(body, content_encoding) using zstd when available and accepted, else gzip"""
+    if len(body) < min_bytes:
+        return body, None
+    codings = accepted_encodings(accept_encoding)
+    if zstandard is not None and 'zstd' in codings:
+        return zstandard.ZstdCompressor(level=3).compress(body), 'zstd'
+    if 'gzip' in codings:
+        return gzip.compress(body, compresslevel=5), 'gzip'
+    return body, None
+
+
+def encode_payload(payload, version, accept, accept_encoding, min_bytes=1024):
+    """Serialize a response body as negotiated. Returns (body, headers)"""
+    if version == 2:
+        payload = to_v2(payload)
+    if version == 2 and wants_msgpack(accept):
+        body = msgpack.packb(payload, use_bin_type=True)
+        content_type = 'application/msgpack'
+    else:
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        content_type = 'application/json'
+    body, content_encoding = compress(body, accept_encoding, min_bytes)
+    headers = {'Content-Type': content_type, 'Vary': 'Accept, Accept-Encoding'}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    return body, headers
@@ -0,0 +1,174 @@
+"""Picks the Mistral model for a script from the size of the prompt and how branchy the code is.
+
+Routes are tried in order and the first one the prompt fits is used:
+
+    mistral-small-latest:1500:15,mistral-large-latest:32000
+
+sends prompts of up to 1500 tokens with at most 15 decision points (branches, loops,
+handlers, boolean operators) to the small model and everything else up to 32000 tokens
+to the large one. A prompt no route accepts is refused before a sandbox is taken.
+A script that is optimized in chunks is routed chunk by chunk, so only the size of
+each chunk's prompt is limited.
+
+Tokens are counted locally with tiktoken (an encoding name such as `cl100k_base`) or
+tokenizers (a `tokenizer.json` path). Neither is Mistral's own tokenizer, so counts are
+an approximation; without either library, while the vocabulary is loading, or when it
+cannot be loaded, they are estimated from the length of the text.
+"""
+import ast
+import math
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import tokenizers
+except ImportError:
+    tokenizers = None
+
+
+# Characters per token for the fallback estimate. Code tokenizes denser than prose,
+# so this errs towards counting too many
+CHARS_PER_TOKEN = 3.5
+
+DECISION_NODES = (ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler, ast.With,
+                  ast.AsyncWith, ast.BoolOp, ast.comprehension, ast.Assert, ast.match_case)
+
+
+class PromptTooLarge(ValueError):
+    pass
+
+
+class Route:
+    def __init__(self, model, max_tokens, max_complexity=None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_complexity = max_complexity
+
+    def accepts(self, tokens, complexity):
+        if tokens > self.max_tokens:
+            return False
+        # Code that does not parse has no complexity; only a route without a limit takes it
+        if self.max_complexity is not None and (complexity is None or complexity > self.max_complexity):
+            return False
+        return True
+
+    def describe(self):
+        limit = f"<= {self.max_tokens} tokens"
+        if self.max_complexity is not None:
+            limit += f", <= {self.max_complexity} decision points"
+        return limit
+
+
+def parse_routes(spec):
+    """Routes from `model:max_tokens[:max_complexity]` entries separated by commas"""
+    routes = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        parts = [part.strip() for part in entry.split(':')]
+        if len(parts) not in (2, 3) or not parts[0]:
+            raise ValueError(f"Invalid model route {entry.strip()!r}, expected model:max_tokens[:max_complexity]")
+        routes.append(Route(parts[0], int(parts[1]), int(parts[2]) if len(parts) == 3 and parts[2] else None))
+    if not routes:
+        raise ValueError("At least one model route is required")
+    return routes
+
+
+def complexity(source):
+    """Decision points in the code, or None if it does not parse"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    return sum(1 for node in ast.walk(tree) if isinstance(node, DECISION_NODES))
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    """Counts tokens with the configured local tokenizer.
+
+    `load` prepares the tokenizer in the background; the server starts it at startup, so
+    no request waits for tiktoken to download its vocabulary (cached in `TIKTOKEN_CACHE_DIR`). Until
+    it is ready, and if it cannot be loaded, counts are estimated from the length of the text.
+    """
+
+    def __init__(self, tokenizer='cl100k_base'):
+        self.tokenizer = tokenizer
+        self.method = 'estimate'
+        self._encode = estimate_tokens
+        self._loader = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        name = self.tokenizer
+        try:
+            if name.endswith('.json'):
+                if tokenizers is None:
+                    raise ImportError("tokenizers is not installed")
+                tokenizer = tokenizers.Tokenizer.from_file(name)
+                return f"tokenizers:{name}", lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+            if tiktoken is None:
+                raise ImportError("tiktoken is not installed")
+            encoding = tiktoken.get_encoding(name)
+            return f"tiktoken:{name}", lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            print(f"Error loading tokenizer {name}, estimating token counts instead: {str(e)}")
+            return 'estimate', estimate_tokens
+
+    def _install(self):
+        self.method, self._encode = self._load()
+
+    def load(self, timeout=0):
+        """Start loading the tokenizer and wait up to `timeout` seconds. Returns whether it is done"""
+        with self._lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._install, name='tokenizer-load', daemon=True)
+                self._loader.start()
+        self._loader.join(timeout)
+        return not self._loader.is_alive()
+
+    def count(self, text):
+        return self._encode(text)
+
+
+class ModelRouter:
+    def __init__(self, routes, counter):
+        self.routes = routes
+        self.counter = counter
+
+    def route(self, system_prompt, source, required=True):
+        """The routing decision for a prompt. If no route takes it, raises PromptTooLarge, or
+        returns the decision without a model when `required` is false"""
+        tokens = self.counter.count(system_prompt) + self.counter.count(source)
+        decision = {
+            'model': None,
+            'tokens': tokens,
+            'complexity': complexity(source),
+            'tokenizer': self.counter.method,
+            'rule': None
+        }
+        for route in self.routes:
+            if route.accepts(tokens, decision['complexity']):
+                decision.update(model=route.model, rule=route.describe())
+                return decision
+        if required:
+            raise self.refusal(decision)
+        return decision
+
+    def refusal(self, decision, subject='script'):
+        """The PromptTooLarge for a decision no route took"""
+        tokens = decision['tokens']
+        limit = max(route.max_tokens for route in self.routes)
+        if tokens > limit:
+            return PromptTooLarge(f"{subject[:1].upper()}{subject[1:]} is too large to optimize: "
+                                  f"{tokens} prompt tokens, the limit is {limit}")
+        return PromptTooLarge(f"No model route accepts this {subject} ({tokens} prompt tokens, "
+                              f"{decision['complexity'] if decision['complexity'] is not None else 'unparseable'} "
+                              f"decision points)")
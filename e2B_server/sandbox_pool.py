@@ -0,0 +1,295 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PooledSandbox:
+    """Bookkeeping for a sandbox owned by the pool"""
+
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+        self.created_at = time.monotonic()
+        self.last_checked = self.created_at
+        self.uses = 0
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created_at
+
+
+class SandboxPool:
+    """Keeps pre-booted sandboxes warm so requests can check one out without paying boot latency.
+
+    Idle sandboxes are health-checked and kept alive in the background, sandboxes are
+    recycled after max_age seconds or max_uses checkouts, and every returned sandbox is
+    reset before it is handed out again. Resets and health checks run on a few worker
+    threads, so one slow sandbox does not hold up the others.
+    """
+
+    def __init__(self, factory, min_size=2, max_size=10, max_age=1800, max_uses=20,
+                 health_interval=30, keepalive=600, reset_command=None, reset_user=None,
+                 checkout_timeout=60, on_create=None, maintenance_workers=4):
+        self.factory = factory
+        self.on_create = on_create
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.health_interval = health_interval
+        self.keepalive = keepalive
+        self.reset_command = reset_command
+        self.reset_user = reset_user
+        self.checkout_timeout = checkout_timeout
+        self.maintenance_workers = maintenance_workers
+
+        self._idle = deque()
+        self._dirty = deque()
+        self._in_use = {}
+        # Sandboxes being reset or health-checked, which go back to idle unless they fail
+        self._settling = {}
+        self._pending = 0
+        self._lock = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._workers = None
+
+    # Lifecycle
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._workers = ThreadPoolExecutor(max_workers=self.maintenance_workers,
+                                               thread_name_prefix='sandbox-pool-maintain')
+            self._thread = threading.Thread(target=self._maintain, name='sandbox-pool', daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            entries = list(self._idle) + list(self._dirty)
+            self._idle.clear()
+            self._dirty.clear()
+            self._lock.notify_all()
+            workers = self._workers
+        self._wakeup.set()
+        if workers is not None:
+            workers.shutdown(wait=False)
+        for entry in entries:
+            self._destroy(entry)
+
+    # Checkout / release
+
+    def checkout(self, timeout=None):
+        """Return a ready sandbox, creating one if the pool is below max_size.
+
+        A failed create is retried with backoff until `timeout`, taking a sandbox that is
+        released in the meantime instead.
+        """
+        self.start()
+        timeout = timeout if timeout is not None else self.checkout_timeout
+        deadline = time.monotonic() + timeout
+        retry_delay = 0.5
+        while True:
+            with self._lock:
+                if self._idle:
+                    entry = self._idle.popleft()
+                    self._lease(entry)
+                    self._wakeup.set()
+                    return entry.sandbox
+                if self._total() < self.max_size:
+                    self._pending += 1
+                    create_now = True
+                else:
+                    create_now = False
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted(f"No sandbox available after waiting {timeout}s")
+                    self._lock.wait(remaining)
+
+            if create_now:
+                entry = self._create()
+                with self._lock:
+                    self._pending -= 1
+                    if entry is not None:
+                        self._lease(entry)
+                        self._wakeup.set()
+                        return entry.sandbox
+                    self._lock.notify_all()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted(f"Failed to create a sandbox within {timeout}s")
+                    self._lock.wait(min(retry_delay, remaining))
+                retry_delay = min(retry_delay * 2, 5)
+
+    def release(self, sandbox, discard=False):
+        """Hand a sandbox back; it is reset in the background before reuse"""
+        with self._lock:
+            entry = self._in_use.pop(sandbox.sandbox_id, None)
+            if entry is None:
+                return
+            retire = discard or self._stopped or self._expired(entry)
+            if not retire:
+                self._dirty.append(entry)
+            self._lock.notify_all()
+        if retire:
+            threading.Thread(target=self._destroy, args=(entry,), daemon=True).start()
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'resetting': len(self._dirty) + len(self._settling),
+                'pending': self._pending,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            }
+
+    def drain_idle(self):
+        """Retire every idle sandbox (e.g. after they were killed externally) and refill"""
+        with self._lock:
+            entries = list(self._idle)
+            self._idle.clear()
+        for entry in entries:
+            self._destroy(entry)
+        self._wakeup.set()
+        return len(entries)
+
+    def is_pooled(self, sandbox_id):
+        with self._lock:
+            return (sandbox_id in self._in_use or sandbox_id in self._settling
+                    or any(e.sandbox.sandbox_id == sandbox_id for e in self._idle)
+                    or any(e.sandbox.sandbox_id == sandbox_id for e in self._dirty))
+
+    # Internals
+
+    def _total(self):
+        return len(self._idle) + len(self._dirty) + len(self._in_use) + len(self._settling) + self._pending
+
+    def _lease(self, entry):
+        entry.uses += 1
+        self._in_use[entry.sandbox.sandbox_id] = entry
+
+    def _expired(self, entry):
+        return entry.age >= self.max_age or entry.uses >= self.max_uses
+
+    def _create(self, prepare=False):
+        try:
+            sandbox = self.factory()
+            print('Sandbox created', sandbox.sandbox_id)
+        except Exception as e:
+            print(f"Error creating pooled sandbox: {str(e)}")
+            return None
+        # Warm-up work only runs for background refills, never on the checkout path
+        if prepare and self.on_create:
+            try:
+                self.on_create(sandbox)
+            except Exception as e:
+                print(f"Error preparing sandbox {sandbox.sandbox_id}: {str(e)}")
+        return PooledSandbox(sandbox)
+
+    def _destroy(self, entry):
+        try:
+            entry.sandbox.kill()
+            print('Sandbox retired', entry.sandbox.sandbox_id)
+        except Exception as e:
+            print(f"Error killing pooled sandbox {entry.sandbox.sandbox_id}: {str(e)}")
+
+    def _reset(self, entry):
+        if not self.reset_command:
+            return True
+        try:
+            entry.sandbox.commands.run(self.reset_command, timeout=30,
+                                       **({'user': self.reset_user} if self.reset_user else {}))
+            return True
+        except Exception as e:
+            print(f"Error resetting sandbox {entry.sandbox.sandbox_id}: {str(e)}")
+            return False
+
+    def _healthy(self, entry):
+        try:
+            if not entry.sandbox.is_running():
+                return False
+            entry.sandbox.set_timeout(self.keepalive)
+            entry.last_checked = time.monotonic()
+            return True
+        except Exception as e:
+            print(f"Health check failed for sandbox {entry.sandbox.sandbox_id}: {str(e)}")
+            return False
+
+    def _maintain(self):
+        while True:
+            self._wakeup.wait(self.health_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if self._stopped:
+                    return
+
+            with self._lock:
+                if self._stopped:
+                    return
+                # Reset sandboxes that were handed back
+                while self._dirty:
+                    self._settle_later(self._dirty.popleft(), self._reset_one)
+                # Recycle old sandboxes and drop unhealthy ones
+                now = time.monotonic()
+                stale = [e for e in self._idle
+                         if self._expired(e) or now - e.last_checked >= self.health_interval]
+                for e in stale:
+                    self._idle.remove(e)
+                    self._settle_later(e, self._check_one)
+
+            # Refill up to min_size idle sandboxes, booting them in parallel
+            with self._lock:
+                if self._stopped:
+                    return
+                missing = min(self.min_size - len(self._idle) - len(self._settling),
+                              self.max_size - self._total())
+                missing = max(missing, 0)
+                self._pending += missing
+            for _ in range(missing):
+                threading.Thread(target=self._refill_one, daemon=True).start()
+
+    def _reset_one(self, entry):
+        self._settle(entry, self._reset(entry))
+
+    def _check_one(self, entry):
+        self._settle(entry, not self._expired(entry) and self._healthy(entry))
+
+    def _settle_later(self, entry, work):
+        # Called with the lock held, so shutdown cannot close the executor in between
+        self._settling[entry.sandbox.sandbox_id] = entry
+        self._workers.submit(work, entry)
+
+    def _settle(self, entry, keep):
+        """Return a reset or checked sandbox to the idle set, or retire it"""
+        with self._lock:
+            self._settling.pop(entry.sandbox.sandbox_id, None)
+            if keep and not self._stopped:
+                self._idle.append(entry)
+            else:
+                keep = False
+            self._lock.notify_all()
+        if not keep:
+            self._destroy(entry)
+
+    def _refill_one(self):
+        entry = self._create(prepare=True)
+        with self._lock:
+            self._pending -= 1
+            stopped = self._stopped
+            if entry is not None and not stopped:
+                self._idle.append(entry)
+            self._lock.notify_all()
+        if entry is not None and stopped:
+            self._destroy(entry)
@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class SessionStore:
+    """Thread-safe key/value store whose entries expire after `ttl` seconds without access.
+
+    Expired sessions are handed to `on_expire` so they can give back whatever they hold
+    (for example a checked-out sandbox). A background thread sweeps every `sweep_interval`
+    seconds, so abandoned sessions are cleaned up even when no further requests arrive.
+    """
+
+    def __init__(self, ttl=900, on_expire=None, sweep_interval=30):
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, key, session):
+        self._start()
+        with self._lock:
+            self._sessions[key] = [session, time.monotonic() + self.ttl]
+        return session
+
+    def get(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            entry[1] = time.monotonic() + self.ttl
+            return entry[0]
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+        return entry[0] if entry else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            sessions = [self._sessions.pop(key)[0] for key in expired]
+        for session in sessions:
+            if self.on_expire:
+                try:
+                    self.on_expire(session)
+                except Exception as e:
+                    print(f"Error expiring session: {str(e)}")
+        return len(sessions)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True)
+            self._thread.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The server's modules are imported by their flat names, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """app.py wired to the offline fakes the load test uses, with fast latencies"""
+    from bench.loadtest import DEFAULTS, load_app
+
+    config = dict(DEFAULTS, scale=0.01, pool_min=1, pool_max=4)
+    return load_app(config, str(tmp_path_factory.mktemp('server')))
@@ -0,0 +1,84 @@
+from chunking import PLACEHOLDER, chunk_problems, split_module
+
+SOURCE = '''import math
+
+LIMIT = 10
+
+
+@staticmethod
+def first(x):
+    return x + 1
+
+# belongs to the group
+def second(x):
+    return x * 2
+
+
+class Shape:
+    sides = 0
+
+    def area(self):
+        return 0
+
+
+total = first(1)
+'''
+
+
+def count_lines(text):
+    return text.count('\n')
+
+
+def test_definitions_become_chunks_and_context_is_left_out():
+    plan = split_module(SOURCE, count_lines, target_tokens=1)
+    assert [chunk.names for chunk in plan.chunks] == [['first'], ['second'], ['Shape']]
+    # Decorators are part of the chunk, top-level statements are not
+    assert plan.source(0) == "@staticmethod\ndef first(x):\n    return x + 1\n"
+    assert plan.source(2).startswith("class Shape:")
+    assert all('total' not in plan.source(i) for i in range(3))
+
+
+def test_adjacent_definitions_are_grouped_up_to_the_target():
+    plan = split_module(SOURCE, count_lines, target_tokens=100)
+    assert [chunk.names for chunk in plan.chunks] == [['first', 'second', 'Shape']]
+    assert "# belongs to the group" in plan.source(0)
+    # A statement between definitions ends the group
+    plan = split_module("def a():\n    pass\nX = 1\ndef b():\n    pass\n", count_lines, target_tokens=100)
+    assert [chunk.names for chunk in plan.chunks] == [['a'], ['b']]
+
+
+def test_unparsable_source_has_no_plan():
+    assert split_module("def broken(:\n", count_lines, 100) is None
+
+
+def test_assemble_without_replacements_restores_the_source():
+    plan = split_module(SOURCE, count_lines, target_tokens=1)
+    assert plan.assemble({}) == SOURCE
+
+
+def test_assemble_replaces_only_the_given_chunks():
+    plan = split_module(SOURCE, count_lines, target_tokens=1)
+    assembled = plan.assemble({1: "\ndef second(x):\n    return x << 1\n\n"})
+    assert "return x << 1" in assembled
+    assert "return x * 2" not in assembled
+    assert plan.source(0) in assembled and plan.source(2) in assembled
+
+
+def test_outline_stubs_the_other_chunks():
+    plan = split_module(SOURCE, count_lines, target_tokens=1)
+    outline = plan.outline(1)
+    assert PLACEHOLDER in outline
+    assert "return x * 2" not in outline
+    # Other definitions keep their signatures, decorators and class attributes only
+    assert "@staticmethod\ndef first(x):\n    ..." in outline
+    assert "sides = 0" in outline and "def area(self):\n        ..." in outline
+    assert "total = first(1)" in outline
+
+
+def test_chunk_problems():
+    assert chunk_problems("def f():\n    return 1\n", ['f']) == []
+    assert chunk_problems("import math\nCACHE = {}\ndef f():\n    return 1\n", ['f']) == []
+    assert chunk_problems("def g():\n    pass\n", ['f']) == [
+        ('missing_definition', "The code must still define f")]
+    assert chunk_problems("def f():\n    pass\nf()\n", ['f'])[0][0] == 'top_level_code'
+    assert chunk_problems("def f(:\n", ['f'])[0][0] == 'syntax'
@@ -0,0 +1,41 @@
+from imports import extract_imports, required_packages
+
+SCRIPT = '''
+import os, sys
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from . import sibling
+from .helpers import tool
+import importlib
+
+def plot():
+    import matplotlib.pyplot as plt
+    yaml = importlib.import_module("yaml")
+    return __import__("PIL.Image")
+'''
+
+
+def test_extract_imports_finds_nested_and_dynamic_imports():
+    assert extract_imports(SCRIPT) == {'os', 'sys', 'numpy', 'sklearn', 'importlib', 'matplotlib', 'yaml', 'PIL'}
+
+
+def test_unparsable_source_falls_back_to_the_pattern():
+    source = "Here is the code:\nimport pandas\nfrom requests.adapters import HTTPAdapter\nprint(\n"
+    assert extract_imports(source) == {'pandas', 'requests'}
+
+
+def test_required_packages_maps_distribution_names_and_skips_stdlib():
+    packages, guessed = required_packages(SCRIPT)
+    assert packages == ['Pillow', 'PyYAML', 'matplotlib', 'numpy', 'scikit-learn']
+    assert guessed == []
+
+
+def test_unknown_names_are_guessed():
+    packages, guessed = required_packages("import rich\nimport pandas\n")
+    assert packages == ['pandas', 'rich']
+    assert guessed == ['rich']
+
+
+def test_local_modules_and_private_names_are_not_installed():
+    source = "import helpers\nimport _private\nimport pip\nimport requests\n"
+    assert required_packages(source, local_modules=['helpers']) == (['requests'], [])
@@ -0,0 +1,103 @@
+import io
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFull
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def gate():
+    # Holds the queue's single worker busy until the test lets it go
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def blocking(cancel_event, gate):
+    gate.wait(5)
+    return 'done'
+
+
+def test_job_runs_and_reports_its_result():
+    queue = JobQueue(workers=1)
+    job = queue.submit(lambda cancel_event, x: x * 2, 21)
+    wait_until(lambda: job.finished)
+    assert job.to_dict()['status'] == 'succeeded'
+    assert job.result == 42
+
+
+def test_failed_job_keeps_the_error():
+    def fails(cancel_event):
+        raise RuntimeError("boom")
+    queue = JobQueue(workers=1)
+    job = queue.submit(fails)
+    wait_until(lambda: job.finished)
+    assert (job.status, job.error) == ('failed', 'boom')
+
+
+def test_full_queue_raises_with_retry_after(gate):
+    queue = JobQueue(workers=1, max_depth=1)
+    queue.submit(blocking, gate)
+    wait_until(lambda: queue.stats()['running'] == 1)
+    queue.submit(blocking, gate)
+
+    with pytest.raises(QueueFull) as raised:
+        queue.submit(blocking, gate)
+    # One running and one queued job at the default 30s estimate, on one worker
+    assert raised.value.retry_after == 60
+    assert "retry in 60s" in str(raised.value)
+
+
+def test_cancelled_queued_job_frees_its_slot_and_cleans_up(gate):
+    cleaned = []
+    queue = JobQueue(workers=1, max_depth=1)
+    queue.submit(blocking, gate)
+    wait_until(lambda: queue.stats()['running'] == 1)
+    queued = queue.submit(blocking, gate, cleanup=cleaned.append)
+
+    assert queue.cancel(queued.id)
+    assert queued.status == 'cancelled'
+    assert cleaned == [gate]
+    assert queue.stats()['queued'] == 0
+    # The slot is free again and the worker skips the cancelled job
+    later = queue.submit(blocking, gate)
+    gate.set()
+    wait_until(lambda: later.finished)
+    assert later.status == 'succeeded'
+    assert queued.started_at is None
+
+
+def test_cancel_of_a_finished_job_is_refused():
+    queue = JobQueue(workers=1)
+    job = queue.submit(lambda cancel_event: None)
+    wait_until(lambda: job.finished)
+    assert not queue.cancel(job.id)
+    assert not queue.cancel('unknown')
+
+
+def test_jobs_endpoint_answers_429_with_retry_after(server, monkeypatch):
+    # No workers: submitted jobs stay queued, so the second one finds the queue full
+    monkeypatch.setattr(server, 'job_queue', JobQueue(workers=0, max_depth=1))
+    client = server.app.test_client()
+
+    def post():
+        return client.post('/jobs', data={'python_file': (io.BytesIO(b"print(1)\n"), 'job.py')})
+
+    accepted = post()
+    assert accepted.status_code == 202
+    rejected = post()
+    assert rejected.status_code == 429
+    assert rejected.headers['Retry-After'] == str(rejected.get_json()['retry_after'])
+
+    # Cancelling the queued job frees its slot
+    assert client.delete(accepted.get_json()['status_url']).status_code == 200
+    assert post().status_code == 202
@@ -0,0 +1,68 @@
+import random
+import subprocess
+
+from output_capture import OutputRing, tee_command
+
+
+def test_ring_keeps_everything_under_the_limit():
+    ring = OutputRing(10)
+    ring.write("abc")
+    ring.write("def")
+    assert ring.getvalue() == "abcdef"
+    assert not ring.truncated
+
+
+def test_ring_keeps_the_tail_across_chunk_boundaries():
+    ring = OutputRing(5)
+    for chunk in ("abc", "defg", "h"):
+        ring.write(chunk)
+    assert ring.getvalue() == "defgh"
+    assert ring.total == 8
+    assert ring.truncated
+
+
+def test_ring_with_a_chunk_larger_than_the_limit():
+    ring = OutputRing(4)
+    ring.write("ab")
+    ring.write("0123456789")
+    assert ring.getvalue() == "6789"
+    ring.write("x")
+    assert ring.getvalue() == "789x"
+
+
+def test_ring_matches_the_tail_of_everything_written():
+    rng = random.Random(7)
+    ring = OutputRing(100)
+    written = []
+    for _ in range(500):
+        chunk = ''.join(rng.choice('abcdef\n') for _ in range(rng.randint(0, 150)))
+        ring.write(chunk)
+        written.append(chunk)
+        everything = ''.join(written)
+        assert ring.getvalue() == everything[-100:]
+    assert ring.total == len(everything)
+
+
+def run_tee(tmp_path, body, stream_limit, log_limit):
+    script = tmp_path / 'script.py'
+    script.write_text(body)
+    log = tmp_path / 'output.log'
+    result = subprocess.run(tee_command(str(script), stream_limit, log_limit, log_path=str(log)),
+                            shell=True, capture_output=True)
+    return result, log.read_bytes()
+
+
+def test_tee_caps_the_stream_and_the_log(tmp_path):
+    result, log = run_tee(tmp_path, "import sys\nsys.stdout.write('x' * 5000)\n", stream_limit=1000, log_limit=3000)
+    assert result.returncode == 0
+    assert result.stdout == b'x' * 1000
+    assert b"output limit reached" in result.stderr
+    assert log == b'x' * 3000
+
+
+def test_tee_passes_small_output_and_the_exit_code_through(tmp_path):
+    result, log = run_tee(tmp_path, "import sys\nprint('hello')\nsys.exit(3)\n", stream_limit=1000, log_limit=1000)
+    assert result.returncode == 3
+    assert result.stdout == b"hello\n"
+    assert result.stderr == b""
+    assert log == b"hello\n"
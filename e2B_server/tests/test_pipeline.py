@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline import Pipeline, PipelineCancelled
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def recorder(log, name, result=None, delay=0, error=None):
+    def stage(context):
+        log.append(('start', name))
+        time.sleep(delay)
+        log.append(('end', name))
+        if error is not None:
+            raise error
+        return result
+    return stage
+
+
+def test_stages_run_after_their_dependencies(executor):
+    log = []
+    pipeline = (Pipeline(executor)
+                .add('sandbox', recorder(log, 'sandbox', 'sb'))
+                .add('upload', recorder(log, 'upload', delay=0.05), after=['sandbox'])
+                .add('optimize', recorder(log, 'optimize', 'code', delay=0.05))
+                .add('execute', recorder(log, 'execute', 'out'), after=['upload', 'optimize']))
+    results = pipeline.run({})
+
+    assert results == {'sandbox': 'sb', 'upload': None, 'optimize': 'code', 'execute': 'out'}
+    assert log.index(('end', 'sandbox')) < log.index(('start', 'upload'))
+    assert log.index(('start', 'execute')) > max(log.index(('end', 'upload')), log.index(('end', 'optimize')))
+
+
+def test_independent_stages_overlap(executor):
+    log = []
+    pipeline = (Pipeline(executor)
+                .add('a', recorder(log, 'a', delay=0.1))
+                .add('b', recorder(log, 'b', delay=0.1)))
+    pipeline.run({})
+    # Both started before either finished
+    assert set(log[:2]) == {('start', 'a'), ('start', 'b')}
+
+
+def test_failure_stops_dependents_and_waits_for_running_stages(executor):
+    log = []
+    pipeline = (Pipeline(executor)
+                .add('fails', recorder(log, 'fails', error=RuntimeError("pip failed")))
+                .add('slow', recorder(log, 'slow', delay=0.1))
+                .add('after', recorder(log, 'after'), after=['fails']))
+    with pytest.raises(RuntimeError, match="pip failed"):
+        pipeline.run({})
+
+    assert ('start', 'after') not in log
+    # The stage already running was allowed to finish before the error surfaced
+    assert ('end', 'slow') in log
+
+
+def test_first_error_wins(executor):
+    pipeline = (Pipeline(executor)
+                .add('first', recorder([], 'first', error=ValueError("first")))
+                .add('second', recorder([], 'second', delay=0.05, error=ValueError("second"))))
+    with pytest.raises(ValueError, match="first"):
+        pipeline.run({})
+
+
+def test_cancel_event_stops_scheduling(executor):
+    log = []
+    cancel = threading.Event()
+
+    def cancelling(context):
+        cancel.set()
+
+    pipeline = (Pipeline(executor)
+                .add('cancel', cancelling)
+                .add('next', recorder(log, 'next'), after=['cancel']))
+    with pytest.raises(PipelineCancelled):
+        pipeline.run({}, cancel_event=cancel)
+    assert log == []
+
+
+def test_unknown_and_duplicate_stages_are_rejected(executor):
+    with pytest.raises(ValueError, match="Duplicate stage"):
+        Pipeline(executor).add('a', lambda context: None).add('a', lambda context: None)
+    with pytest.raises(ValueError, match="unknown stages: missing"):
+        Pipeline(executor).add('a', lambda context: None, after=['missing']).run({})
+
+
+def test_dependency_cycle_is_reported(executor):
+    pipeline = (Pipeline(executor)
+                .add('a', lambda context: None, after=['b'])
+                .add('b', lambda context: None, after=['a']))
+    with pytest.raises(ValueError, match="can never run"):
+        pipeline.run({})
@@ -0,0 +1,95 @@
+import ast
+import types
+
+from preflight import IncrementalSyntaxCheck, check, delta_text, repair_messages, syntax_error, undefined_names
+
+
+def feed_in_chunks(text, size=7):
+    checker = IncrementalSyntaxCheck()
+    for start in range(0, len(text), size):
+        if checker.feed(text[start:start + size]):
+            return checker, start
+    return checker, None
+
+
+def test_valid_code_streams_without_error():
+    code = (
+        "```python\n"
+        "import math\n"
+        "\n"
+        "@staticmethod\n"
+        "def area(r):\n"
+        "    if r < 0:\n"
+        "        raise ValueError(r)\n"
+        "    else:\n"
+        "        return math.pi * r ** 2\n"
+        "total = (area(1) +\n"
+        "area(2)\n"
+        ")\n"
+        "print(total)\n"
+        "```\n"
+        "This explanation after the fence is ignored.\n"
+    )
+    checker, stopped_at = feed_in_chunks(code)
+    assert stopped_at is None
+    assert checker.error is None
+    assert checker.finished
+    assert checker.code.startswith("import math\n")
+    assert "explanation" not in checker.code
+
+
+def test_error_is_reported_before_the_stream_ends():
+    code = "def f(:\n    return 1\nx = 1\n" + "y = 2\n" * 100
+    checker, stopped_at = feed_in_chunks(code)
+    assert checker.error == "invalid syntax at line 1: def f(:"
+    # Stopped as soon as the next top-level line arrived, long before the end
+    assert stopped_at is not None and stopped_at < 40
+
+
+def test_unfinished_input_is_not_an_error():
+    checker = IncrementalSyntaxCheck()
+    assert checker.feed("def f(x):\n") is None
+    assert checker.feed("    return (x +\n") is None
+    assert checker.feed("            1)\n") is None
+    assert checker.feed("print(f(1))\n") is None
+
+
+def test_feed_after_an_error_keeps_returning_it():
+    checker = IncrementalSyntaxCheck()
+    checker.feed("x = = 1\ny = 2\n")
+    error = checker.error
+    assert error
+    assert checker.feed("z = 3\n") == error
+
+
+def test_syntax_error_description():
+    assert syntax_error("x = 1\n") is None
+    assert "line 2" in syntax_error("x = 1\nif x\n")
+    assert syntax_error("x = '\0'\0") is not None
+
+
+def test_check_reports_undefined_names_and_unknown_imports():
+    code = "import numpy\nimport totally_unknown_module\nprint(numpy.zeros(3), missing_name)\n"
+    assert check(code) == [
+        ('undefined_name', "name 'missing_name' is not defined at line 3"),
+        ('import', "imports 'totally_unknown_module', which is not installed and not a known package"),
+    ]
+    assert check(code.replace(', missing_name', ''), known_modules=['totally_unknown_module']) == []
+
+
+def test_dynamic_scopes_are_not_checked_for_names():
+    assert undefined_names(ast.parse("exec('y = 1')\nprint(y)\n")) == []
+    assert undefined_names(ast.parse("from os.path import *\nprint(join)\n")) == []
+
+
+def test_repair_messages_appends_the_rejected_code():
+    messages = repair_messages([{'role': 'user', 'content': 'optimize'}], 'bad', [('syntax', 'oops')])
+    assert messages[1] == {'role': 'assistant', 'content': 'bad'}
+    assert "- oops" in messages[2]['content']
+
+
+def test_delta_text_accepts_strings_and_chunks():
+    assert delta_text(types.SimpleNamespace(content='abc')) == 'abc'
+    chunks = [types.SimpleNamespace(text='a'), types.SimpleNamespace(text=None), types.SimpleNamespace(text='b')]
+    assert delta_text(types.SimpleNamespace(content=chunks)) == 'ab'
+    assert delta_text(types.SimpleNamespace(content=None)) == ''
@@ -0,0 +1,95 @@
+import gzip
+import json
+
+import pytest
+
+from response_format import accepted_encodings, encode_payload, requested_version, to_v2
+
+CODE = "import time\n" + "x = sum(range(1000))\n" * 50
+OPTIMIZED = "x = 499500\n" * 50
+OUTPUT = "499500\n" * 100
+
+PAYLOAD = {
+    'status': 'success',
+    'python_code': CODE,
+    'optimized_code': OPTIMIZED,
+    'output': OUTPUT,
+    'timeline_events': [
+        {'step': 'File Upload', 'input': CODE, 'output': 'Wrote script.py'},
+        {'step': 'Code Optimization', 'input': CODE, 'output': OPTIMIZED},
+        {'step': 'Execution', 'input': OPTIMIZED, 'output': OUTPUT},
+    ],
+}
+
+
+def expand(body):
+    """The v1 form of a v2 body, resolving every content reference"""
+    content = body['content']
+
+    def text(value):
+        return content[value] if isinstance(value, int) else value
+
+    expanded = {key: value for key, value in body.items() if key not in ('version', 'content')}
+    for field in ('python_code', 'optimized_code', 'output'):
+        expanded[field] = text(body[field])
+    expanded['timeline_events'] = [dict(event, input=text(event['input']), output=text(event['output']))
+                                   for event in body['timeline_events']]
+    return expanded
+
+
+def test_v2_stores_each_text_once():
+    body = to_v2(PAYLOAD)
+    assert body['version'] == 2
+    assert sorted(body['content']) == sorted([CODE, OPTIMIZED, OUTPUT, 'Wrote script.py'])
+    assert expand(body) == PAYLOAD
+    assert len(json.dumps(body)) < len(json.dumps(PAYLOAD)) / 2
+
+
+def test_v2_compacts_nested_job_results():
+    job = {'job_id': 'j', 'status': 'succeeded', 'result': PAYLOAD, 'error': None}
+    body = to_v2(job)
+    assert expand(body['result'] | {'content': body['content']}) == PAYLOAD
+
+
+def test_version_negotiation():
+    assert requested_version('2', '') == 2
+    assert requested_version(None, 'application/vnd.openoperator.v2+json') == 2
+    assert requested_version(None, 'application/json') == 1
+
+
+def test_refused_encodings_are_ignored():
+    assert accepted_encodings('gzip;q=0, zstd, br; q=0.5') == {'zstd', 'br'}
+
+
+def test_small_bodies_are_not_compressed():
+    body, headers = encode_payload({'status': 'ok'}, 1, '', 'gzip', min_bytes=1024)
+    assert json.loads(body) == {'status': 'ok'}
+    assert 'Content-Encoding' not in headers
+
+
+def test_gzip_round_trip():
+    body, headers = encode_payload(PAYLOAD, 1, 'application/json', 'gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(gzip.decompress(body)) == PAYLOAD
+
+
+def test_zstd_round_trip():
+    zstandard = pytest.importorskip('zstandard')
+    body, headers = encode_payload(PAYLOAD, 2, '', 'gzip, zstd')
+    assert headers['Content-Encoding'] == 'zstd'
+    assert expand(json.loads(zstandard.ZstdDecompressor().decompress(body))) == PAYLOAD
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip('msgpack')
+    body, headers = encode_payload(PAYLOAD, 2, 'application/msgpack', 'identity')
+    assert headers['Content-Type'] == 'application/msgpack'
+    assert 'Content-Encoding' not in headers
+    assert expand(msgpack.unpackb(body, raw=False)) == PAYLOAD
+
+
+def test_msgpack_is_only_offered_with_v2():
+    body, headers = encode_payload(PAYLOAD, 1, 'application/msgpack', '')
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(body) == PAYLOAD
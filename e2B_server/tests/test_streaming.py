@@ -0,0 +1,39 @@
+import io
+import json
+
+SCRIPT = b"import json\nprint(json.dumps({'total': sum(range(10))}))\n"
+
+
+def test_encode_message_framing(server):
+    message = {'type': 'output_delta', 'text': 'line\n'}
+    assert server.encode_message('ndjson', message) == json.dumps(message) + '\n'
+    assert server.encode_message('sse', message) == f"event: output_delta\ndata: {json.dumps(message)}\n\n"
+
+
+def test_ndjson_stream_starts_and_completes(server):
+    response = server.app.test_client().post(
+        '/execute?stream=ndjson', data={'python_file': (io.BytesIO(SCRIPT), 'sum.py')})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    messages = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+    types = [message['type'] for message in messages]
+    assert types[0] == 'started'
+    assert types[-1] == 'complete'
+    assert 'timeline_event' in types
+    assert 'optimized_code' in types
+    assert types.index('optimized_code') < types.index('output')
+
+
+def test_sse_stream_frames_every_message(server):
+    response = server.app.test_client().post(
+        '/execute', data={'python_file': (io.BytesIO(SCRIPT), 'sum.py')},
+        headers={'Accept': 'text/event-stream'})
+    assert response.mimetype == 'text/event-stream'
+
+    events = [block for block in response.get_data(as_text=True).split('\n\n') if block.strip()]
+    for block in events:
+        event, data = block.split('\n')
+        assert event.startswith('event: ')
+        assert json.loads(data[len('data: '):])['type'] == event[len('event: '):]
+    assert events[-1].startswith('event: complete')
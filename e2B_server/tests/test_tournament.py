@@ -0,0 +1,53 @@
+import hashlib
+import subprocess
+import types
+
+from tournament import compare_outputs, leaderboard, output_digests
+
+
+def outputs(stdout, **files):
+    return {'stdout': stdout, 'files': files}
+
+
+def test_matching_outputs_ignore_trailing_whitespace():
+    assert compare_outputs(outputs("a\nb\n", **{'out.csv': '1'}), outputs("a  \nb", **{'out.csv': '1'})) is None
+
+
+def test_stdout_differences_are_located():
+    assert compare_outputs(outputs("a\nb"), outputs("a\nc")) == "stdout differs at line 2: expected 'b', got 'c'"
+    assert compare_outputs(outputs("a\nb"), outputs("a")) == "stdout has 1 lines, the original printed 2"
+
+
+def test_file_differences_are_reported():
+    expected = outputs("", **{'a.png': '1', 'b.csv': '2'})
+    assert compare_outputs(expected, outputs("", **{'a.png': '1'})) == "did not write b.csv"
+    assert compare_outputs(expected, outputs("", **{'a.png': '1', 'b.csv': '2', 'c': '3'})) == "wrote unexpected files: c"
+    assert compare_outputs(expected, outputs("", **{'a.png': '1', 'b.csv': 'x'})) == "b.csv differs from the original's"
+
+
+def test_leaderboard_ranks_passed_candidates_by_speedup():
+    candidates = [
+        {'candidate': 1, 'status': 'failed', 'code': '...'},
+        {'candidate': 2, 'status': 'passed', 'speedup': {'value': 1.5}, 'wall_seconds': 2.0, 'code': '...'},
+        {'candidate': 3, 'status': 'passed', 'speedup': {'value': 3.0}, 'wall_seconds': 1.0, 'code': '...'},
+        {'candidate': 0, 'status': 'mismatch', 'code': '...'},
+    ]
+    board = leaderboard(candidates)
+    assert [(entry['candidate'], entry['rank']) for entry in board] == [(3, 1), (2, 2), (0, None), (1, None)]
+    assert all('code' not in entry for entry in board)
+
+
+def test_output_digests_skip_scripts_and_hidden_files(tmp_path):
+    (tmp_path / 'script.py').write_text("print(1)")
+    (tmp_path / 'result.txt').write_text("42")
+    (tmp_path / '.blobs').mkdir()
+    (tmp_path / '.blobs' / 'data').write_text("x")
+    (tmp_path / 'plots').mkdir()
+    (tmp_path / 'plots' / 'a.png').write_bytes(b"png")
+
+    def run(cmd):
+        return subprocess.run(cmd, shell=True, cwd=tmp_path, capture_output=True, text=True)
+
+    digests = output_digests(types.SimpleNamespace(commands=types.SimpleNamespace(run=run)))
+    assert sorted(digests) == ['plots/a.png', 'result.txt']
+    assert digests['result.txt'] == hashlib.sha256(b"42").hexdigest()
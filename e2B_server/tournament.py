@@ -0,0 +1,75 @@
+import json
+import shlex
+
+
+# Runs inside the sandbox: SHA-256 of every file under the working directory except the
+# scripts themselves, caches and hidden directories (the upload blob store is one)
+OUTPUT_DIGEST_SCRIPT = '''
+import hashlib, json, os, sys
+skip = set(json.loads(sys.argv[1]))
+digests = {}
+for root, dirs, files in os.walk('.'):
+    dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+    for name in files:
+        path = os.path.relpath(os.path.join(root, name))
+        if name.startswith('.') or path in skip:
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digests[path] = digest.hexdigest()
+print(json.dumps(digests))
+'''
+
+SCRIPT_FILES = ['script.py', 'optimized_script.py']
+
+
+def output_digests(sandbox):
+    """Content hashes of the files a script left in the sandbox's working directory"""
+    result = sandbox.commands.run(
+        f"python -c {shlex.quote(OUTPUT_DIGEST_SCRIPT)} {shlex.quote(json.dumps(SCRIPT_FILES))}"
+    )
+    return json.loads(result.stdout or '{}')
+
+
+def _lines(text):
+    return [line.rstrip() for line in (text or '').rstrip().splitlines()]
+
+
+def compare_outputs(expected, actual):
+    """Why a candidate's stdout and files differ from the original's, or None if they match.
+
+    Both arguments are {'stdout': ..., 'files': {path: sha256}}. Trailing whitespace is
+    ignored, anything else counts.
+    """
+    expected_lines, actual_lines = _lines(expected['stdout']), _lines(actual['stdout'])
+    if expected_lines != actual_lines:
+        for number, (want, got) in enumerate(zip(expected_lines, actual_lines), start=1):
+            if want != got:
+                return f"stdout differs at line {number}: expected {want[:80]!r}, got {got[:80]!r}"
+        return f"stdout has {len(actual_lines)} lines, the original printed {len(expected_lines)}"
+
+    missing = sorted(set(expected['files']) - set(actual['files']))
+    if missing:
+        return f"did not write {', '.join(missing[:3])}"
+    extra = sorted(set(actual['files']) - set(expected['files']))
+    if extra:
+        return f"wrote unexpected files: {', '.join(extra[:3])}"
+    changed = sorted(path for path in expected['files'] if expected['files'][path] != actual['files'][path])
+    if changed:
+        return f"{', '.join(changed[:3])} {'differs' if len(changed) == 1 else 'differ'} from the original's"
+    return None
+
+
+def leaderboard(candidates):
+    """Candidates ordered best first: verified ones by speedup, then everything that dropped out"""
+    def key(entry):
+        if entry['status'] == 'passed':
+            return (0, -entry['speedup']['value'], entry['wall_seconds'])
+        return (1, 0, entry['candidate'])
+
+    ranked = sorted(candidates, key=key)
+    for rank, entry in enumerate(ranked, start=1):
+        entry['rank'] = rank if entry['status'] == 'passed' else None
+    return [{key: value for key, value in entry.items() if key != 'code'} for entry in ranked]
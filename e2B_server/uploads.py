@@ -0,0 +1,122 @@
+import hashlib
+import os
+import shlex
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from flask import Request
+
+
+# Outside the shared .openoperator directory, and removed by every backend's reset_command:
+# one run's data must never be readable by the next script in a pooled sandbox, so
+# content is only deduplicated within a run
+REMOTE_BLOB_ROOT = '/home/user/.openoperator-blobs'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingSpool:
+    """Spool file for uploads that hashes the bytes while werkzeug writes them.
+
+    Small uploads stay in memory, larger ones roll over to a temporary file, so a
+    multi-gigabyte dataset never sits in worker memory.
+    """
+
+    def __init__(self, max_size=CHUNK_SIZE):
+        self._file = SpooledTemporaryFile(max_size=max_size)
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """Flask request whose uploaded files are hashed while they are being received"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool()
+
+
+def file_digest(data_file):
+    """SHA-256 of an uploaded file; free when it was received through UploadRequest"""
+    stream = data_file.stream
+    if isinstance(stream, HashingSpool):
+        return stream.hexdigest(), stream.size
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def upload_data_files(sandbox, data_files, workers=4, remote_dir='data', blob_root=REMOTE_BLOB_ROOT):
+    """Copy uploaded files into the sandbox, skipping content the sandbox already holds.
+
+    Files are stored once per content hash under `blob_root` and copied into `remote_dir`,
+    so a file uploaded twice in a run is sent once. They are sent in parallel, straight
+    from their spool streams. Returns one dict per file with its name, size, hash and
+    whether it was sent or reused.
+
+    Blobs are not reused across runs: every pool reset wipes `blob_root`. The server has
+    no tenant or session to key a shared cache by, and the sandbox user can sudo, so a
+    blob kept for a later run would be open to whatever script that run executes.
+    """
+    entries = []
+    for data_file in data_files:
+        digest, size = file_digest(data_file)
+        entries.append({
+            'name': os.path.basename(data_file.filename),
+            'hash': digest,
+            'size': size,
+            'file': data_file
+        })
+
+    # One round trip to learn which blobs are already in the sandbox
+    digests = sorted({entry['hash'] for entry in entries})
+    check = (
+        f'mkdir -p {shlex.quote(blob_root)} {shlex.quote(remote_dir)} && cd {shlex.quote(blob_root)} && '
+        f'for d in {" ".join(digests)}; do test -f "$d" && echo "$d"; done; true'
+    )
+    present = set(sandbox.commands.run(check).stdout.split())
+
+    missing = {}
+    for entry in entries:
+        entry['reused'] = entry['hash'] in present
+        if not entry['reused']:
+            missing.setdefault(entry['hash'], entry)
+
+    def send(entry):
+        stream = entry['file'].stream
+        stream.seek(0)
+        partial = f'{blob_root}/.partial-{uuid.uuid4().hex}'
+        sandbox.files.write(partial, stream)
+        sandbox.commands.run(f'mv {shlex.quote(partial)} {shlex.quote(blob_root)}/{entry["hash"]}')
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(workers, len(missing)), thread_name_prefix='upload') as executor:
+            list(executor.map(send, missing.values()))
+
+    # Scripts get private copies so they can never modify the shared blob
+    copies = ' && '.join(
+        f'cp {shlex.quote(blob_root)}/{entry["hash"]} {shlex.quote(remote_dir + "/" + entry["name"])}'
+        for entry in entries
+    )
+    if copies:
+        sandbox.commands.run(copies)
+
+    return [{key: entry[key] for key in ('name', 'hash', 'size', 'reused')} for entry in entries]